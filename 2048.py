@@ -1,9 +1,31 @@
-from handlers import bot
-from database import init_db
-from config import logger
+import signal
+from handlers import bot, game_state
+from database import init_db, close_db
+from broadcast import resume_broadcasts
+from hints import close_hints
+from verify import score_verifier
+from writer import db_writer
+from config import logger, BOT_MODE
+from metrics import start_metrics_server
+from webhook import run_webhook
 
 if __name__ == "__main__":
     logger.info("Initializing database...")
     init_db()
+    resume_broadcasts(bot)
+    start_metrics_server()
     logger.info("Starting bot...")
-    bot.polling(non_stop=True)
+    try:
+        if BOT_MODE == "webhook":
+            run_webhook(bot)
+        else:
+            # Stop polling on SIGTERM too, so queued writes are flushed below
+            signal.signal(signal.SIGTERM, lambda *_: bot.stop_polling())
+            bot.polling(non_stop=True)
+    finally:
+        logger.info("Saving active games...")
+        close_hints()
+        game_state.close()
+        score_verifier.close()
+        db_writer.close()
+        close_db()
@@ -0,0 +1,399 @@
+"""The bot on AsyncTeleBot: one event loop serves every user, SQLite runs on the database executor
+
+Run with: python async_bot.py (2048.py stays the threaded entry point)
+"""
+import asyncio
+import signal
+import threading
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+from config import (
+    TOKEN, ADMIN_USER_IDS, logger, BOT_MODE, ASYNC_HTTP_CONNECTIONS,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+)
+from broadcast import start_broadcast_async, resume_broadcasts_async
+from callbacks import CallbackRouter, encode, SHOW_LEVELS, EASY, MEDIUM, HARD, DUMMY, UP, DOWN, LEFT, RIGHT, END, CONFIRM_END, CANCEL_END, NEW_GAME, HINT, MODE
+from database import init_db, close_db, run_db
+from game import get_score, move_up, move_left, move_right, move_down, is_game_over
+from hints import request_hint_async, close_hints
+from render import game_message, edit_message_async, render_leaderboard, render_rank, render_stats, hint_text
+from sessions import GameSession, create_session_store
+from metrics import instrument_bot, start_metrics_server
+from utils import is_message_valid, check_rate_limit, rate_limiter
+from verify import score_verifier
+from writer import db_writer
+
+# Every handler shares one aiohttp session, this caps its keep-alive connection pool
+asyncio_helper.REQUEST_LIMIT = ASYNC_HTTP_CONNECTIONS
+
+bot = AsyncTeleBot(TOKEN)
+
+# Active games, kept in memory or persisted depending on SESSION_BACKEND
+game_state = create_session_store()
+
+# Routes every callback query through one parse and a dict lookup
+router = CallbackRouter()
+
+# Admins whose next text message is the broadcast, AsyncTeleBot has no next step handlers
+awaiting_broadcast = set()
+
+async def allow(message):
+    """Drop old messages and rate limited users, telling the latter why"""
+    if not is_message_valid(message):
+        return False
+    user_id = message.from_user.id
+    allowed, error_message = await run_db(check_rate_limit, user_id)
+    if not allowed:
+        await bot.send_message(user_id, error_message)
+    return allowed
+
+def game_over_markup():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("بازی جدید", callback_data=encode(NEW_GAME)))
+    return markup
+
+@bot.message_handler(commands=['start'])
+async def send_welcome(message):
+    """Handle /start command to welcome the user and initiate the game"""
+    user = message.from_user.first_name
+    if not await allow(message):
+        return
+    db_writer.save_user(message.from_user.id, user)
+
+    welcome_message = (
+        f"سلام {user} عزیز! 😊\n"
+        f"به ربات بازی 2048 خوش اومدی  ،  نمیدونم چقد با بازی آشنایی  ،  اما اگه از قوانین بازی خیلی نمیدونی روی /rules  کلیک کن تا قوانین بهت نشون داده بشن  \n\n"
+        f"همچنین میتونی برای دیدن امتیاز نفرات برتر از دستور /leaderboard 🥇 و برای دیدن رتبه خودت از /rank استفاده کنی\n\n"
+        "هر موقع آماده بودی ، روی دکمه شروع بازی بزن تا وارد بازی بشیم"
+    )
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data=encode(SHOW_LEVELS)))
+    await bot.send_message(message.chat.id, welcome_message, reply_markup=markup)
+
+@bot.message_handler(commands=['rules'])
+async def send_rules(message):
+    """Handle /rules command to display game rules"""
+    if not await allow(message):
+        return
+    rules_message = (
+        "🎲 **قوانین و روش بازی ۲۰۴۸** 🎲\n\n"
+        "هدف بازی اینه که با جابه‌جا کردن کاشی‌ها، به عدد ۲۰۴۸ برسی!\n"
+        "چجوری؟ اینجوری:\n"
+        "1️⃣ با دکمه‌های جهت‌دار (↑ ↓ ← →) کاشی‌ها رو حرکت بده.\n"
+        "2️⃣ کاشی‌های با عدد یکسان که کنار هم قرار بگیرن، با هم جمع می‌شن (مثلاً ۲+۲=۴).\n"
+        "3️⃣ بعد از هر حرکت، یه کاشی جدید (۲ یا ۴) تو جدول ظاهر می‌شه.\n"
+        "4️⃣ اگه به ۲۰۴۸ برسی، برنده می‌شی! ولی اگه جدول پر بشه و دیگه حرکتی نداشته باشی، می‌بازی.\n\n"
+        "امتیازت هم بزرگ‌ترین عدد تو جدوله! آماده‌ای بهترین خودت رو نشون بدی؟ 😎"
+    )
+    await bot.send_message(message.chat.id, rules_message, parse_mode='Markdown')
+
+@bot.message_handler(commands=['leaderboard'])
+async def show_leaderboard(message):
+    """Handle /leaderboard command to show top players"""
+    if not await allow(message):
+        return
+    message_text = await run_db(render_leaderboard)
+    if message_text is None:
+        await bot.send_message(message.chat.id, "هنوز هیچ‌کس امتیازی ثبت نکرده!")
+        return
+    await bot.send_message(message.chat.id, message_text, parse_mode='Markdown')
+
+@bot.message_handler(commands=['rank'])
+async def show_rank(message):
+    """Handle /rank command to show the user's position on each leaderboard"""
+    if not await allow(message):
+        return
+    message_text = await run_db(render_rank, message.from_user.id)
+    if message_text is None:
+        await bot.send_message(message.chat.id, "هنوز امتیازی ثبت نکردی! یه بازی رو تموم کن تا رتبه‌ات مشخص بشه.")
+        return
+    await bot.send_message(message.chat.id, message_text)
+
+@bot.message_handler(commands=['alive'])
+async def send_alive_status(message):
+    """Handle /alive command to check bot status"""
+    await bot.send_message(message.chat.id, "I'm alive and kicking! 🤖 2048Bot is here!")
+
+@bot.message_handler(commands=['stats'])
+async def send_stats(message):
+    """Handle /stats command to show latency and error metrics to admins"""
+    if message.chat.id not in ADMIN_USER_IDS:
+        await bot.send_message(message.chat.id, "این قابلیت فقط برای ادمین‌ها در دسترسه!")
+        return
+    await bot.send_message(message.chat.id, await run_db(render_stats))
+
+@bot.message_handler(func=lambda message: message.text == "پیام همگانی 📢")
+async def handle_broadcast(message):
+    """Handle broadcast command for admins"""
+    if not is_message_valid(message):
+        return
+    user_id = message.chat.id
+    if user_id not in ADMIN_USER_IDS:
+        await bot.send_message(user_id, "این قابلیت فقط برای ادمین‌ها در دسترسه!")
+        return
+    logger.info(f"Broadcast initiated by admin {user_id}")
+    awaiting_broadcast.add(user_id)
+    await bot.send_message(user_id, "هر پیامی که می‌خوای بنویس تا برای همه کاربران ارسال بشه 📢")
+
+@bot.message_handler(func=lambda message: message.chat.id in awaiting_broadcast, content_types=['text'])
+async def send_broadcast(message):
+    """Send broadcast message to all users"""
+    user_id = message.chat.id
+    awaiting_broadcast.discard(user_id)
+    if not is_message_valid(message) or user_id not in ADMIN_USER_IDS:
+        return
+    await bot.send_message(user_id, "ارسال پیام همگانی شروع شد، پیشرفتش رو همینجا می‌بینی 📢")
+    await start_broadcast_async(bot, user_id, message.text)
+
+@bot.message_handler(content_types=['text'])
+async def handle_message(message):
+    """Handle general text messages with rate limiting"""
+    await allow(message)
+
+@router.route(SHOW_LEVELS)
+async def handle_show_levels(call):
+    """Show difficulty level selection menu"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("آسون (۵×۵)", callback_data=encode(EASY)))
+    markup.add(types.InlineKeyboardButton("متوسط (۷×۷)", callback_data=encode(MEDIUM)))
+    markup.add(types.InlineKeyboardButton("سخت (۹×۹)", callback_data=encode(HARD)))
+    await edit_message_async(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        text="میخوای بازی تو چه سطحی باشه ؟ در واقع این میزان بزرگ یا کوچیک بودن جدول بازی رو مشخص میکنه",
+        reply_markup=markup
+    )
+    await bot.answer_callback_query(call.id)
+
+async def handle_level_selection(call, size):
+    """Handle difficulty level selection and start the game"""
+    user_id = str(call.from_user.id)
+    session = GameSession.start(size, call.from_user.first_name)
+    board = session.board
+    # Storing a game only touches memory, SQLite writes happen in the store's flusher thread
+    game_state[user_id] = session
+    await edit_message_async(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        **game_message(board, user_id, f"بازی شروع شد!\nامتیاز: {get_score(board)} | زمان: {session.elapsed()} ثانیه", session.text_mode)
+    )
+    await bot.answer_callback_query(call.id)
+
+@router.route(DUMMY)
+async def handle_dummy_tiles(call):
+    """Handle clicks on game board tiles or dummy buttons"""
+    await bot.answer_callback_query(call.id, text="این دکمه‌ها نمایشین!", show_alert=True)
+
+@router.route(END)
+async def handle_end_game_prompt(call):
+    """Prompt user to confirm ending the game"""
+    user_id = str(call.from_user.id)
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("آره", callback_data=encode(CONFIRM_END, user_id)),
+        types.InlineKeyboardButton("نه", callback_data=encode(CANCEL_END))
+    )
+    await edit_message_async(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        text="مطمئنی که میخوای بازی رو تموم بکنی ؟ ",
+        reply_markup=markup
+    )
+    await bot.answer_callback_query(call.id)
+
+@router.route(CONFIRM_END)
+async def handle_confirm_end_game(call):
+    """Handle confirmed game end and save score"""
+    user_id = str(call.from_user.id)
+    # Loading a game may read SQLite when the sqlite session backend is on
+    session = await run_db(game_state.get, user_id)
+    # Another press of this user may have ended the game while this one waited for the store
+    if session is None or not game_state.holds(user_id, session):
+        await bot.answer_callback_query(call.id, text="اطلاعات بازی شما پیدا نشد.", show_alert=True)
+        return
+    score = session.score
+    elapsed_time = session.elapsed()
+    game_state.pop(user_id, None)
+    score_verifier.submit(user_id, call.from_user.first_name, session, elapsed_time)
+    await edit_message_async(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        text=f"بازی تموم شد !\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه",
+        reply_markup=game_over_markup()
+    )
+    await bot.answer_callback_query(call.id)
+
+@router.route(CANCEL_END)
+async def handle_noop(call):
+    """Handle cancellation of game end prompt"""
+    user_id = str(call.from_user.id)
+    session = await run_db(game_state.get, user_id)
+    if session is None:
+        await bot.send_message(call.message.chat.id, "برای شروع یک بازی جدید، /start را بزنید.")
+    else:
+        board = session.board
+        await edit_message_async(
+            bot,
+            call.message.chat.id,
+            call.message.message_id,
+            **game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {get_score(board)} | زمان: {session.elapsed()} ثانیه", session.text_mode)
+        )
+    await bot.answer_callback_query(call.id)
+
+@router.route(NEW_GAME)
+async def handle_new_game(call):
+    """Handle starting a new game"""
+    welcome_message = (
+        f"سلام دوباره {call.from_user.first_name} جان! 😍\n"
+        "مرسی که برگشتی، یه بازی جدید شروع کنیم؟"
+    )
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data=encode(SHOW_LEVELS)))
+    await edit_message_async(bot, call.message.chat.id, call.message.message_id, text=welcome_message, reply_markup=markup)
+    await bot.answer_callback_query(call.id)
+
+async def handle_game_moves(call, move):
+    """Handle game movement actions (up, down, left, right)"""
+    user_id = str(call.from_user.id)
+    session = await run_db(game_state.get, user_id)
+    # Another press of this user may have ended the game while this one waited for the store
+    if session is None or not game_state.holds(user_id, session):
+        await bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
+        return
+
+    # No await from the check above to the end of the move, so a concurrent press can't interleave
+    if not session.play(move):
+        await bot.answer_callback_query(call.id, text="حرکتی امکان‌پذیر نیست! ", show_alert=True)
+        return
+    board = session.board
+    user_name = call.from_user.first_name
+    session.name = user_name
+    game_state.save(user_id)
+    score = get_score(board)
+    elapsed_time = session.elapsed()
+
+    if 2048 in [num for row in board for num in row]:
+        game_state.pop(user_id, None)
+        score_verifier.submit(user_id, user_name, session, elapsed_time)
+        message = {"text": f"شما برنده شدید! 💥\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه", "reply_markup": game_over_markup()}
+    elif is_game_over(board):
+        game_state.pop(user_id, None)
+        score_verifier.submit(user_id, user_name, session, elapsed_time)
+        message = {"text": f"بازی تموم شد، شما باختید! ❌\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه", "reply_markup": game_over_markup()}
+    else:
+        message = game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه", session.text_mode)
+    await edit_message_async(bot, call.message.chat.id, call.message.message_id, **message)
+    await bot.answer_callback_query(call.id)
+
+@router.route(HINT)
+async def handle_hint(call):
+    """Answer with the move the hint search suggests, searched off the event loop"""
+    user_id = str(call.from_user.id)
+    session = await run_db(game_state.get, user_id)
+    if session is None:
+        await bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
+        return
+    direction = await request_hint_async(user_id, session.board)
+    await bot.answer_callback_query(call.id, text=hint_text(direction))
+
+@router.route(MODE)
+async def handle_mode_switch(call):
+    """Switch the game between tile buttons and the board drawn as text"""
+    user_id = str(call.from_user.id)
+    session = await run_db(game_state.get, user_id)
+    if session is None:
+        await bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
+        return
+    session.text_mode = not session.text_mode
+    game_state.save(user_id)
+    board = session.board
+    await edit_message_async(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        **game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {get_score(board)} | زمان: {session.elapsed()} ثانیه", session.text_mode)
+    )
+    await bot.answer_callback_query(call.id)
+
+router.add(EASY, lambda call: handle_level_selection(call, 5))
+router.add(MEDIUM, lambda call: handle_level_selection(call, 7))
+router.add(HARD, lambda call: handle_level_selection(call, 9))
+router.add(UP, lambda call: handle_game_moves(call, move_up))
+router.add(DOWN, lambda call: handle_game_moves(call, move_down))
+router.add(LEFT, lambda call: handle_game_moves(call, move_left))
+router.add(RIGHT, lambda call: handle_game_moves(call, move_right))
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    """Dispatch every callback query through the router"""
+    handler = router.resolve(call)
+    if handler is None:
+        await bot.answer_callback_query(call.id, text="برای شروع یک بازی جدید، /start را بزنید.")
+        return
+    await handler(call)
+
+# Registered last so every handler above is timed
+instrument_bot(bot, router, game_state, rate_limiter)
+
+
+async def serve_webhook(stop):
+    """Feed webhook POSTs into the event loop until stop is set"""
+    from webhook import WebhookServer
+    loop = asyncio.get_running_loop()
+    limit = WEBHOOK_WORKERS * WEBHOOK_QUEUE_SIZE
+    pending = set()
+    lock = threading.Lock()
+
+    def submit(update):
+        # Called on the HTTP server's threads, beyond `limit` unfinished updates Telegram is asked to retry
+        with lock:
+            if len(pending) >= limit:
+                logger.warning(f"{limit} updates in progress, asking Telegram to retry update {update.get('update_id')}")
+                return False
+            future = asyncio.run_coroutine_threadsafe(bot.process_new_updates([types.Update.de_json(update)]), loop)
+            pending.add(future)
+        future.add_done_callback(lambda done: pending.discard(done))
+        return True
+
+    server = WebhookServer(submit)
+    server.start()
+    await bot.remove_webhook()
+    await bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None, max_connections=100)
+    logger.info(f"Async webhook listening on port {server.port}{WEBHOOK_PATH}")
+    await stop.wait()
+    await loop.run_in_executor(None, server.stop)
+    while pending:
+        await asyncio.sleep(0.1)
+
+async def main():
+    await run_db(init_db)
+    start_metrics_server()
+    await resume_broadcasts_async(bot)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    logger.info("Starting async bot...")
+    try:
+        if BOT_MODE == "webhook":
+            await serve_webhook(stop)
+        else:
+            polling = asyncio.create_task(bot.polling(non_stop=True))
+            await stop.wait()
+            polling.cancel()
+    finally:
+        logger.info("Saving active games...")
+        if asyncio_helper.session_manager.session is not None:
+            await bot.close_session()
+        close_hints()
+        game_state.close()
+        score_verifier.close()
+        db_writer.close()
+        close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
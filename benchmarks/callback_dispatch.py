@@ -0,0 +1,71 @@
+"""Compare the cost of routing one callback query: telebot's predicate chain vs CallbackRouter
+
+Run with: python -m benchmarks.callback_dispatch
+"""
+import argparse
+import random
+from timeit import timeit
+from types import SimpleNamespace
+from callbacks import CallbackRouter, encode, SHOW_LEVELS, EASY, MEDIUM, HARD, DUMMY, UP, DOWN, LEFT, RIGHT, END, CONFIRM_END, CANCEL_END, NEW_GAME
+
+USER_ID = 123456789
+# Roughly what players send: mostly moves, a few menu and tile presses
+LEGACY_MIX = ["up", "down", "left", "right"] * 20 + ["tile_3_4", "dummy", "end", "confirm_end", "noop", "new_game", "show_levels", "easy"]
+COMPACT_MIX = [UP, DOWN, LEFT, RIGHT] * 20 + [DUMMY, DUMMY, END, CONFIRM_END, CANCEL_END, NEW_GAME, SHOW_LEVELS, EASY]
+OWNED = {"up", "down", "left", "right", "tile_3_4", "end", "confirm_end"}
+OWNED_COMPACT = {UP, DOWN, LEFT, RIGHT, END, CONFIRM_END}
+
+
+def _call(data):
+    return SimpleNamespace(data=data, from_user=SimpleNamespace(id=USER_ID))
+
+def _noop(call):
+    return None
+
+def legacy_chain():
+    """The callback_query_handler filters of handlers.py before the router, in registration order"""
+    return [
+        (lambda call: call.data == "show_levels", _noop),
+        (lambda call: call.data in ["easy", "medium", "hard"], _noop),
+        (lambda call: call.data.startswith("tile_") or call.data == "dummy", _noop),
+        (lambda call: call.data.startswith("end_"), _noop),
+        (lambda call: call.data.startswith("confirm_end_"), _noop),
+        (lambda call: call.data == "noop", _noop),
+        (lambda call: call.data == "new_game", _noop),
+        (lambda call: call.data.endswith("_" + str(call.from_user.id)), _noop),
+    ]
+
+def legacy_dispatch(chain, call):
+    # telebot tests every handler's func in order until one matches
+    for func, handler in chain:
+        if func(call):
+            return handler(call)
+
+def compact_router():
+    router = CallbackRouter()
+    for action in (SHOW_LEVELS, EASY, MEDIUM, HARD, DUMMY, UP, DOWN, LEFT, RIGHT, END, CONFIRM_END, CANCEL_END, NEW_GAME):
+        router.add(action, _noop)
+    return router
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark callback dispatch")
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=2048)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    legacy = [_call(f"{data}_{USER_ID}" if data in OWNED else data) for data in rng.choices(LEGACY_MIX, k=args.calls)]
+    compact = [_call(encode(data, USER_ID) if data in OWNED_COMPACT else encode(data)) for data in rng.choices(COMPACT_MIX, k=args.calls)]
+    old_style = [_call(call.data) for call in legacy]
+
+    chain = legacy_chain()
+    router = compact_router()
+    results = {
+        "predicate chain": timeit(lambda: [legacy_dispatch(chain, call) for call in legacy], number=1),
+        "router, compact data": timeit(lambda: [router.dispatch(call) for call in compact], number=1),
+        "router, legacy data": timeit(lambda: [router.dispatch(call) for call in old_style], number=1),
+    }
+    for name, seconds in results.items():
+        print(f"{name:<22} {seconds / args.calls * 1e9:8.0f} ns/callback")
+
+if __name__ == "__main__":
+    main()
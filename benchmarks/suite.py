@@ -0,0 +1,251 @@
+"""Microbenchmarks of the game, rendering and database hot paths, with a baseline compare mode
+
+Run with: python -m benchmarks.suite --output bench.json
+          python -m benchmarks.suite --compare bench.json   (exit code 1 on a slowdown)
+Every case uses fixed seeds, so two runs on one machine measure the same work.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from timeit import Timer
+import database
+import game
+from database import ConnectionManager
+from ranking import RankIndex
+from render import build_game_keyboard, game_message, tile_row_json
+from sessions import GameSession, encode_board
+from verify import append_move, replay
+from writer import WriteBehindWriter
+
+SIZES = (5, 7, 9)
+# Share of non-empty cells, "full" is a full board without any merge (the worst case for is_game_over)
+FILLS = (0.25, 0.5, 0.9, "full")
+LEADERBOARD_ROWS = (1_000, 100_000, 1_000_000)
+SEED = 2048
+
+
+def make_board(size, fill, seed=SEED):
+    """Board with the given share of tiles, exponents 1-10 drawn from a seeded generator"""
+    if fill == "full":
+        # Horizontal neighbours differ by 1 and vertical ones by 3 (mod 10), so nothing merges
+        return [[1 << ((3 * i + j) % 10 + 1) for j in range(size)] for i in range(size)]
+    rng = random.Random(f"{seed}:{size}:{fill}")
+    board = [[0] * size for _ in range(size)]
+    for cell in rng.sample(range(size * size), round(size * size * fill)):
+        board[cell // size][cell % size] = 1 << rng.randint(1, 10)
+    return board
+
+def copy_board(board):
+    return [row[:] for row in board]
+
+
+def game_cases():
+    """Moves, game over checks and tile spawns; moves and spawns include copying the board"""
+    for size in SIZES:
+        for fill in FILLS:
+            board = make_board(size, fill)
+            label = f"{size}x{size}@{fill}"
+            for name in ("move_left", "move_right", "move_up", "move_down"):
+                move = getattr(game, name)
+                yield f"game.{name}[{label}]", lambda move=move, board=board: move(copy_board(board))
+            yield f"game.is_game_over[{label}]", lambda board=board: game.is_game_over(board)
+            yield f"game.add_random_tile[{label}]", lambda board=board: game.add_random_tile(copy_board(board))
+        yield f"game.copy_board[{size}x{size}]", lambda board=make_board(size, 0.5): copy_board(board)
+
+def render_cases():
+    """Keyboard JSON as sent to Telegram, with the tile row cache warm and cold"""
+    for size in SIZES:
+        board = make_board(size, 0.5)
+
+        def cold(board=board):
+            tile_row_json.cache_clear()
+            return build_game_keyboard(board, 123456789).to_json()
+
+        yield f"render.build_game_keyboard[{size}x{size},warm]", lambda board=board: build_game_keyboard(board, 123456789).to_json()
+        yield f"render.build_game_keyboard[{size}x{size},cold]", cold
+        yield f"render.game_message[{size}x{size},text]", lambda board=board: game_message(board, 123456789, "bench", True)
+        session = GameSession(size, encode_board(board), name="bench")
+        yield f"sessions.GameSession.board[{size}x{size},roundtrip]", lambda session=session: setattr(session, "board", session.board)
+
+def logged_game(size, moves, seed=SEED):
+    """(seed, move log, move count) of a game of random moves, as GameSession.play logs it"""
+    rng = random.Random(f"{seed}:moves:{size}")
+    session = GameSession.start(size, "bench", seed=seed)
+    while session.move_count < moves:
+        if not session.play(rng.choice(game.MOVES)) and game.is_game_over(session.board):
+            break
+    return session.seed, bytes(session.moves), session.move_count
+
+def verify_cases():
+    """Replaying a move log the way verify.py checks a finished game"""
+    for size in SIZES:
+        seed, log, count = logged_game(size, 500)
+        yield f"verify.replay[{size}x{size},{count} moves]", lambda size=size, seed=seed, log=log, count=count: replay(size, seed, log, count)
+
+    def write_log(moves=500):
+        log = bytearray()
+        for k in range(moves):
+            append_move(log, k, k & 3)
+        return log
+
+    yield "verify.append_move[500 moves]", write_log
+
+
+def fill_database(path, rows):
+    """Create the schema in a fresh file and insert `rows` users and leaderboard entries"""
+    manager = ConnectionManager(path)
+    database.init_db(manager)
+    rng = random.Random(f"{SEED}:{rows}")
+    with manager.transaction() as cursor:
+        cursor.executemany("INSERT INTO users (id, username) VALUES (?, ?)", ((i, f"user{i}") for i in range(1, rows + 1)))
+        cursor.executemany(
+            "INSERT INTO leaderboard (user_id, name, score, time) VALUES (?, ?, ?, ?)",
+            ((i, f"user{i}", 1 << rng.randint(3, 11), rng.randint(10, 5000)) for i in range(1, rows + 1)),
+        )
+    return manager
+
+def database_cases(rows, directory):
+    """database.py functions against users and leaderboard tables of `rows` rows, in their own file
+
+    Every case passes the manager of that file, the process-wide database.db is never touched.
+    """
+    manager = fill_database(os.path.join(directory, f"bench-{rows}.db"), rows)
+    rng = random.Random(f"{SEED}:ops:{rows}")
+    new_users = iter(range(rows + 1, sys.maxsize))
+    scores = iter(range(1 << 12, sys.maxsize))
+
+    def save_score():
+        # One game end as the writer saves it: a rising score, so both upserts really update their row
+        user_id, score = rng.randint(1, rows), next(scores)
+        database.save_batch([], [], [(user_id, "bench", score, 100, 5)], [(user_id, "bench", score, 100)], manager=manager)
+
+    # Its flush thread would keep writing during later sizes' timings, so it stops with this size
+    writer = WriteBehindWriter(flush_interval=3600, manager=manager)
+    try:
+        yield f"database.get_top_n[{rows}]", lambda: database.get_top_n(manager=manager)
+        yield f"database.save_batch[{rows},one score]", save_score
+        yield f"database.save_user[{rows},existing]", lambda: database.save_user(rng.randint(1, rows), "bench", manager)
+        yield f"database.save_user[{rows},new]", lambda: database.save_user(next(new_users), "bench", manager)
+        writer.save_user(1, "bench")
+        yield f"writer.save_user[{rows},known]", lambda: writer.save_user(1, "bench")
+        yield f"database.count_users[{rows}]", lambda: database.count_users(manager)
+        yield f"database.get_pending_broadcast_users[{rows},first page]", lambda: database.get_pending_broadcast_users(
+            1, None, 500, manager
+        )
+        if rows <= 100_000:
+            yield f"database.get_leaderboard[{rows}]", lambda: database.get_leaderboard(manager)
+
+        ranks = RankIndex(manager)
+        ranks.rank(1)
+        yield f"ranking.rank[{rows}]", lambda: ranks.rank(rng.randint(1, rows))
+
+        def count_rank():
+            # What /rank would cost as a query, for comparison
+            score, time_value = manager.connection().execute(
+                "SELECT score, time FROM leaderboard WHERE user_id = ?", (rng.randint(1, rows),)
+            ).fetchone()
+            return manager.connection().execute(
+                "SELECT COUNT(*) FROM leaderboard WHERE score > ? OR (score = ? AND time < ?)", (score, score, time_value)
+            ).fetchone()[0] + 1
+        yield f"database.rank_by_count[{rows}]", count_rank
+    finally:
+        writer.close()
+        manager.close_all()
+
+
+def measure(func, min_time, repeat):
+    """Best time per call over `repeat` runs, each long enough to last about min_time seconds"""
+    timer = Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number, number
+
+def run_suite(cases, min_time, repeat, pattern=None):
+    results = {}
+    for name, func in cases:
+        if pattern and pattern not in name:
+            continue
+        random.seed(SEED)
+        seconds, number = measure(func, min_time, repeat)
+        results[name] = {"ns_per_op": round(seconds * 1e9, 1), "ops": number}
+        print(f"{name:<64} {seconds * 1e9:>14,.0f} ns")
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": SEED,
+    }
+
+def compare(results, baseline, threshold):
+    """Print old vs new per case, return the names that got slower by more than threshold"""
+    slower = []
+    print(f"\n{'case':<64} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<64} {'-':>12} {result['ns_per_op']:>12,.0f}      new")
+            continue
+        change = result["ns_per_op"] / before["ns_per_op"] - 1
+        flag = ""
+        if change > threshold:
+            slower.append(name)
+            flag = "  SLOWER"
+        print(f"{name:<64} {before['ns_per_op']:>12,.0f} {result['ns_per_op']:>12,.0f} {change:>+8.0%}{flag}")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark game, rendering and database hot paths")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown that counts as a regression (0.15 = 15%%)")
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="shorter timing runs and no 1M row tables")
+    args = parser.parse_args()
+
+    min_time, repeat = (0.05, 3) if args.quick else (0.2, 5)
+    cases = [*game_cases(), *render_cases(), *verify_cases()]
+    results = run_suite(cases, min_time, repeat, args.filter)
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        for rows in LEADERBOARD_ROWS:
+            if args.quick and rows > 100_000:
+                continue
+            # Filling the tables is slow, so skip it unless a database case can match the filter
+            if args.filter and not args.filter.startswith(("database", "writer", "ranking")):
+                continue
+            print(f"Filling tables with {rows:,} rows...")
+            results.update(run_suite(database_cases(rows, directory), min_time, repeat, args.filter))
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            raise SystemExit(f"{len(slower)} cases are more than {args.threshold:.0%} slower than {args.compare}")
+        print(f"No case is more than {args.threshold:.0%} slower than {args.compare}")
+
+if __name__ == "__main__":
+    main()
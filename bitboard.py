@@ -0,0 +1,229 @@
+import random
+from game import (
+    init_board as list_init_board,
+    add_random_tile as list_add_random_tile,
+    move_up as list_move_up,
+    move_down as list_move_down,
+    move_left as list_move_left,
+    move_right as list_move_right,
+    is_game_over as list_is_game_over,
+)
+
+# Every cell holds a tile exponent (0 = empty, 1 = 2, 2 = 4, ... 11 = 2048)
+CELL_BITS = 4
+CELL_MASK = (1 << CELL_BITS) - 1
+MAX_EXPONENT = CELL_MASK
+SIZES = (5, 7, 9)
+
+# Row transition tables, one pair per board size: packed row -> (packed row, moved)
+# 16^size rows can't be enumerated for 7x7 and 9x9, so every table is filled the
+# first time a row shows up and reused for every board of that size after that.
+MAX_TABLE_ROWS = 1 << 20
+_left_tables = {size: {} for size in SIZES}
+_right_tables = {size: {} for size in SIZES}
+
+
+class BitBoard:
+    """Game board stored as one packed int of tile exponents per row"""
+    __slots__ = ("size", "rows")
+
+    def __init__(self, size, rows=None):
+        self.size = size
+        self.rows = list(rows) if rows is not None else [0] * size
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.size == other.size and self.rows == other.rows
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"BitBoard({self.size}, {self.to_lists()})"
+
+    def get(self, i, j):
+        return (self.rows[i] >> (CELL_BITS * j)) & CELL_MASK
+
+    def set(self, i, j, exponent):
+        shift = CELL_BITS * j
+        self.rows[i] = (self.rows[i] & ~(CELL_MASK << shift)) | (exponent << shift)
+
+    def to_lists(self):
+        """Return the board as a list of lists of tile values"""
+        return [[1 << e if e else 0 for e in unpack_row(row, self.size)] for row in self.rows]
+
+    @classmethod
+    def from_lists(cls, board):
+        """Build a packed board from a list of lists of tile values"""
+        return cls(len(board), [pack_row([value.bit_length() - 1 if value else 0 for value in row]) for row in board])
+
+
+def pack_row(exponents):
+    """Pack a list of tile exponents into an int, first cell in the lowest bits"""
+    row = 0
+    for j, exponent in enumerate(exponents):
+        row |= exponent << (CELL_BITS * j)
+    return row
+
+def unpack_row(row, size):
+    """Unpack an int into a list of tile exponents"""
+    return [(row >> (CELL_BITS * j)) & CELL_MASK for j in range(size)]
+
+def _slide_left(exponents):
+    """Slide and merge a row of exponents towards index 0, same rules as game.move_left"""
+    size = len(exponents)
+    tiles = [e for e in exponents if e != 0]
+    for j in range(len(tiles) - 1):
+        if tiles[j] != 0 and tiles[j] == tiles[j + 1]:
+            if tiles[j] == MAX_EXPONENT:
+                raise OverflowError("Tile exponent doesn't fit in a packed cell")
+            tiles[j] += 1
+            tiles[j + 1] = 0
+    tiles = [e for e in tiles if e != 0]
+    return tiles + [0] * (size - len(tiles))
+
+def _row_left(row, size):
+    """Look up (or compute once) the result of moving a packed row left"""
+    table = _left_tables.setdefault(size, {})
+    result = table.get(row)
+    if result is None:
+        if len(table) >= MAX_TABLE_ROWS:
+            table.clear()
+        new_row = pack_row(_slide_left(unpack_row(row, size)))
+        result = table[row] = (new_row, new_row != row)
+    return result
+
+def _row_right(row, size):
+    """Look up (or compute once) the result of moving a packed row right"""
+    table = _right_tables.setdefault(size, {})
+    result = table.get(row)
+    if result is None:
+        if len(table) >= MAX_TABLE_ROWS:
+            table.clear()
+        new_row = pack_row(_slide_left(unpack_row(row, size)[::-1])[::-1])
+        result = table[row] = (new_row, new_row != row)
+    return result
+
+def transpose(rows, size):
+    """Turn packed rows into packed columns (and back)"""
+    columns = []
+    for j in range(size):
+        shift = CELL_BITS * j
+        column = 0
+        for i in range(size):
+            column |= ((rows[i] >> shift) & CELL_MASK) << (CELL_BITS * i)
+        columns.append(column)
+    return columns
+
+def slide_rows(rows, size, right=False):
+    """Move every packed row (or transposed column) left or right, return (new lines, moved)"""
+    lookup = _row_right if right else _row_left
+    lines = list(rows)
+    moved = False
+    for k in range(size):
+        lines[k], changed = lookup(lines[k], size)
+        moved = moved or changed
+    return lines, moved
+
+def init_board(size, rng=random):
+    """Initialize the game board"""
+    board = BitBoard(size)
+    add_random_tile(board, rng)
+    add_random_tile(board, rng)
+    return board
+
+def add_random_tile(board, rng=random):
+    """Add a new random tile (2 or 4), drawing from rng exactly like game.add_random_tile"""
+    shifts = [CELL_BITS * j for j in range(board.size)]
+    empty = [(i, shift) for i, row in enumerate(board.rows) for shift in shifts if not (row >> shift) & CELL_MASK]
+    if empty:
+        i, shift = rng.choice(empty)
+        board.rows[i] |= (1 if rng.choice([2, 4]) == 2 else 2) << shift
+
+def get_score(board):
+    """Return the highest tile value"""
+    highest = max(max(unpack_row(row, board.size)) for row in board.rows)
+    return 1 << highest if highest else 0
+
+def move_left(board):
+    """Move tiles left"""
+    board.rows[:], moved = slide_rows(board.rows, board.size)
+    return moved
+
+def move_right(board):
+    """Move tiles right"""
+    board.rows[:], moved = slide_rows(board.rows, board.size, right=True)
+    return moved
+
+def move_up(board):
+    """Move tiles up"""
+    columns, moved = slide_rows(transpose(board.rows, board.size), board.size)
+    board.rows[:] = transpose(columns, board.size)
+    return moved
+
+def move_down(board):
+    """Move tiles down"""
+    columns, moved = slide_rows(transpose(board.rows, board.size), board.size, right=True)
+    board.rows[:] = transpose(columns, board.size)
+    return moved
+
+def is_game_over(board):
+    """Check if no moves are left"""
+    size = board.size
+    for row in board.rows:
+        cells = unpack_row(row, size)
+        if 0 in cells:
+            return False
+        for j in range(size - 1):
+            if cells[j] == cells[j + 1]:
+                return False
+    for column in transpose(board.rows, size):
+        cells = unpack_row(column, size)
+        for i in range(size - 1):
+            if cells[i] == cells[i + 1]:
+                return False
+    return True
+
+def table_sizes():
+    """Return how many rows each transition table has cached so far"""
+    return {size: len(_left_tables[size]) + len(_right_tables[size]) for size in _left_tables}
+
+def check_against_list_engine(games=20, seed=2048, sizes=SIZES):
+    """Play the same random games on both engines and fail on the first mismatch"""
+    list_moves = (list_move_up, list_move_down, list_move_left, list_move_right)
+    bit_moves = (move_up, move_down, move_left, move_right)
+    picker = random.Random(seed)
+    steps = 0
+    for size in sizes:
+        for game in range(games):
+            state = random.getstate()
+            random.seed(picker.random())
+            expected = list_init_board(size)
+            board = BitBoard.from_lists(expected)
+            while not list_is_game_over(expected):
+                if is_game_over(board):
+                    raise AssertionError(f"{size}x{size} game {game}: bitboard reports game over too early")
+                move = picker.randrange(4)
+                moved_list = list_moves[move](expected)
+                moved_bit = bit_moves[move](board)
+                if moved_list != moved_bit:
+                    raise AssertionError(f"{size}x{size} game {game}: moved flag differs at step {steps}")
+                if moved_list:
+                    rng_state = random.getstate()
+                    list_add_random_tile(expected)
+                    random.setstate(rng_state)
+                    add_random_tile(board)
+                if board.to_lists() != expected:
+                    raise AssertionError(f"{size}x{size} game {game}: boards differ at step {steps}")
+                if get_score(board) != max(max(row) for row in expected):
+                    raise AssertionError(f"{size}x{size} game {game}: scores differ at step {steps}")
+                steps += 1
+                if get_score(board) >= 2048:
+                    break
+            if list_is_game_over(expected) != is_game_over(board):
+                raise AssertionError(f"{size}x{size} game {game}: game over checks differ")
+            random.setstate(state)
+    return steps
+
+if __name__ == "__main__":
+    checked = check_against_list_engine()
+    print(f"Bitboard engine matches game.py on {checked} moves, cached rows per size: {table_sizes()}")
@@ -0,0 +1,281 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep, monotonic
+from telebot.apihelper import ApiTelegramException
+from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+from config import logger, BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_PAGE_SIZE, BROADCAST_PROGRESS_INTERVAL
+from database import (
+    run_db,
+    create_broadcast_job, get_unfinished_broadcast_jobs, get_pending_broadcast_users,
+    save_broadcast_deliveries, count_broadcast_deliveries, finish_broadcast_job, count_users,
+)
+
+MAX_ATTEMPTS = 5
+
+
+class TokenBucket:
+    """Let through at most `rate` sends per second, with short bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if one is free, otherwise return how long to wait for one"""
+        with self._lock:
+            now = monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a send is allowed"""
+        while wait := self._take():
+            sleep(wait)
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a send is allowed"""
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop every sender for a while, used when Telegram answers 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, monotonic() + seconds)
+            self._tokens = 0
+
+
+# Shared by every job so concurrent broadcasts together stay under Telegram's limit
+send_bucket = TokenBucket(BROADCAST_RATE)
+
+
+class BroadcastJob:
+    """Send one text to every user, resumable from its saved delivery records"""
+
+    def __init__(self, bot, job_id, admin_id, text, bucket=None, workers=BROADCAST_WORKERS, page_size=BROADCAST_PAGE_SIZE):
+        self.bot = bot
+        self.job_id = job_id
+        self.admin_id = admin_id
+        self.text = text
+        self.bucket = bucket or send_bucket
+        self.workers = workers
+        self.page_size = page_size
+        self.sent = 0
+        self.failed = 0
+        self._results = []
+        self._lock = threading.Lock()
+        self._progress_message_id = None
+        self._resumed = 0
+
+    def _send(self, user_id):
+        """Deliver to one user, waiting out 429 errors, and return the delivery status"""
+        for _ in range(MAX_ATTEMPTS):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(user_id, self.text)
+                return "sent"
+            except ApiTelegramException as e:
+                if e.error_code != 429:
+                    logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                    return "failed"
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Broadcast {self.job_id} hit the rate limit, pausing {retry_after}s")
+                self.bucket.pause(retry_after)
+            except Exception as e:
+                logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    def _deliver(self, user_id):
+        status = self._send(user_id)
+        with self._lock:
+            self._results.append((user_id, status))
+            if status == "sent":
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def _save_results(self):
+        with self._lock:
+            results, self._results = self._results, []
+        if results:
+            save_broadcast_deliveries(self.job_id, results)
+
+    def _progress_text(self, total, started, done):
+        elapsed = max(monotonic() - started, 1e-9)
+        rate = (self.sent + self.failed - self._resumed) / elapsed
+        title = "ارسال پیام همگانی تموم شد ✅" if done else "در حال ارسال پیام همگانی 📢"
+        return (
+            f"{title}\n"
+            f"ارسال‌شده: {self.sent} | ناموفق: {self.failed} | کل کاربران: {total}\n"
+            f"سرعت: {rate:.1f} پیام در ثانیه"
+        )
+
+    def _report(self, total, started, done=False):
+        """Show the admin how far the broadcast got and how fast it goes"""
+        text = self._progress_text(total, started, done)
+        try:
+            if self._progress_message_id is None:
+                self._progress_message_id = self.bot.send_message(self.admin_id, text).message_id
+            else:
+                self.bot.edit_message_text(text, chat_id=self.admin_id, message_id=self._progress_message_id)
+        except Exception as e:
+            logger.warning(f"Failed to update broadcast progress for admin {self.admin_id}: {e}")
+
+    def run(self):
+        """Stream pending users page by page through the worker pool"""
+        counts = count_broadcast_deliveries(self.job_id)
+        self.sent, self.failed = counts.get("sent", 0), counts.get("failed", 0)
+        self._resumed = self.sent + self.failed
+        total = count_users()
+        started = monotonic()
+        last_report = 0
+        # Bound the work queued in the pool to two pages so memory stays flat
+        in_flight = threading.BoundedSemaphore(self.page_size * 2)
+        after_id = None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"broadcast-{self.job_id}") as pool:
+            while True:
+                page = get_pending_broadcast_users(self.job_id, after_id, self.page_size)
+                if not page:
+                    break
+                for user_id in page:
+                    in_flight.acquire()
+                    future = pool.submit(self._deliver, user_id)
+                    future.add_done_callback(lambda _: in_flight.release())
+                after_id = page[-1]
+                self._save_results()
+                if monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    self._report(total, started)
+                    last_report = monotonic()
+        self._save_results()
+        finish_broadcast_job(self.job_id, time())
+        self._report(total, started, done=True)
+        logger.info(f"Broadcast {self.job_id} sent to {self.sent} users ({self.failed} failed) by admin {self.admin_id}")
+
+
+class AsyncBroadcastJob(BroadcastJob):
+    """BroadcastJob for AsyncTeleBot, sends run as tasks and queries on the database executor"""
+
+    async def _send(self, user_id):
+        for _ in range(MAX_ATTEMPTS):
+            await self.bucket.acquire_async()
+            try:
+                await self.bot.send_message(user_id, self.text)
+                return "sent"
+            except AsyncApiTelegramException as e:
+                if e.error_code != 429:
+                    logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                    return "failed"
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Broadcast {self.job_id} hit the rate limit, pausing {retry_after}s")
+                self.bucket.pause(retry_after)
+            except Exception as e:
+                logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def _deliver(self, user_id, in_flight):
+        try:
+            status = await self._send(user_id)
+            with self._lock:
+                self._results.append((user_id, status))
+                if status == "sent":
+                    self.sent += 1
+                else:
+                    self.failed += 1
+        finally:
+            in_flight.release()
+
+    async def _report(self, total, started, done=False):
+        text = self._progress_text(total, started, done)
+        try:
+            if self._progress_message_id is None:
+                self._progress_message_id = (await self.bot.send_message(self.admin_id, text)).message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.admin_id, message_id=self._progress_message_id)
+        except Exception as e:
+            logger.warning(f"Failed to update broadcast progress for admin {self.admin_id}: {e}")
+
+    async def run(self):
+        """Stream pending users page by page, at most `workers` sends in flight"""
+        counts = await run_db(count_broadcast_deliveries, self.job_id)
+        self.sent, self.failed = counts.get("sent", 0), counts.get("failed", 0)
+        self._resumed = self.sent + self.failed
+        total = await run_db(count_users)
+        started = monotonic()
+        last_report = 0
+        in_flight = asyncio.Semaphore(self.workers)
+        tasks = set()
+        after_id = None
+        while True:
+            page = await run_db(get_pending_broadcast_users, self.job_id, after_id, self.page_size)
+            if not page:
+                break
+            for user_id in page:
+                await in_flight.acquire()
+                task = asyncio.create_task(self._deliver(user_id, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            after_id = page[-1]
+            await run_db(self._save_results)
+            if monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                await self._report(total, started)
+                last_report = monotonic()
+        await asyncio.gather(*tasks)
+        await run_db(self._save_results)
+        await run_db(finish_broadcast_job, self.job_id, time())
+        await self._report(total, started, done=True)
+        logger.info(f"Broadcast {self.job_id} sent to {self.sent} users ({self.failed} failed) by admin {self.admin_id}")
+
+
+def _run_in_background(job):
+    thread = threading.Thread(target=job.run, name=f"broadcast-{job.job_id}", daemon=True)
+    thread.start()
+    return thread
+
+def start_broadcast(bot, admin_id, text):
+    """Create a broadcast job and run it without blocking the calling handler"""
+    job_id = create_broadcast_job(admin_id, text, time())
+    logger.info(f"Broadcast {job_id} initiated by admin {admin_id}")
+    return _run_in_background(BroadcastJob(bot, job_id, admin_id, text))
+
+def resume_broadcasts(bot):
+    """Continue every broadcast that was interrupted by a restart"""
+    threads = []
+    for job in get_unfinished_broadcast_jobs():
+        logger.info(f"Resuming broadcast {job['id']} of admin {job['admin_id']}")
+        threads.append(_run_in_background(BroadcastJob(bot, job["id"], job["admin_id"], job["text"])))
+    return threads
+
+# The event loop only keeps weak references to tasks, running async broadcasts are held here
+_running_jobs = set()
+
+def _run_as_task(job):
+    task = asyncio.create_task(job.run())
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return task
+
+async def start_broadcast_async(bot, admin_id, text):
+    """start_broadcast for AsyncTeleBot, the job runs as a task"""
+    job_id = await run_db(create_broadcast_job, admin_id, text, time())
+    logger.info(f"Broadcast {job_id} initiated by admin {admin_id}")
+    return _run_as_task(AsyncBroadcastJob(bot, job_id, admin_id, text))
+
+async def resume_broadcasts_async(bot):
+    """resume_broadcasts for AsyncTeleBot"""
+    tasks = []
+    for job in await run_db(get_unfinished_broadcast_jobs):
+        logger.info(f"Resuming broadcast {job['id']} of admin {job['admin_id']}")
+        tasks.append(_run_as_task(AsyncBroadcastJob(bot, job["id"], job["admin_id"], job["text"])))
+    return tasks
@@ -0,0 +1,124 @@
+from config import logger
+
+# One-character action codes sent as callback_data, optionally followed by the
+# owner's token (user id in base 36) so stale or foreign keyboards are ignored
+SHOW_LEVELS = "s"
+EASY, MEDIUM, HARD = "5", "7", "9"
+DUMMY = "."
+UP, DOWN, LEFT, RIGHT = "u", "d", "l", "r"
+END = "x"
+CONFIRM_END = "y"
+CANCEL_END = "n"
+NEW_GAME = "g"
+HINT = "h"
+MODE = "m"
+
+# Readable names of the action codes, for logs and metrics
+ACTION_NAMES = {
+    SHOW_LEVELS: "show_levels", EASY: "easy", MEDIUM: "medium", HARD: "hard", DUMMY: "dummy",
+    UP: "up", DOWN: "down", LEFT: "left", RIGHT: "right",
+    END: "end", CONFIRM_END: "confirm_end", CANCEL_END: "cancel_end", NEW_GAME: "new_game", HINT: "hint",
+    MODE: "mode",
+}
+
+# callback_data of keyboards sent before the compact format, still out in chats
+_LEGACY_EXACT = {
+    "show_levels": SHOW_LEVELS,
+    "easy": EASY,
+    "medium": MEDIUM,
+    "hard": HARD,
+    "dummy": DUMMY,
+    "noop": CANCEL_END,
+    "new_game": NEW_GAME,
+}
+_LEGACY_PREFIXES = (
+    ("tile_", DUMMY),
+    ("confirm_end_", CONFIRM_END),
+    ("end_", END),
+    ("up_", UP),
+    ("down_", DOWN),
+    ("left_", LEFT),
+    ("right_", RIGHT),
+)
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def user_token(user_id):
+    """Encode a user id in base 36"""
+    user_id = int(user_id)
+    token = ""
+    while True:
+        user_id, digit = divmod(user_id, 36)
+        token = _DIGITS[digit] + token
+        if user_id == 0:
+            return token
+
+def encode(action, user_id=None):
+    """Build callback_data for an action, bound to a user when given"""
+    return action if user_id is None else action + user_token(user_id)
+
+def decode(data):
+    """Split callback_data into (action, owner user id or None), (None, None) if it can't be parsed"""
+    if not data:
+        return None, None
+    legacy = _LEGACY_EXACT.get(data)
+    if legacy is not None:
+        return legacy, None
+    if "_" in data:
+        for prefix, action in _LEGACY_PREFIXES:
+            if data.startswith(prefix):
+                owner = data.rsplit("_", 1)[1]
+                return action, int(owner) if owner.isdecimal() else None
+        return None, None
+    token = data[1:]
+    if not token:
+        return data, None
+    # int() would also take a sign, spaces or "_", which user_token never writes
+    if not (token.isascii() and token.isalnum()):
+        # Hand-made data or a button from a deploy with another format
+        return None, None
+    return data[:1], int(token, 36)
+
+
+class CallbackRouter:
+    """Dispatch callback queries with one parse and one dict lookup"""
+
+    def __init__(self):
+        self._routes = {}
+
+    def add(self, action, handler):
+        if action in self._routes:
+            raise ValueError(f"Callback action {action!r} is already routed")
+        self._routes[action] = handler
+
+    def route(self, *actions):
+        """Decorator registering a handler for one or more action codes"""
+        def decorator(handler):
+            for action in actions:
+                self.add(action, handler)
+            return handler
+        return decorator
+
+    def wrap(self, wrapper):
+        """Replace every handler with wrapper(action name, handler), e.g. to time it"""
+        self._routes = {action: wrapper(ACTION_NAMES.get(action, action), handler) for action, handler in self._routes.items()}
+
+    def resolve(self, call):
+        """Return the handler for a callback, None if it has none or the button isn't the caller's"""
+        action, owner = decode(call.data or "")
+        handler = self._routes.get(action)
+        if handler is None:
+            logger.warning(f"Unknown callback data {call.data!r} from user {call.from_user.id}")
+            return None
+        if owner is not None and owner != call.from_user.id:
+            logger.warning(f"User {call.from_user.id} pressed a button of user {owner}")
+            return None
+        return handler
+
+    def dispatch(self, call):
+        """Run the handler for a callback, return False if nothing handled it"""
+        handler = self.resolve(call)
+        if handler is None:
+            return False
+        handler(call)
+        return True
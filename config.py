@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from logging import getLogger
+import logging
 
 # Load environment variables
 load_dotenv()
@@ -9,5 +9,85 @@ load_dotenv()
 TOKEN = os.getenv("TOKEN")
 ADMIN_USER_IDS = list(map(int, os.getenv("ADMIN_USER_IDS", "").split(","))) if os.getenv("ADMIN_USER_IDS") else []
 
+# SQLite tuning: synchronous is OFF, NORMAL or FULL, busy timeout is in seconds
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "128"))
+# Threads the async mode (python async_bot.py) runs SQLite calls on
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+# Users and finished games are written behind: queued in memory and saved in one transaction
+# every WRITE_FLUSH_INTERVAL seconds. KNOWN_USERS_MAX saved users are remembered so /start
+# skips SQLite for them. Several results of one user in a flush coalesce on the all-sizes
+# leaderboard: "last" keeps the newest, "max" the best score (and that board then never lowers
+# a saved score). Each level's leaderboard always keeps the best.
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1"))
+KNOWN_USERS_MAX = int(os.getenv("KNOWN_USERS_MAX", "200000"))
+LEADERBOARD_COALESCE = os.getenv("LEADERBOARD_COALESCE", "last")
+
+# Where active games live: "memory" (lost on restart) or "sqlite" (survives restarts)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "2"))
+SESSION_FLUSH_SIZE = int(os.getenv("SESSION_FLUSH_SIZE", "200"))
+# Games untouched for SESSION_IDLE_TTL seconds end with their score saved, the least
+# recently used ones also end once more than SESSION_MAX_ACTIVE are kept in memory
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "21600"))
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "50000"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "60"))
+
+# Broadcasts: messages per second across all jobs, sender threads, users read per page
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# How updates arrive: "polling" or "webhook" (needs WEBHOOK_URL behind an HTTPS proxy)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Per-user ordered workers, updates each worker may queue, seconds to wait for room
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+WEBHOOK_QUEUE_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "1"))
+
+# Async mode: keep-alive connections to the Bot API shared by all handlers
+ASYNC_HTTP_CONNECTIONS = int(os.getenv("ASYNC_HTTP_CONNECTIONS", "100"))
+
+# Multi-process mode (python supervisor.py): shard processes, queued updates per shard,
+# seconds between throughput reports
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+SHARD_REPORT_INTERVAL = float(os.getenv("SHARD_REPORT_INTERVAL", "30"))
+
+# Hints: seconds a search may take, search processes, searches running at once, empty cells
+# a search tries a spawn in (more is exact but shallower), positions remembered per process
+HINT_TIME_BUDGET = float(os.getenv("HINT_TIME_BUDGET", "1"))
+HINT_WORKERS = int(os.getenv("HINT_WORKERS", "2"))
+HINT_MAX_PENDING = int(os.getenv("HINT_MAX_PENDING", "8"))
+HINT_SPAWN_CELLS = int(os.getenv("HINT_SPAWN_CELLS", "6"))
+HINT_TABLE_SIZE = int(os.getenv("HINT_TABLE_SIZE", "200000"))
+
+# Rate limiting: more than BURST messages within WINDOW seconds blocks a user for
+# BLOCK seconds. Idle users are forgotten after TTL seconds, MAX_ENTRIES caps memory
+# (blocked users are kept past it until their block ends).
+# The "sqlite" backend shares the limits between every process using bot.db.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_WINDOW = float(os.getenv("RATE_LIMIT_WINDOW", "1"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "2"))
+RATE_LIMIT_BLOCK = float(os.getenv("RATE_LIMIT_BLOCK", "30"))
+RATE_LIMIT_TTL = float(os.getenv("RATE_LIMIT_TTL", "300"))
+RATE_LIMIT_MAX_ENTRIES = int(os.getenv("RATE_LIMIT_MAX_ENTRIES", "100000"))
+
+# Metrics: Prometheus text on http://METRICS_LISTEN:METRICS_PORT/metrics, 0 turns the endpoint off
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Logging: level name such as DEBUG, INFO or WARNING
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(processName)s %(threadName)s: %(message)s")
+
 # Logger instance
-logger = getLogger(__name__)
+logger = logging.getLogger(__name__)
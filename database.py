@@ -1,72 +1,526 @@
+import asyncio
 import sqlite3
-from config import logger
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from time import time
+from config import logger, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT, DB_CACHED_STATEMENTS, DB_EXECUTOR_WORKERS
+from metrics import DB_SECONDS
 
 DB_NAME = "bot.db"
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+LEADERBOARD_SIZE = 5
 
-def init_db():
+
+class ConnectionManager:
+    """Hand out one long-lived SQLite connection per thread, all in WAL mode"""
+
+    def __init__(self, db_name, synchronous=DB_SYNCHRONOUS, busy_timeout=DB_BUSY_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown SQLite synchronous mode: {synchronous}")
+        self.db_name = db_name
+        self.synchronous = synchronous.upper()
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._generation = 0
+
+    def _open(self):
+        # Statements are cached per connection by their SQL text, so keeping the
+        # connection alive is what lets every call reuse its prepared statement
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        local = self._local
+        if getattr(local, "generation", None) == self._generation:
+            return local.conn
+        conn = self._open()
+        with self._lock:
+            # Drop connections whose threads are gone so they don't pile up
+            alive = []
+            for thread, other in self._connections:
+                if thread.is_alive():
+                    alive.append((thread, other))
+                else:
+                    other.close()
+            alive.append((threading.current_thread(), conn))
+            self._connections = alive
+            local.conn, local.generation = conn, self._generation
+        logger.debug(f"Opened SQLite connection for thread {threading.current_thread().name}")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block in one transaction, commit on success and roll back on error"""
+        conn = self.connection()
+        with conn:
+            yield conn.cursor()
+
+    def close_all(self):
+        """Close every connection, threads that run again get a fresh one"""
+        with self._lock:
+            for _, conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            closed = len(self._connections)
+            self._connections = []
+            self._generation += 1
+        logger.info(f"Closed {closed} SQLite connections")
+
+
+db = ConnectionManager(DB_NAME)
+
+def _db(manager):
+    """The given ConnectionManager, the process-wide one when None"""
+    return db if manager is None else manager
+
+# (manager, board size or None for all sizes) -> (leaderboard version, top LEADERBOARD_SIZE rows)
+# as last read from SQLite. The version lives in SQLite and moves only with writes that can
+# change some board's top rows, so the cache here and rendered leaderboards in every process
+# know when to rebuild.
+_top_lock = threading.Lock()
+_top_entries = {}
+
+def init_db(manager=None):
     """Create tables if they don't exist"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    with _db(manager).transaction() as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT
+        )
+        """)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT
-    )
-    """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            score INTEGER,
+            time INTEGER
+        )
+        """)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS leaderboard (
-        user_id INTEGER PRIMARY KEY,
-        name TEXT,
-        score INTEGER,
-        time INTEGER
-    )
-    """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard (score DESC, time ASC)
+        """)
+
+        # updated_at lets the in-memory rank index (ranking.py) read only rows written since its last sync
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(leaderboard)")}
+        if "updated_at" not in columns:
+            cursor.execute("ALTER TABLE leaderboard ADD COLUMN updated_at REAL")
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_updated ON leaderboard (updated_at)
+        """)
+
+        # Best score of each user on each board size
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS level_leaderboard (
+            size INTEGER,
+            user_id INTEGER,
+            name TEXT,
+            score INTEGER,
+            time INTEGER,
+            updated_at REAL,
+            PRIMARY KEY (size, user_id)
+        ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_level_leaderboard_rank ON level_leaderboard (size, score DESC, time ASC)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_level_leaderboard_updated ON level_leaderboard (updated_at)
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            text TEXT,
+            status TEXT,
+            created_at REAL,
+            finished_at REAL
+        )
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER,
+            user_id INTEGER,
+            status TEXT,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            user_id INTEGER PRIMARY KEY,
+            count INTEGER,
+            window_start REAL,
+            blocked_until REAL,
+            last_seen REAL
+        )
+        """)
+        # blocked_count runs on every metrics scrape
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rate_limits_blocked ON rate_limits (blocked_until)
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS game_sessions (
+            user_id TEXT PRIMARY KEY,
+            size INTEGER,
+            board BLOB,
+            start_time REAL,
+            name TEXT,
+            updated_at REAL
+        )
+        """)
+
+        # Databases created before sessions kept the player's name, a move log or the render mode lack the columns
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(game_sessions)")}
+        for column, kind in (
+            ("name", "TEXT"), ("seed", "INTEGER"), ("moves", "BLOB"), ("move_count", "INTEGER"), ("text_mode", "INTEGER"),
+        ):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE game_sessions ADD COLUMN {column} {kind}")
+
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_game_sessions_updated ON game_sessions (updated_at)
+        """)
+
+        # Every finished game with its seed and 2-bit move log, verified is NULL for games
+        # started before logs existed and 0 when the log didn't replay to the score
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS game_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            size INTEGER,
+            seed INTEGER,
+            moves BLOB,
+            move_count INTEGER,
+            score INTEGER,
+            time INTEGER,
+            finished_at REAL,
+            verified INTEGER
+        )
+        """)
+
+        # Counters bumped in the same transaction as the data they describe, read by every process
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """)
+
+        # How many records of each export migrate.py already imported, and the byte offset right after the last one
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            position INTEGER,
+            byte_offset INTEGER,
+            updated_at REAL
+        )
+        """)
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(import_checkpoints)")}
+        if "byte_offset" not in columns:
+            cursor.execute("ALTER TABLE import_checkpoints ADD COLUMN byte_offset INTEGER")
+
+# The async mode runs every query on these threads so the event loop never waits on SQLite
+_executor = None
+_executor_lock = threading.Lock()
+
+def db_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+        return _executor
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database call on the database executor"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor(), partial(func, *args, **kwargs))
 
-    conn.commit()
-    conn.close()
+def close_db():
+    """Close all pooled connections on shutdown"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    db.close_all()
 
-def save_user(user_id, username):
+@DB_SECONDS.time()
+def save_user(user_id, username, manager=None):
     """Save new user if not exists"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    if cursor.fetchone() is None:
-        cursor.execute("INSERT INTO users (id, username) VALUES (?, ?)", (user_id, username if username else "ندارد"))
-        logger.info(f"Saved user {user_id} to database")
-    conn.commit()
-    conn.close()
+    with _db(manager).transaction() as cursor:
+        cursor.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (user_id, username if username else "ندارد"))
+        if cursor.rowcount:
+            logger.info(f"Saved user {user_id} to database")
 
+@DB_SECONDS.time()
 def get_all_users():
     """Return all saved users"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username FROM users")
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"id": row[0], "username": row[1]} for row in rows]
-
-def get_leaderboard():
+    cursor = db.connection().execute("SELECT id, username FROM users")
+    return [{"id": row[0], "username": row[1]} for row in cursor.fetchall()]
+
+@DB_SECONDS.time()
+def create_broadcast_job(admin_id, text, created_at):
+    """Register a new broadcast and return its id"""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO broadcast_jobs (admin_id, text, status, created_at) VALUES (?, ?, 'running', ?)",
+            (admin_id, text, created_at)
+        )
+        return cursor.lastrowid
+
+@DB_SECONDS.time()
+def get_unfinished_broadcast_jobs():
+    """Return broadcasts that were still running when the bot stopped"""
+    cursor = db.connection().execute(
+        "SELECT id, admin_id, text FROM broadcast_jobs WHERE status = 'running' ORDER BY id"
+    )
+    return [{"id": row[0], "admin_id": row[1], "text": row[2]} for row in cursor.fetchall()]
+
+@DB_SECONDS.time()
+def get_pending_broadcast_users(job_id, after_id, limit, manager=None):
+    """Return the next page of users that have no delivery record for a job yet"""
+    cursor = _db(manager).connection().execute("""
+    SELECT id FROM users
+    WHERE id > ? AND NOT EXISTS (
+        SELECT 1 FROM broadcast_deliveries WHERE job_id = ? AND user_id = users.id
+    )
+    ORDER BY id LIMIT ?
+    """, (after_id if after_id is not None else -1 << 63, job_id, limit))
+    return [row[0] for row in cursor.fetchall()]
+
+@DB_SECONDS.time()
+def save_broadcast_deliveries(job_id, results):
+    """Record (user_id, status) delivery results of a job in one transaction"""
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO broadcast_deliveries (job_id, user_id, status) VALUES (?, ?, ?)",
+            [(job_id, user_id, status) for user_id, status in results]
+        )
+
+@DB_SECONDS.time()
+def count_broadcast_deliveries(job_id):
+    """Return how many deliveries of a job ended in each status"""
+    cursor = db.connection().execute(
+        "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE job_id = ? GROUP BY status", (job_id,)
+    )
+    return dict(cursor.fetchall())
+
+@DB_SECONDS.time()
+def finish_broadcast_job(job_id, finished_at):
+    """Mark a broadcast as done so it isn't resumed again"""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE id = ?", (finished_at, job_id)
+        )
+
+@DB_SECONDS.time()
+def count_users(manager=None):
+    """Return how many users are saved"""
+    return _db(manager).connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+@DB_SECONDS.time()
+def get_leaderboard(manager=None):
     """Return leaderboard as dict"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, name, score, time FROM leaderboard")
-    rows = cursor.fetchall()
-    conn.close()
-    return {str(row[0]): {"name": row[1], "score": row[2], "time": row[3]} for row in rows}
-
-def save_leaderboard_entry(user_id, name, score, time_value):
-    """Insert or update leaderboard entry"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    cursor = _db(manager).connection().execute("SELECT user_id, name, score, time FROM leaderboard")
+    return {str(row[0]): {"name": row[1], "score": row[2], "time": row[3]} for row in cursor.fetchall()}
+
+@DB_SECONDS.time()
+def get_top_n(n=LEADERBOARD_SIZE, size=None, manager=None):
+    """Return the n best leaderboard entries of a board size (of all sizes when None), highest score then fastest time first"""
+    conn = _db(manager).connection()
+    if size is None:
+        cursor = conn.execute(
+            "SELECT user_id, name, score, time FROM leaderboard ORDER BY score DESC, time ASC LIMIT ?", (n,)
+        )
+    else:
+        cursor = conn.execute(
+            "SELECT user_id, name, score, time FROM level_leaderboard WHERE size = ? ORDER BY score DESC, time ASC LIMIT ?",
+            (size, n)
+        )
+    return [{"user_id": row[0], "name": row[1], "score": row[2], "time": row[3]} for row in cursor.fetchall()]
+
+@DB_SECONDS.time()
+def get_rank_rows(size=None, since=None, manager=None):
+    """Return (user_id, score, time, updated_at) of a board size (all sizes when None), only rows written since `since` if given
+
+    Legacy rows may lack a score or time, those count as 0.
+    """
+    table, where, params = ("leaderboard", "", ()) if size is None else ("level_leaderboard", "WHERE size = ?", (size,))
+    if since is not None:
+        where += (" AND" if where else "WHERE") + " updated_at >= ?"
+        params += (since,)
+    return _db(manager).connection().execute(f"SELECT user_id, COALESCE(score, 0), COALESCE(time, 0), updated_at FROM {table} {where}", params).fetchall()
+
+@DB_SECONDS.time()
+def get_leaderboard_version(manager=None):
+    """Return a counter that changes whenever any process writes a score that can change a leaderboard's top"""
+    row = _db(manager).connection().execute("SELECT version FROM versions WHERE name = 'leaderboard'").fetchone()
+    return row[0] if row else 0
+
+def _bump_leaderboard_version(cursor):
     cursor.execute("""
-    INSERT INTO leaderboard (user_id, name, score, time)
-    VALUES (?, ?, ?, ?)
-    ON CONFLICT(user_id) DO UPDATE SET
-        name = excluded.name,
-        score = excluded.score,
-        time = excluded.time
-    """, (user_id, name, score, time_value))
-    conn.commit()
-    conn.close()
+    INSERT INTO versions (name, version) VALUES ('leaderboard', 1)
+    ON CONFLICT(name) DO UPDATE SET version = version + 1
+    """)
+
+def _top_of(size, version, manager=None):
+    """Top rows of a level's leaderboard (the all-sizes one when None), read again once the version moved"""
+    cached = _top_entries.get((manager, size))
+    if cached is None or cached[0] != version:
+        cached = _top_entries[manager, size] = (version, get_top_n(LEADERBOARD_SIZE, size, manager))
+    return cached[1]
+
+def _changes_top(user_id, score, time_value, top):
+    """Check whether writing this entry can change the given top entries"""
+    if len(top) < LEADERBOARD_SIZE or any(entry["user_id"] == user_id for entry in top):
+        return True
+    last = top[-1]
+    return (-score, time_value) <= (-last["score"], last["time"])
+
+_UPSERT_LEADERBOARD = """
+INSERT INTO leaderboard (user_id, name, score, time, updated_at)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    name = excluded.name,
+    score = excluded.score,
+    time = excluded.time,
+    updated_at = excluded.updated_at
+"""
+
+# Same, but an entry only replaces a worse score or an equal one reached slower
+_UPSERT_BEST_LEADERBOARD = _UPSERT_LEADERBOARD + """
+WHERE excluded.score > leaderboard.score OR (excluded.score = leaderboard.score AND excluded.time < leaderboard.time)
+"""
+
+# Level boards always keep each user's best
+_UPSERT_LEVEL_LEADERBOARD = """
+INSERT INTO level_leaderboard (user_id, name, score, time, updated_at, size)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(size, user_id) DO UPDATE SET
+    name = excluded.name,
+    score = excluded.score,
+    time = excluded.time,
+    updated_at = excluded.updated_at
+WHERE excluded.score > level_leaderboard.score
+    OR (excluded.score = level_leaderboard.score AND excluded.time < level_leaderboard.time)
+"""
+
+@DB_SECONDS.time()
+def save_leaderboard_entry(user_id, name, score, time_value, size=None, keep_best=False):
+    """Save a score, on its level's board too when size is given
+
+    The all-sizes board keeps the newest score, or the best one with keep_best. A level's board always keeps the best.
+    """
+    now = time()
+    with _top_lock:
+        version = get_leaderboard_version()
+        changed = _changes_top(user_id, score, time_value, _top_of(None, version)) or (
+            size is not None and _changes_top(user_id, score, time_value, _top_of(size, version))
+        )
+        with db.transaction() as cursor:
+            cursor.execute(_UPSERT_BEST_LEADERBOARD if keep_best else _UPSERT_LEADERBOARD, (user_id, name, score, time_value, now))
+            if size is not None:
+                cursor.execute(_UPSERT_LEVEL_LEADERBOARD, (user_id, name, score, time_value, now, size))
+            if changed:
+                _bump_leaderboard_version(cursor)
+
+@DB_SECONDS.time()
+def save_batch(users, games, level_entries, entries, keep_best=False, manager=None):
+    """Write queued (id, username) users, finished game log rows, (user_id, name, score, time, size) level
+    leaderboard entries and (user_id, name, score, time) all-sizes leaderboard entries in one transaction"""
+    now = time()
+    with _top_lock:
+        # Most game ends land far below every top and leave the rendered /leaderboard valid
+        version = get_leaderboard_version(manager)
+        changed = any(
+            _changes_top(user_id, score, time_value, _top_of(size, version, manager))
+            for user_id, _, score, time_value, size in level_entries
+        ) or any(
+            _changes_top(user_id, score, time_value, _top_of(None, version, manager))
+            for user_id, _, score, time_value in entries
+        )
+        with _db(manager).transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", users)
+            new_users = cursor.rowcount
+            cursor.executemany("""
+            INSERT INTO game_logs (user_id, name, size, seed, moves, move_count, score, time, finished_at, verified)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, games)
+            cursor.executemany(_UPSERT_LEVEL_LEADERBOARD, [(*entry[:4], now, entry[4]) for entry in level_entries])
+            cursor.executemany(
+                _UPSERT_BEST_LEADERBOARD if keep_best else _UPSERT_LEADERBOARD, [(*entry, now) for entry in entries]
+            )
+            if changed:
+                # One version covers every board, so it moves at most once a flush
+                _bump_leaderboard_version(cursor)
+    if new_users:
+        logger.info(f"Saved {new_users} new users to database")
+
+@DB_SECONDS.time()
+def get_import_checkpoint(source):
+    """Return (records imported already, byte offset after the last one) of an export, the offset is None
+    for checkpoints saved before offsets were"""
+    row = db.connection().execute(
+        "SELECT position, byte_offset FROM import_checkpoints WHERE source = ?", (source,)
+    ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+def _import_batch(insert_sql, rows, source, position, offset, bumps_leaderboard=False, extra=()):
+    """Run insert_sql over rows, then each (sql, rows) of extra, return how many rows insert_sql inserted"""
+    with db.transaction() as cursor:
+        cursor.executemany(insert_sql, rows)
+        inserted = cursor.rowcount
+        changed = inserted
+        for sql, extra_rows in extra:
+            cursor.executemany(sql, extra_rows)
+            changed += max(cursor.rowcount, 0)
+        if changed and bumps_leaderboard:
+            _bump_leaderboard_version(cursor)
+        cursor.execute("""
+        INSERT INTO import_checkpoints (source, position, byte_offset, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET
+            position = excluded.position, byte_offset = excluded.byte_offset, updated_at = excluded.updated_at
+        """, (source, position, offset, time()))
+    return inserted
+
+@DB_SECONDS.time()
+def import_users(rows, source, position, offset):
+    """Insert (id, username) rows skipping known users and save the checkpoint, in one transaction"""
+    return _import_batch("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", rows, source, position, offset)
+
+@DB_SECONDS.time()
+def import_leaderboard_entries(rows, source, position, offset):
+    """Insert (user_id, name, score, time, size) rows keeping existing entries and save the checkpoint, in one transaction
+
+    Every row goes to the all-sizes leaderboard, rows with a size to that level's leaderboard too.
+    """
+    now = time()
+    return _import_batch(
+        "INSERT OR IGNORE INTO leaderboard (user_id, name, score, time, updated_at) VALUES (?, ?, ?, ?, ?)",
+        [(*row[:4], now) for row in rows], source, position, offset, bumps_leaderboard=True,
+        extra=[(
+            "INSERT OR IGNORE INTO level_leaderboard (user_id, name, score, time, updated_at, size) VALUES (?, ?, ?, ?, ?, ?)",
+            [(*row[:4], now, row[4]) for row in rows if row[4] is not None]
+        )]
+    )
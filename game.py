@@ -1,18 +1,18 @@
 import random
 
-def init_board(size):
+def init_board(size, rng=random):
     """Initialize the game board"""
     board = [[0] * size for _ in range(size)]
-    add_random_tile(board)
-    add_random_tile(board)
+    add_random_tile(board, rng)
+    add_random_tile(board, rng)
     return board
 
-def add_random_tile(board):
-    """Add a new random tile (2 or 4)"""
+def add_random_tile(board, rng=random):
+    """Add a new random tile (2 or 4), drawn from rng so a seeded game can be replayed"""
     empty = [(i, j) for i in range(len(board)) for j in range(len(board)) if board[i][j] == 0]
     if empty:
-        i, j = random.choice(empty)
-        board[i][j] = random.choice([2, 4])
+        i, j = rng.choice(empty)
+        board[i][j] = rng.choice([2, 4])
 
 def get_score(board):
     """Return the highest tile value"""
@@ -86,3 +86,7 @@ def is_game_over(board):
             if board[i][j] == board[i + 1][j]:
                 return False
     return True
+
+# Move of each 2-bit code in a move log
+MOVES = (move_up, move_down, move_left, move_right)
+MOVE_CODES = {move: code for code, move in enumerate(MOVES)}
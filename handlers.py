@@ -1,36 +1,24 @@
 import telebot
 from telebot import types
-from time import time, sleep
 from config import TOKEN, ADMIN_USER_IDS, logger
-from database import save_user, get_all_users, get_leaderboard, save_leaderboard_entry
-from game import init_board, get_score, add_random_tile, move_up, move_left, move_right, move_down, is_game_over
-from utils import is_message_valid, check_rate_limit
+from broadcast import start_broadcast
+from callbacks import CallbackRouter, encode, SHOW_LEVELS, EASY, MEDIUM, HARD, DUMMY, UP, DOWN, LEFT, RIGHT, END, CONFIRM_END, CANCEL_END, NEW_GAME, HINT, MODE
+from game import get_score, move_up, move_left, move_right, move_down, is_game_over
+from hints import request_hint
+from render import game_message, edit_message, render_leaderboard, render_rank, render_stats, hint_text
+from sessions import GameSession, create_session_store
+from metrics import instrument_bot
+from utils import is_message_valid, check_rate_limit, rate_limiter
+from verify import score_verifier
+from writer import db_writer
 
 bot = telebot.TeleBot(TOKEN)
 
-# Store active games in memory
-game_state = {}
+# Active games, kept in memory or persisted depending on SESSION_BACKEND
+game_state = create_session_store()
 
-def build_game_keyboard(board, user_id):
-    """Create inline keyboard for game board"""
-    size = len(board)
-    markup = types.InlineKeyboardMarkup()
-    for i in range(size):
-        row_buttons = [types.InlineKeyboardButton(str(board[i][j]) if board[i][j] != 0 else "⚫", callback_data=f"tile_{i}_{j}_{user_id}") for j in range(size)]
-        markup.row(*row_buttons)
-    
-    markup.row(
-        types.InlineKeyboardButton("..........", callback_data="dummy"),
-        types.InlineKeyboardButton("↑", callback_data=f"up_{user_id}"),
-        types.InlineKeyboardButton("..........", callback_data="dummy")
-    )
-    markup.row(
-        types.InlineKeyboardButton("←", callback_data=f"left_{user_id}"),
-        types.InlineKeyboardButton("↓", callback_data=f"down_{user_id}"),
-        types.InlineKeyboardButton("→", callback_data=f"right_{user_id}")
-    )
-    markup.row(types.InlineKeyboardButton("دیگه نمیخوام بازی کنم ! ", callback_data=f"end_{user_id}"))
-    return markup
+# Routes every callback query through one parse and a dict lookup
+router = CallbackRouter()
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -44,16 +32,16 @@ def send_welcome(message):
     if not allowed:
         bot.send_message(user_id, error_message)
         return
-    save_user(user_id, user)
+    db_writer.save_user(user_id, user)
 
     welcome_message = (
         f"سلام {user} عزیز! 😊\n"
         f"به ربات بازی 2048 خوش اومدی  ،  نمیدونم چقد با بازی آشنایی  ،  اما اگه از قوانین بازی خیلی نمیدونی روی /rules  کلیک کن تا قوانین بهت نشون داده بشن  \n\n"
-        f"همچنین میتونی برای دیدن امتیاز نفرات برتر از دستور /leaderboard 🥇 استفاده کنی\n\n"
+        f"همچنین میتونی برای دیدن امتیاز نفرات برتر از دستور /leaderboard 🥇 و برای دیدن رتبه خودت از /rank استفاده کنی\n\n"
         "هر موقع آماده بودی ، روی دکمه شروع بازی بزن تا وارد بازی بشیم"
     )
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data="show_levels"))
+    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data=encode(SHOW_LEVELS)))
     bot.send_message(message.chat.id, welcome_message, reply_markup=markup)
 
 @bot.message_handler(commands=['rules'])
@@ -90,92 +78,116 @@ def show_leaderboard(message):
     if not allowed:
         bot.send_message(user_id, error_message)
         return
-    lb = get_leaderboard()
-    if not lb:
+    message_text = render_leaderboard()
+    if message_text is None:
         bot.send_message(message.chat.id, "هنوز هیچ‌کس امتیازی ثبت نکرده!")
         return
-    sorted_lb = sorted(lb.items(), key=lambda x: (-x[1]["score"], x[1]["time"]))
-    message_text = "🏆 **لیدربورد بهترین بازیکنان (۵ نفر اول)** 🏆\n\n"
-    for i, (uid, data) in enumerate(sorted_lb[:5], 1):
-        message_text += f"{i}. {data['name']} - امتیاز: {data['score']} | زمان: {data['time']} ثانیه\n"
     bot.send_message(message.chat.id, message_text, parse_mode='Markdown')
 
+@bot.message_handler(commands=['rank'])
+def show_rank(message):
+    """Handle /rank command to show the user's position on each leaderboard"""
+    if not is_message_valid(message):
+        return
+    
+    user_id = message.from_user.id
+    allowed, error_message = check_rate_limit(user_id)
+    if not allowed:
+        bot.send_message(user_id, error_message)
+        return
+    message_text = render_rank(user_id)
+    if message_text is None:
+        bot.send_message(message.chat.id, "هنوز امتیازی ثبت نکردی! یه بازی رو تموم کن تا رتبه‌ات مشخص بشه.")
+        return
+    bot.send_message(message.chat.id, message_text)
+
 @bot.message_handler(commands=['alive'])
 def send_alive_status(message):
     """Handle /alive command to check bot status"""
     bot.send_message(message.chat.id, "I'm alive and kicking! 🤖 2048Bot is here!")
 
-@bot.callback_query_handler(func=lambda call: call.data == "show_levels")
+@bot.message_handler(commands=['stats'])
+def send_stats(message):
+    """Handle /stats command to show latency and error metrics to admins"""
+    if message.chat.id not in ADMIN_USER_IDS:
+        bot.send_message(message.chat.id, "این قابلیت فقط برای ادمین‌ها در دسترسه!")
+        return
+    bot.send_message(message.chat.id, render_stats())
+
+@router.route(SHOW_LEVELS)
 def handle_show_levels(call):
     """Show difficulty level selection menu"""
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("آسون (۵×۵)", callback_data="easy"))
-    markup.add(types.InlineKeyboardButton("متوسط (۷×۷)", callback_data="medium"))
-    markup.add(types.InlineKeyboardButton("سخت (۹×۹)", callback_data="hard"))
-    bot.edit_message_text(
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
+    markup.add(types.InlineKeyboardButton("آسون (۵×۵)", callback_data=encode(EASY)))
+    markup.add(types.InlineKeyboardButton("متوسط (۷×۷)", callback_data=encode(MEDIUM)))
+    markup.add(types.InlineKeyboardButton("سخت (۹×۹)", callback_data=encode(HARD)))
+    edit_message(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
         text="میخوای بازی تو چه سطحی باشه ؟ در واقع این میزان بزرگ یا کوچیک بودن جدول بازی رو مشخص میکنه",
         reply_markup=markup
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data in ["easy", "medium", "hard"])
-def handle_level_selection(call):
+def handle_level_selection(call, size):
     """Handle difficulty level selection and start the game"""
     user_id = str(call.from_user.id)
-    size = {"easy": 5, "medium": 7, "hard": 9}[call.data]
-    game_state[user_id] = {"board": init_board(size), "size": size, "start_time": time()}
-    score = get_score(game_state[user_id]["board"])
-    elapsed_time = int(time() - game_state[user_id]["start_time"])
+    session = game_state[user_id] = GameSession.start(size, call.from_user.first_name)
+    board = session.board
+    score = get_score(board)
+    elapsed_time = session.elapsed()
     
-    bot.edit_message_text(
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
-        text=f"بازی شروع شد!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه",
-        reply_markup=build_game_keyboard(game_state[user_id]["board"], user_id)
+    edit_message(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        **game_message(board, user_id, f"بازی شروع شد!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه", session.text_mode)
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("tile_") or call.data == "dummy")
+@router.route(DUMMY)
 def handle_dummy_tiles(call):
     """Handle clicks on game board tiles or dummy buttons"""
     bot.answer_callback_query(call.id, text="این دکمه‌ها نمایشین!", show_alert=True)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("end_"))
+@router.route(END)
 def handle_end_game_prompt(call):
     """Prompt user to confirm ending the game"""
     user_id = str(call.from_user.id)
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("آره", callback_data=f"confirm_end_{user_id}"),
-        types.InlineKeyboardButton("نه", callback_data="noop")
+        types.InlineKeyboardButton("آره", callback_data=encode(CONFIRM_END, user_id)),
+        types.InlineKeyboardButton("نه", callback_data=encode(CANCEL_END))
     )
-    bot.edit_message_text(
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
+    edit_message(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
         text="مطمئنی که میخوای بازی رو تموم بکنی ؟ ",
         reply_markup=markup
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_end_"))
+@router.route(CONFIRM_END)
 def handle_confirm_end_game(call):
     """Handle confirmed game end and save score"""
     user_id = str(call.from_user.id)
-    if user_id in game_state:
-        score = get_score(game_state[user_id]["board"])
-        elapsed_time = int(time() - game_state[user_id]["start_time"])
+    session = game_state.get(user_id)
+    if session is not None:
+        score = session.score
+        elapsed_time = session.elapsed()
         user_name = call.from_user.first_name
         
-        save_leaderboard_entry(int(user_id), user_name, score, elapsed_time)
+        score_verifier.submit(user_id, user_name, session, elapsed_time)
         
-        del game_state[user_id]
+        game_state.pop(user_id, None)
         markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("بازی جدید", callback_data="new_game"))
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
+        markup.add(types.InlineKeyboardButton("بازی جدید", callback_data=encode(NEW_GAME)))
+        edit_message(
+            bot,
+            call.message.chat.id,
+            call.message.message_id,
             text=f"بازی تموم شد !\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه",
             reply_markup=markup
         )
@@ -195,25 +207,26 @@ def handle_message(message):
         bot.send_message(user_id, error_message)
         return
 
-@bot.callback_query_handler(func=lambda call: call.data == "noop")
+@router.route(CANCEL_END)
 def handle_noop(call):
     """Handle cancellation of game end prompt"""
     user_id = str(call.from_user.id)
-    if user_id in game_state:
-        board = game_state[user_id]["board"]
+    session = game_state.get(user_id)
+    if session is not None:
+        board = session.board
         score = get_score(board)
-        elapsed_time = int(time() - game_state[user_id]["start_time"])
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=f"بازی ادامه داره!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه",
-            reply_markup=build_game_keyboard(board, user_id)
+        elapsed_time = session.elapsed()
+        edit_message(
+            bot,
+            call.message.chat.id,
+            call.message.message_id,
+            **game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه", session.text_mode)
         )
     else:
         bot.send_message(call.message.chat.id, "برای شروع یک بازی جدید، /start را بزنید.")
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "new_game")
+@router.route(NEW_GAME)
 def handle_new_game(call):
     """Handle starting a new game"""
     user = call.from_user.first_name
@@ -222,80 +235,117 @@ def handle_new_game(call):
         "مرسی که برگشتی، یه بازی جدید شروع کنیم؟"
     )
     markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data="show_levels"))
-    bot.edit_message_text(
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
+    markup.add(types.InlineKeyboardButton("شروع بازی 🚀", callback_data=encode(SHOW_LEVELS)))
+    edit_message(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
         text=welcome_message,
         reply_markup=markup
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.endswith("_" + str(call.from_user.id)))
-def handle_game_moves(call):
+def handle_game_moves(call, move):
     """Handle game movement actions (up, down, left, right)"""
     user_id = str(call.from_user.id)
     
-    if user_id not in game_state:
+    session = game_state.get(user_id)
+    if session is None:
         bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
         return
 
-    board = game_state[user_id]["board"]
-    moved = False
-    
-    action = call.data.split('_')[0]
-
-    if action == "up":
-        moved = move_up(board)
-    elif action == "left":
-        moved = move_left(board)
-    elif action == "right":
-        moved = move_right(board)
-    elif action == "down":
-        moved = move_down(board)
+    moved = session.play(move)
 
     if moved:
-        add_random_tile(board)
-        score = get_score(board)
-        elapsed_time = int(time() - game_state[user_id]["start_time"])
+        board = session.board
         user_name = call.from_user.first_name
+        session.name = user_name
+        game_state.save(user_id)
+        score = get_score(board)
+        elapsed_time = session.elapsed()
 
         if 2048 in [num for row in board for num in row]:
-            save_leaderboard_entry(int(user_id), user_name, score, elapsed_time)
+            score_verifier.submit(user_id, user_name, session, elapsed_time)
             
             markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("بازی جدید", callback_data="new_game"))
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
+            markup.add(types.InlineKeyboardButton("بازی جدید", callback_data=encode(NEW_GAME)))
+            edit_message(
+                bot,
+                call.message.chat.id,
+                call.message.message_id,
                 text=f"شما برنده شدید! 💥\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه",
                 reply_markup=markup
             )
-            del game_state[user_id]
+            game_state.pop(user_id, None)
         elif is_game_over(board):
-            save_leaderboard_entry(int(user_id), user_name, score, elapsed_time)
+            score_verifier.submit(user_id, user_name, session, elapsed_time)
             
             markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("بازی جدید", callback_data="new_game"))
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
+            markup.add(types.InlineKeyboardButton("بازی جدید", callback_data=encode(NEW_GAME)))
+            edit_message(
+                bot,
+                call.message.chat.id,
+                call.message.message_id,
                 text=f"بازی تموم شد، شما باختید! ❌\nامتیاز نهایی: {score} | زمان: {elapsed_time} ثانیه",
                 reply_markup=markup
             )
-            del game_state[user_id]
+            game_state.pop(user_id, None)
         else:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"بازی ادامه داره!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه",
-                reply_markup=build_game_keyboard(board, user_id)
+            edit_message(
+                bot,
+                call.message.chat.id,
+                call.message.message_id,
+                **game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {score} | زمان: {elapsed_time} ثانیه", session.text_mode)
             )
     else:
         bot.answer_callback_query(call.id, text="حرکتی امکان‌پذیر نیست! ", show_alert=True)
     
     bot.answer_callback_query(call.id)
 
+@router.route(HINT)
+def handle_hint(call):
+    """Answer with the move the hint search suggests, without waiting for it here"""
+    user_id = str(call.from_user.id)
+    session = game_state.get(user_id)
+    if session is None:
+        bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
+        return
+    if not request_hint(user_id, session.board, lambda direction: bot.answer_callback_query(call.id, text=hint_text(direction))):
+        bot.answer_callback_query(call.id, text=hint_text(None))
+
+@router.route(MODE)
+def handle_mode_switch(call):
+    """Switch the game between tile buttons and the board drawn as text"""
+    user_id = str(call.from_user.id)
+    session = game_state.get(user_id)
+    if session is None:
+        bot.answer_callback_query(call.id, text="لطفاً یک بازی جدید را شروع کنید.", show_alert=True)
+        return
+    session.text_mode = not session.text_mode
+    game_state.save(user_id)
+    board = session.board
+    edit_message(
+        bot,
+        call.message.chat.id,
+        call.message.message_id,
+        **game_message(board, user_id, f"بازی ادامه داره!\nامتیاز: {get_score(board)} | زمان: {session.elapsed()} ثانیه", session.text_mode)
+    )
+    bot.answer_callback_query(call.id)
+
+router.add(EASY, lambda call: handle_level_selection(call, 5))
+router.add(MEDIUM, lambda call: handle_level_selection(call, 7))
+router.add(HARD, lambda call: handle_level_selection(call, 9))
+router.add(UP, lambda call: handle_game_moves(call, move_up))
+router.add(DOWN, lambda call: handle_game_moves(call, move_down))
+router.add(LEFT, lambda call: handle_game_moves(call, move_left))
+router.add(RIGHT, lambda call: handle_game_moves(call, move_right))
+
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    """Dispatch every callback query through the router"""
+    if not router.dispatch(call):
+        bot.answer_callback_query(call.id, text="برای شروع یک بازی جدید، /start را بزنید.")
+
 @bot.message_handler(func=lambda message: message.text == "پیام همگانی 📢")
 def handle_broadcast(message):
     """Handle broadcast command for admins"""
@@ -316,15 +366,8 @@ def send_broadcast(message):
     user_id = message.chat.id
     if user_id not in ADMIN_USER_IDS:
         return
-    users = get_all_users()
-    success_count = 0
-    for user in users:
-        try:
-            bot.send_message(user["id"], message.text)
-            success_count += 1
-            sleep(0.5)
-        except Exception as e:
-            logger.warning(f"Failed to send broadcast to user {user['id']}: {e}")
-            continue
-    bot.send_message(user_id, f"پیام به {success_count} کاربر ارسال شد 📢")
-    logger.info(f"Broadcast sent to {success_count} users by admin {user_id}")
\ No newline at end of file
+    bot.send_message(user_id, "ارسال پیام همگانی شروع شد، پیشرفتش رو همینجا می‌بینی 📢")
+    start_broadcast(bot, user_id, message.text)
+
+# Registered last so every handler above is timed
+instrument_bot(bot, router, game_state, rate_limiter)
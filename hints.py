@@ -0,0 +1,303 @@
+"""Best next move for a board: expectimax over the tile spawns, deepened until the time budget runs out
+
+Searches run in a process pool so they neither block handler threads nor hold their GIL.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import time
+from bitboard import BitBoard, CELL_BITS, CELL_MASK, MAX_TABLE_ROWS, slide_rows, transpose, unpack_row
+from callbacks import UP, DOWN, LEFT, RIGHT
+from config import logger, HINT_TIME_BUDGET, HINT_WORKERS, HINT_MAX_PENDING, HINT_SPAWN_CELLS, HINT_TABLE_SIZE
+from metrics import HINT_SECONDS, HINT_DEPTH
+
+# game.add_random_tile picks a 2 or a 4 with equal odds, as (exponent, probability)
+SPAWNS = ((1, 0.5), (2, 0.5))
+WIN_EXPONENT = 11
+# Deeper than this the branching outgrows any sensible budget even on 5x5
+MAX_DEPTH = 8
+
+# Row heuristic on tile exponents: reward empty cells, equal neighbours and rows that only
+# rise or only fall, penalize big sums so merging is preferred to spreading tiles out
+LOST_PENALTY = 200000
+EMPTY_WEIGHT = 270
+MERGE_WEIGHT = 700
+MONOTONICITY_POWER = 4
+MONOTONICITY_WEIGHT = 47
+SUM_POWER = 3.5
+SUM_WEIGHT = 11
+WIN_BONUS = 1000000
+
+
+class SearchTimeout(Exception):
+    """The time budget ran out in the middle of a depth"""
+
+
+class TranspositionTable:
+    """Bounded map of a board after a move -> (depth searched, value), the oldest entries go first"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, rows, depth):
+        """Value of a board searched at least `depth` moves deep, None if there is none"""
+        entry = self._entries.get(rows)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+        return None
+
+    def put(self, rows, depth, value):
+        entries = self._entries
+        if rows not in entries and len(entries) >= self.capacity:
+            del entries[next(iter(entries))]
+        entries[rows] = (depth, value)
+
+
+# One table per search process, shared by every search it runs, so the next hint of a
+# game starts from the positions the previous one already valued
+_table = TranspositionTable(HINT_TABLE_SIZE)
+# Heuristic value of each packed row seen so far, per board size
+_row_scores = {}
+
+def _row_score(row, size):
+    table = _row_scores.setdefault(size, {})
+    score = table.get(row)
+    if score is None:
+        if len(table) >= MAX_TABLE_ROWS:
+            table.clear()
+        cells = unpack_row(row, size)
+        merges = 0
+        previous = counter = 0
+        for exponent in cells:
+            if exponent == 0:
+                continue
+            if exponent == previous:
+                counter += 1
+            elif counter:
+                merges += 1 + counter
+                counter = 0
+            previous = exponent
+        if counter:
+            merges += 1 + counter
+        left = right = 0
+        for a, b in zip(cells, cells[1:]):
+            if a > b:
+                left += a ** MONOTONICITY_POWER - b ** MONOTONICITY_POWER
+            else:
+                right += b ** MONOTONICITY_POWER - a ** MONOTONICITY_POWER
+        score = (
+            LOST_PENALTY + EMPTY_WEIGHT * cells.count(0) + MERGE_WEIGHT * merges
+            - MONOTONICITY_WEIGHT * min(left, right) - SUM_WEIGHT * sum(e ** SUM_POWER for e in cells)
+        )
+        if WIN_EXPONENT in cells:
+            score += WIN_BONUS
+        table[row] = score
+    return score
+
+def evaluate(rows, size):
+    """Heuristic value of a board, the sum over its rows and columns"""
+    return sum(_row_score(row, size) for row in rows) + sum(_row_score(column, size) for column in transpose(rows, size))
+
+def successors(rows, size):
+    """(direction, rows after the move) for every direction that changes the board"""
+    found = []
+    for direction, right in ((LEFT, False), (RIGHT, True)):
+        lines, moved = slide_rows(rows, size, right)
+        if moved:
+            found.append((direction, tuple(lines)))
+    columns = transpose(rows, size)
+    for direction, right in ((UP, False), (DOWN, True)):
+        lines, moved = slide_rows(columns, size, right)
+        if moved:
+            found.append((direction, tuple(transpose(lines, size))))
+    return found
+
+
+class Search:
+    """Expectimax to a fixed depth that gives up once the deadline passed"""
+
+    def __init__(self, size, deadline, spawn_cells=HINT_SPAWN_CELLS, table=_table):
+        self.size = size
+        self.deadline = deadline
+        self.spawn_cells = spawn_cells
+        self.table = table
+
+    def best_move(self, rows, depth):
+        """(direction, value) of the best move looking `depth` moves ahead"""
+        best = None
+        for direction, after in successors(rows, self.size):
+            value = self._chance(after, depth - 1)
+            if best is None or value > best[1]:
+                best = (direction, value)
+        return best
+
+    def _max(self, rows, depth):
+        best = None
+        for _, after in successors(rows, self.size):
+            value = self._chance(after, depth - 1)
+            if best is None or value > best:
+                best = value
+        if best is None:
+            # Lost: the board without the LOST_PENALTY each of its rows and columns earns for
+            # being alive, so it ranks far below the boards that go on, however heavy their tiles are
+            return evaluate(rows, self.size) - 2 * self.size * LOST_PENALTY
+        return best
+
+    def _chance(self, rows, depth):
+        if depth == 0:
+            return evaluate(rows, self.size)
+        value = self.table.get(rows, depth)
+        if value is not None:
+            return value
+        if time() > self.deadline:
+            raise SearchTimeout()
+        empty = [
+            (i, CELL_BITS * j) for i, row in enumerate(rows) for j in range(self.size)
+            if not (row >> (CELL_BITS * j)) & CELL_MASK
+        ]
+        if len(empty) > self.spawn_cells:
+            # Big boards have dozens of empty cells, spread the sampled ones over the board
+            step = len(empty) / self.spawn_cells
+            empty = [empty[int(k * step)] for k in range(self.spawn_cells)]
+        total = 0
+        for i, shift in empty:
+            for exponent, probability in SPAWNS:
+                spawned = rows[:i] + (rows[i] | exponent << shift,) + rows[i + 1:]
+                total += probability * self._max(spawned, depth)
+        value = total / len(empty)
+        self.table.put(rows, depth, value)
+        return value
+
+
+def search(rows, deadline, max_depth=MAX_DEPTH):
+    """Deepen the search of a packed board until the deadline, return (direction, depth completed)
+
+    Depth 1 always completes, so a search that starts late still answers.
+    """
+    rows = tuple(rows)
+    size = len(rows)
+    moves = successors(rows, size)
+    if len(moves) <= 1:
+        return (moves[0][0] if moves else None), 0
+    searcher = Search(size, deadline)
+    best, depth = None, 0
+    for depth_limit in range(1, max_depth + 1):
+        started = time()
+        try:
+            best = searcher.best_move(rows, depth_limit)
+        except SearchTimeout:
+            break
+        depth = depth_limit
+        # The next depth takes several times longer than this one, don't start what can't finish
+        if time() + (time() - started) * 2 > deadline:
+            break
+    return best[0], depth
+
+def suggest_move(board, budget=HINT_TIME_BUDGET):
+    """Best move for a board of tile values searched for about `budget` seconds, in this process"""
+    return search(BitBoard.from_lists(board).rows, time() + budget)[0]
+
+
+_pool = None
+_replies = None
+_pool_lock = threading.Lock()
+# Users with a search running, a user gets one at a time
+_pending = set()
+
+def hint_pool():
+    """The search pool, started on the first hint"""
+    global _pool, _replies
+    with _pool_lock:
+        if _pool is None:
+            if multiprocessing.current_process().daemon:
+                # Daemonic shard processes can't have children, the shard's own core searches instead
+                _pool = ThreadPoolExecutor(max_workers=HINT_WORKERS, thread_name_prefix="hint")
+            else:
+                _pool = ProcessPoolExecutor(max_workers=HINT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _replies = ThreadPoolExecutor(max_workers=HINT_WORKERS, thread_name_prefix="hint-reply")
+        return _pool
+
+def _claim(user_id):
+    with _pool_lock:
+        if user_id in _pending or len(_pending) >= HINT_MAX_PENDING:
+            return False
+        _pending.add(user_id)
+        return True
+
+def _record(size, started, depth):
+    HINT_SECONDS.observe(time() - started, size)
+    HINT_DEPTH.inc(depth)
+
+def _reply(reply, direction):
+    try:
+        reply(direction)
+    except Exception as e:
+        logger.error(f"Failed to send a hint: {e}")
+
+def request_hint(user_id, board, reply):
+    """Search a player's board in the pool, then call reply(direction or None) on a reply thread
+
+    Return False without searching when the player already waits for a hint or the pool is busy.
+    """
+    if not _claim(user_id):
+        return False
+    started = time()
+    try:
+        future = hint_pool().submit(search, BitBoard.from_lists(board).rows, started + HINT_TIME_BUDGET)
+        replies = _replies
+    except Exception:
+        with _pool_lock:
+            _pending.discard(user_id)
+        raise
+
+    def done(future):
+        with _pool_lock:
+            _pending.discard(user_id)
+        try:
+            direction, depth = future.result()
+        except Exception as e:
+            logger.error(f"Hint search for user {user_id} failed: {e}")
+            direction = None
+        else:
+            _record(len(board), started, depth)
+        try:
+            replies.submit(_reply, reply, direction)
+        except RuntimeError:
+            logger.warning(f"Dropped the hint of user {user_id}, shutting down")
+
+    future.add_done_callback(done)
+    return True
+
+async def request_hint_async(user_id, board):
+    """request_hint for the event loop: the suggested direction, None when it failed or the pool is busy"""
+    if not _claim(user_id):
+        return None
+    started = time()
+    try:
+        direction, depth = await asyncio.get_running_loop().run_in_executor(
+            hint_pool(), search, BitBoard.from_lists(board).rows, started + HINT_TIME_BUDGET
+        )
+    except Exception as e:
+        logger.error(f"Hint search for user {user_id} failed: {e}")
+        return None
+    finally:
+        with _pool_lock:
+            _pending.discard(user_id)
+    _record(len(board), started, depth)
+    return direction
+
+def close_hints():
+    """Stop the search pool on shutdown, dropping searches nobody will wait for"""
+    global _pool, _replies
+    with _pool_lock:
+        pool, replies = _pool, _replies
+        _pool = _replies = None
+    # Outside the lock, finishing searches release their user in their done callback
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+        replies.shutdown(wait=True)
@@ -0,0 +1,283 @@
+import threading
+from bisect import bisect_left
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import perf_counter, time
+from config import logger, METRICS_LISTEN, METRICS_PORT
+
+# Upper bounds in seconds, from a cached SQLite read up to a stuck Telegram request
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds in bytes of a game message's text plus keyboard JSON
+PAYLOAD_BUCKETS = (256, 512, 1024, 2048, 4096, 8192)
+
+
+class Counter:
+    """Monotonic count per label value"""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label=None, amount=1):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label, value in sorted(self.values().items(), key=lambda item: str(item[0])):
+            lines.append(f"{self.name}{_labels(self.label, label)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from a function at scrape time, so keeping it current costs nothing"""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._read = None
+
+    def set_function(self, read):
+        self._read = read
+
+    def value(self):
+        if self._read is None:
+            return None
+        try:
+            return self._read()
+        except Exception as e:
+            logger.warning(f"Failed to read gauge {self.name}: {e}")
+            return None
+
+    def render(self):
+        value = self.value()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Histogram:
+    """Bucketed durations per label value, an observation is one bisect and one locked increment"""
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, label=None):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            try:
+                series = self._series[label]
+            except KeyError:
+                series = self._series[label] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += seconds
+
+    def series(self):
+        with self._lock:
+            return {label: list(series) for label, series in self._series.items()}
+
+    def quantile(self, q, label=None):
+        """Estimate a quantile by interpolating inside its bucket"""
+        series = self.series().get(label)
+        if not series:
+            return None
+        counts = series[:-1]
+        target = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= target:
+                low = self.buckets[i - 1] if i else 0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (target - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def time(self, label=None):
+        """Decorator recording how long each call of a plain function takes"""
+        def decorator(func):
+            name = label if label is not None else func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(perf_counter() - started, name)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, series in sorted(self.series().items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label, label, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, label)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label, label)} {cumulative}")
+        return lines
+
+
+def _labels(name, value, **extra):
+    pairs = [(name, value)] if name and value is not None else []
+    pairs += extra.items()
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{str(val).replace(chr(34), chr(39))}"' for key, val in pairs) + "}"
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in each update handler", "handler")
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", "handler")
+API_SECONDS = Histogram("bot_telegram_api_seconds", "Bot API request duration by method", "method")
+API_ERRORS = Counter("bot_telegram_api_errors_total", "Failed Bot API requests by method and error", "error")
+DB_SECONDS = Histogram("bot_db_query_seconds", "Time spent in each database.py function", "query")
+RATE_LIMIT_BLOCKS = Counter("bot_rate_limit_blocks_total", "Users blocked for sending too fast")
+SCORES_REJECTED = Counter("bot_scores_rejected_total", "Finished games whose move log didn't replay to their score")
+ACTIVE_SESSIONS = Gauge("bot_active_sessions", "Games kept in memory")
+BLOCKED_USERS = Gauge("bot_rate_limited_users", "Users currently blocked by the rate limiter")
+PENDING_WRITES = Gauge("bot_pending_writes", "Users, games and leaderboard entries waiting for the next write")
+HINT_SECONDS = Histogram("bot_hint_seconds", "Time from a hint request to its answer by board size", "size")
+HINT_DEPTH = Counter("bot_hint_depth_total", "Hints by the search depth they completed", "depth")
+EDIT_PAYLOAD_BYTES = Histogram(
+    "bot_game_message_bytes", "Size of each rendered game message, text plus keyboard, by render mode", "mode", PAYLOAD_BUCKETS
+)
+STARTED = time()
+
+METRICS = (
+    HANDLER_SECONDS, HANDLER_ERRORS, API_SECONDS, API_ERRORS, DB_SECONDS, RATE_LIMIT_BLOCKS, SCORES_REJECTED,
+    ACTIVE_SESSIONS, BLOCKED_USERS, PENDING_WRITES, HINT_SECONDS, HINT_DEPTH, EDIT_PAYLOAD_BYTES,
+)
+
+
+def timed(histogram, label, func, errors=None):
+    """Wrap func so every call is observed in histogram under label"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            histogram.observe(perf_counter() - started, label)
+            if errors is not None:
+                errors.inc(label)
+            raise
+        if hasattr(result, "__await__"):
+            return _finish(result, started, histogram, label, errors)
+        histogram.observe(perf_counter() - started, label)
+        return result
+    return wrapper
+
+async def _finish(awaitable, started, histogram, label, errors):
+    try:
+        return await awaitable
+    except Exception:
+        if errors is not None:
+            errors.inc(label)
+        raise
+    finally:
+        histogram.observe(perf_counter() - started, label)
+
+def _api_error(method, error):
+    code = getattr(error, "error_code", None)
+    return f"{method}:{code or type(error).__name__}"
+
+def instrument_api():
+    """Time every Bot API request of the sync and async telebot helpers, once per process"""
+    from telebot import apihelper
+    if getattr(apihelper._make_request, "instrumented", False):
+        return
+    make_request = apihelper._make_request
+
+    def sync_request(token, method_name, *args, **kwargs):
+        started = perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(_api_error(method_name, e))
+            raise
+        finally:
+            API_SECONDS.observe(perf_counter() - started, method_name)
+
+    sync_request.instrumented = True
+    apihelper._make_request = sync_request
+    try:
+        from telebot import asyncio_helper
+    except ImportError:
+        return
+    process_request = asyncio_helper._process_request
+
+    async def async_request(token, url, *args, **kwargs):
+        started = perf_counter()
+        try:
+            return await process_request(token, url, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(_api_error(url, e))
+            raise
+        finally:
+            API_SECONDS.observe(perf_counter() - started, url)
+
+    asyncio_helper._process_request = async_request
+
+def instrument_bot(bot, router, game_state, rate_limiter):
+    """Time every message and callback handler and publish the session and rate limit gauges"""
+    for handler in bot.message_handlers:
+        function = handler["function"]
+        handler["function"] = timed(HANDLER_SECONDS, function.__name__, function, HANDLER_ERRORS)
+    router.wrap(lambda name, handler: timed(HANDLER_SECONDS, f"callback_{name}", handler, HANDLER_ERRORS))
+    ACTIVE_SESSIONS.set_function(lambda: len(game_state))
+    BLOCKED_USERS.set_function(rate_limiter.blocked_count)
+    instrument_api()
+
+
+def render():
+    """Every metric in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += ["# TYPE bot_uptime_seconds gauge", f"bot_uptime_seconds {time() - STARTED:.0f}"]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(host=METRICS_LISTEN, port=METRICS_PORT):
+    """Serve /metrics in a background thread, return None when METRICS_PORT is 0"""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = MetricsHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,18 +1,222 @@
-# Python Scriptt to migrate from JSON to SQLite 
+"""Import users and leaderboard rows from JSON or JSONL exports into SQLite
 
+Files are parsed a chunk at a time, so memory stays flat however big the export is. Each batch
+is inserted with one executemany in its own transaction together with a checkpoint, an
+interrupted import seeks to the byte offset right after the last saved batch when run again.
+
+Run with: python migrate.py --users users.json --leaderboard leaderboard.json
+"""
+import argparse
+import io
 import json
-from database import init_db, add_user
+import os
+from itertools import islice
+from time import perf_counter
+from database import init_db, get_import_checkpoint, import_users, import_leaderboard_entries
 
 USERS_JSON = "users.json"
+LEADERBOARD_JSON = "leaderboard.json"
+CHUNK_SIZE = 1 << 16
+PROGRESS_INTERVAL = 2
+_decoder = json.JSONDecoder()
+
+
+class _JSONReader:
+    """Pull JSON values one at a time out of a file read in chunks, `offset` bytes into the file"""
+
+    def __init__(self, f, offset=0):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        # UTF-8 bytes of the file up to buffer[counted]
+        self.offset = offset
+        self.counted = 0
+
+    def tell(self):
+        """Byte offset of the reading position in the file"""
+        self.offset += len(self.buffer[self.counted:self.pos].encode("utf-8"))
+        self.counted = self.pos
+        return self.offset
+
+    def _fill(self):
+        self.tell()
+        chunk = self.f.read(CHUNK_SIZE)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = self.counted = 0
+        return bool(chunk)
+
+    def peek(self):
+        """Next non-whitespace character, "" at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char or 'the end of the file'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the chunk end ("12" of "123", "2" of "2.5") decodes fine too,
+            # so read on while only number characters follow it
+            if isinstance(value, (int, float)) and not self.buffer[end:].strip("0123456789.eE+-") and self._fill():
+                continue
+            self.pos = end
+            return value
+
+def _text(raw):
+    # newline="" keeps "\r\n" as two characters, so byte offsets count them both
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+def iter_json(f, opening=None, offset=0):
+    """Yield (key, value, byte offset after it) of each member of a top-level object, or (None, item, offset)
+    of an array. Given the opening bracket, f is `offset` bytes in, right after a value yielded before."""
+    reader = _JSONReader(f, offset)
+    if opening is None:
+        opening = reader.expect("[{")
+        closing = "]" if opening == "[" else "}"
+        if reader.peek() == closing:
+            return
+    else:
+        closing = "]" if opening == "[" else "}"
+        if reader.expect("," + closing) == closing:
+            return
+    while True:
+        key = None
+        if opening == "{":
+            key = reader.value()
+            reader.expect(":")
+        yield key, reader.value(), reader.tell()
+        if reader.expect("," + closing) == closing:
+            return
+
+def iter_jsonl(f, skip=0, offset=0):
+    """Yield (None, value, byte offset after it) for each non-empty line of a binary file `offset` bytes in,
+    the first `skip` are passed over without parsing"""
+    for line in f:
+        offset += len(line)
+        if not line.strip():
+            continue
+        if skip:
+            skip -= 1
+            continue
+        yield None, json.loads(line), offset
+
+def iter_records(path, skip=0, offset=None):
+    """Records of a .json or .jsonl (.ndjson) export with the byte offset after each, starting at a
+    byte offset or, without one, after the first `skip` records"""
+    with open(path, "rb") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            if offset:
+                f.seek(offset)
+                yield from iter_jsonl(f, 0, offset)
+            else:
+                yield from iter_jsonl(f, skip)
+        elif offset:
+            text = _text(f)
+            opening = _JSONReader(text).expect("[{")
+            # Let go of f without closing it
+            text.detach()
+            f.seek(offset)
+            yield from iter_json(_text(f), opening, offset)
+        else:
+            yield from islice(iter_json(_text(f)), skip, None)
+
+
+def user_row(key, record):
+    """(id, username) of a user record, or of an id -> record / username mapping entry"""
+    if isinstance(record, dict):
+        user_id = record.get("id", record.get("user_id", key))
+        username = record.get("username") or record.get("first_name") or record.get("name")
+    else:
+        user_id, username = key, record
+    return int(user_id), username or "ندارد"
+
+def leaderboard_row(key, record):
+    """(user_id, name, score, time, size) of a leaderboard record or of a user_id -> record entry, size None if missing"""
+    user_id = record.get("user_id", record.get("id", key))
+    size = record.get("size")
+    return (
+        int(user_id), record.get("name") or str(user_id), int(record["score"]), int(record.get("time", 0)),
+        None if size is None else int(size)
+    )
+
+# What each table imports with: row builder and batch insert
+IMPORTERS = {
+    "users": (user_row, import_users),
+    "leaderboard": (leaderboard_row, import_leaderboard_entries),
+}
+
+
+def import_file(table, path, batch_size, restart=False):
+    """Import one export into a table in batches, return (records read, rows inserted, records skipped)"""
+    to_row, insert = IMPORTERS[table]
+    source = f"{table}:{os.path.abspath(path)}"
+    position, offset = (0, 0) if restart else get_import_checkpoint(source)
+    if position:
+        print(f"{table}: resuming {path} after {position:,} records")
+    records = iter_records(path, position, offset)
+    read = inserted = skipped = 0
+    started = last_report = perf_counter()
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows = []
+        for key, record, offset in batch:
+            try:
+                rows.append(to_row(key, record))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                skipped += 1
+                if skipped <= 10:
+                    print(f"{table}: skipped malformed record {record!r:.200}")
+        position += len(batch)
+        read += len(batch)
+        inserted += insert(rows, source, position, offset)
+        now = perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            print(f"{table}: {read:,} records, {inserted:,} inserted ({read / (now - started):,.0f} rows/s)")
+    elapsed = perf_counter() - started
+    print(
+        f"{table}: {read:,} records from {path} in {elapsed:.1f}s ({read / max(elapsed, 1e-9):,.0f} rows/s), "
+        f"{inserted:,} inserted, {read - inserted - skipped:,} already there, {skipped:,} malformed"
+    )
+    return read, inserted, skipped
 
 def migrate():
-    """Read users from JSON and insert into SQLite database."""
+    """Import the user and leaderboard exports given on the command line"""
+    parser = argparse.ArgumentParser(description="Import JSON or JSONL exports into the bot's SQLite database")
+    parser.add_argument("--users", help=f"users export (default {USERS_JSON} if it exists)")
+    parser.add_argument("--leaderboard", help=f"leaderboard export (default {LEADERBOARD_JSON} if it exists)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per transaction")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints and read the files from the start")
+    args = parser.parse_args()
+
+    jobs = [
+        (table, path or (default if os.path.exists(default) else None))
+        for table, path, default in (("users", args.users, USERS_JSON), ("leaderboard", args.leaderboard, LEADERBOARD_JSON))
+    ]
+    jobs = [(table, path) for table, path in jobs if path]
+    if not jobs:
+        parser.error(f"nothing to import, pass --users or --leaderboard or put {USERS_JSON} here")
     init_db()
-    with open(USERS_JSON, "r", encoding="utf-8") as f:
-        users = json.load(f)
-        for user in users:
-            add_user(user["id"], user["username"])
-    print(f"{len(users)} users migrated successfully to SQLite.")
+    for table, path in jobs:
+        import_file(table, path, args.batch_size, args.restart)
 
 if __name__ == "__main__":
     migrate()
@@ -0,0 +1,173 @@
+"""Each player's position on a leaderboard, from an in-memory order-statistic tree kept in sync with SQLite
+
+A board is read from SQLite in full once per process, after that each lookup first applies only
+the rows written since its last sync, found through the updated_at index. Finding a rank walks
+one path of the tree, O(log n), instead of counting the better rows on every request.
+"""
+import random
+import threading
+from time import time
+from database import get_rank_rows
+
+# Keys sort like ORDER BY score DESC, time ASC, ties broken by user id
+SCORE_LIMIT = 1 << 40
+TIME_LIMIT = (1 << 32) - 1
+# Rows are stamped before their transaction commits, so a sync also re-reads the last few
+# seconds to catch rows another process committed late. Applying a row again changes nothing.
+SYNC_SLACK = 5
+
+
+def rank_key(user_id, score, time_value):
+    """One int ordering entries best first"""
+    return ((SCORE_LIMIT - score) << 96) | (min(max(time_value, 0), TIME_LIMIT) << 64) | user_id
+
+
+class _Node:
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+def _split(node, key):
+    """(keys below key, keys from key on)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        node.size = 1 + _size(node.left) + _size(node.right)
+        return node, right
+    left, node.left = _split(node.left, key)
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return left, node
+
+def _merge(left, right):
+    """Join two treaps whose keys don't overlap, every key of left below every key of right"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.size = 1 + _size(left.left) + _size(left.right)
+        return left
+    right.left = _merge(left, right.left)
+    right.size = 1 + _size(right.left) + _size(right.right)
+    return right
+
+
+class RankTree:
+    """Treap of distinct int keys that also counts the keys below any key"""
+
+    def __init__(self, keys=()):
+        self.root = self._build(sorted(keys))
+
+    def __len__(self):
+        return _size(self.root)
+
+    @staticmethod
+    def _build(keys):
+        # Balanced shape, then priorities that fall level by level keep it a valid treap
+        def build(low, high):
+            if low >= high:
+                return None
+            middle = (low + high) // 2
+            node = _Node(keys[middle], 0)
+            node.left = build(low, middle)
+            node.right = build(middle + 1, high)
+            node.size = high - low
+            return node
+
+        root = build(0, len(keys))
+        priorities = sorted((random.random() for _ in keys), reverse=True)
+        level = [root] if root is not None else []
+        k = 0
+        while level:
+            following = []
+            for node in level:
+                node.priority = priorities[k]
+                k += 1
+                following += [child for child in (node.left, node.right) if child is not None]
+            level = following
+        return root
+
+    def insert(self, key):
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key, random.random())), right)
+
+    def remove(self, key):
+        left, right = _split(self.root, key)
+        _, right = _split(right, key + 1)
+        self.root = _merge(left, right)
+
+    def rank(self, key):
+        """How many keys are below key"""
+        below = 0
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                below += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return below
+
+
+class _Board:
+    __slots__ = ("tree", "keys", "synced_at")
+
+    def __init__(self, rows, synced_at):
+        self.keys = {user_id: rank_key(user_id, score, time_value) for user_id, score, time_value, _ in rows}
+        self.tree = RankTree(self.keys.values())
+        self.synced_at = synced_at
+
+    def apply(self, rows):
+        for user_id, score, time_value, _ in rows:
+            key = rank_key(user_id, score, time_value)
+            old = self.keys.get(user_id)
+            if old == key:
+                continue
+            if old is not None:
+                self.tree.remove(old)
+            self.tree.insert(key)
+            self.keys[user_id] = key
+
+
+class RankIndex:
+    """Ranks on every level's leaderboard (size None is the all-sizes one), loaded on first use"""
+
+    def __init__(self, manager=None):
+        # Reads the process-wide database unless given another ConnectionManager
+        self.manager = manager
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def rank(self, user_id, size=None):
+        """(position from 1, players on the board), None when the user has no score there"""
+        with self._lock:
+            board = self._sync(size)
+            key = board.keys.get(int(user_id))
+            if key is None:
+                return None
+            return board.tree.rank(key) + 1, len(board.tree)
+
+    def _sync(self, size):
+        started = time()
+        board = self._boards.get(size)
+        if board is None:
+            board = self._boards[size] = _Board(get_rank_rows(size, manager=self.manager), started)
+        else:
+            board.apply(get_rank_rows(size, board.synced_at - SYNC_SLACK, self.manager))
+            board.synced_at = started
+        return board
+
+
+# Every handler of this process looks ranks up in this one
+rank_index = RankIndex()
@@ -0,0 +1,187 @@
+import heapq
+import threading
+from collections import OrderedDict
+from time import time
+from config import (
+    logger, RATE_LIMIT_BACKEND, RATE_LIMIT_WINDOW, RATE_LIMIT_BURST, RATE_LIMIT_BLOCK,
+    RATE_LIMIT_MAX_ENTRIES, RATE_LIMIT_TTL,
+)
+from database import db as default_db
+from metrics import DB_SECONDS, RATE_LIMIT_BLOCKS
+
+
+class RateLimitPolicy:
+    """Allow `burst` messages per `window` seconds, then block for `block` seconds"""
+    __slots__ = ("window", "burst", "block")
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST, block=RATE_LIMIT_BLOCK):
+        self.window = window
+        self.burst = burst
+        self.block = block
+
+    def apply(self, count, window_start, blocked_until, now):
+        """Count one message, return (allowed, just_blocked, count, window_start, blocked_until)"""
+        if now < blocked_until:
+            return False, False, count, window_start, blocked_until
+        if now - window_start > self.window:
+            count, window_start = 0, now
+        count += 1
+        if count > self.burst:
+            return False, True, count, window_start, now + self.block
+        return True, False, count, window_start, blocked_until
+
+
+class _Entry:
+    __slots__ = ("count", "window_start", "blocked_until", "last_seen")
+
+    def __init__(self, now):
+        self.count = 0
+        self.window_start = now
+        self.blocked_until = 0.0
+        self.last_seen = now
+
+
+class MemoryRateLimitStore:
+    """Per-process counters, least recently seen users are evicted first but blocked users never are"""
+
+    def __init__(self, max_entries=RATE_LIMIT_MAX_ENTRIES, ttl=RATE_LIMIT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Users that aren't blocked, least recently seen first
+        self._entries = OrderedDict()
+        # Blocked users apart from them, and (block end, user) by end so finished blocks leave in order
+        self._blocked = {}
+        self._block_ends = []
+        self._lock = threading.Lock()
+
+    def hit(self, user_id, policy, now):
+        with self._lock:
+            self._unblock(now)
+            entry = self._blocked.pop(user_id, None) or self._entries.pop(user_id, None) or _Entry(now)
+            allowed, just_blocked, entry.count, entry.window_start, entry.blocked_until = policy.apply(
+                entry.count, entry.window_start, entry.blocked_until, now
+            )
+            entry.last_seen = now
+            if now < entry.blocked_until:
+                self._blocked[user_id] = entry
+                if just_blocked:
+                    heapq.heappush(self._block_ends, (entry.blocked_until, user_id))
+            else:
+                self._entries[user_id] = entry
+            self._evict(now)
+            return allowed, just_blocked, entry.blocked_until
+
+    def _unblock(self, now):
+        ends = self._block_ends
+        while ends and ends[0][0] <= now:
+            blocked_until, user_id = heapq.heappop(ends)
+            entry = self._blocked.get(user_id)
+            # A user blocked again since has a newer end further back in the heap
+            if entry is not None and entry.blocked_until == blocked_until:
+                del self._blocked[user_id]
+                # Blocks end in order and before any later hit is counted, so an entry seen
+                # last when its block ended still belongs at the end
+                entry.last_seen = blocked_until
+                self._entries[user_id] = entry
+
+    def _evict(self, now):
+        # Entries are ordered by last_seen, so expired ones are all at the front
+        entries = self._entries
+        while entries and next(iter(entries.values())).last_seen + self.ttl < now:
+            entries.popitem(last=False)
+        # Blocked users count toward the cap but aren't dropped, that would lift their block
+        while len(entries) > max(self.max_entries - len(self._blocked), 1):
+            entries.popitem(last=False)
+
+    def blocked_count(self, now):
+        with self._lock:
+            self._unblock(now)
+            return len(self._blocked)
+
+    def __len__(self):
+        return len(self._entries) + len(self._blocked)
+
+
+class SQLiteRateLimitStore:
+    """Counters shared by every process using the same database file"""
+
+    def __init__(self, db=default_db, max_entries=RATE_LIMIT_MAX_ENTRIES, ttl=RATE_LIMIT_TTL, cleanup_interval=60):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0
+
+    @DB_SECONDS.time("rate_limit_hit")
+    def hit(self, user_id, policy, now):
+        conn = self.db.connection()
+        # IMMEDIATE takes the write lock up front so two processes can't both read the old count
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT count, window_start, blocked_until FROM rate_limits WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            count, window_start, blocked_until = row if row else (0, now, 0.0)
+            allowed, just_blocked, count, window_start, blocked_until = policy.apply(count, window_start, blocked_until, now)
+            conn.execute("""
+            INSERT INTO rate_limits (user_id, count, window_start, blocked_until, last_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                count = excluded.count,
+                window_start = excluded.window_start,
+                blocked_until = excluded.blocked_until,
+                last_seen = excluded.last_seen
+            """, (user_id, count, window_start, blocked_until, now))
+            if now - self._last_cleanup >= self.cleanup_interval:
+                self._last_cleanup = now
+                self._evict(conn, now)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return allowed, just_blocked, blocked_until
+
+    def blocked_count(self, now):
+        return self.db.connection().execute("SELECT COUNT(*) FROM rate_limits WHERE blocked_until > ?", (now,)).fetchone()[0]
+
+    def _evict(self, conn, now):
+        expired = conn.execute(
+            "DELETE FROM rate_limits WHERE last_seen < ? AND blocked_until < ?", (now - self.ttl, now)
+        ).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM rate_limits WHERE user_id IN "
+                "(SELECT user_id FROM rate_limits WHERE blocked_until <= ? ORDER BY last_seen LIMIT ?)",
+                (now, overflow)
+            )
+        logger.debug(f"Evicted {expired + max(overflow, 0)} rate limit entries")
+
+
+class RateLimiter:
+    """Apply one policy to every user through a pluggable store"""
+
+    def __init__(self, policy=None, store=None):
+        self.policy = policy if policy is not None else RateLimitPolicy()
+        self.store = store if store is not None else MemoryRateLimitStore()
+
+    def hit(self, user_id, now=None):
+        """Count a message, return (allowed, just_blocked, seconds left in the block)"""
+        now = time() if now is None else now
+        allowed, just_blocked, blocked_until = self.store.hit(user_id, self.policy, now)
+        if just_blocked:
+            RATE_LIMIT_BLOCKS.inc()
+        return allowed, just_blocked, max(blocked_until - now, 0)
+
+    def blocked_count(self, now=None):
+        """How many users are blocked right now"""
+        return self.store.blocked_count(time() if now is None else now)
+
+
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND):
+    """Build the rate limiter selected in the config"""
+    if backend == "sqlite":
+        return RateLimiter(store=SQLiteRateLimitStore())
+    if backend == "memory":
+        return RateLimiter(store=MemoryRateLimitStore())
+    raise ValueError(f"Unknown rate limit backend: {backend}")
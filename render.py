@@ -0,0 +1,207 @@
+import html
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from time import time
+from telebot import types
+from config import logger
+from callbacks import user_token, DUMMY, UP, DOWN, LEFT, RIGHT, END, HINT, MODE
+from database import get_top_n, get_leaderboard_version, LEADERBOARD_SIZE
+from ranking import rank_index
+import metrics
+
+EMPTY_TILE = "⚫"
+# Text mode: every cell is right-aligned to the widest tile (2048), empty cells show a dot
+TEXT_EMPTY_TILE = "·"
+TEXT_TILE_WIDTH = 4
+# Telegram rejects inline keyboard rows with more buttons than this
+MAX_ROW_BUTTONS = 8
+# Stands in for the user token inside cached JSON so rows can be shared by every player
+USER_MARK = "@user@"
+# How many sent messages we remember the last text and markup of
+MAX_TRACKED_MESSAGES = 10000
+
+
+class SerializedMarkup(types.JsonSerializable):
+    """Inline keyboard built from rows that are already serialized to JSON"""
+    __slots__ = ("rows", "_json")
+
+    def __init__(self, rows):
+        self.rows = rows
+        self._json = None
+
+    def to_json(self):
+        if self._json is None:
+            self._json = '{"inline_keyboard":[' + ",".join(self.rows) + "]}"
+        return self._json
+
+
+def _button(text, callback_data):
+    return {"text": text, "callback_data": callback_data}
+
+@lru_cache(maxsize=8192)
+def tile_row_json(values):
+    """Serialized row of tile buttons, cached by tile values"""
+    buttons = [_button(str(value) if value != 0 else EMPTY_TILE, DUMMY) for value in values]
+    # Wide boards wrap onto a second keyboard row, like InlineKeyboardMarkup.row does
+    return ",".join(
+        json.dumps(buttons[k:k + MAX_ROW_BUTTONS]) for k in range(0, len(buttons), MAX_ROW_BUTTONS)
+    )
+
+@lru_cache(maxsize=8192)
+def text_row(values):
+    """Monospace line of a board row, cached by tile values"""
+    return " ".join(str(value).rjust(TEXT_TILE_WIDTH) if value != 0 else TEXT_EMPTY_TILE.rjust(TEXT_TILE_WIDTH) for value in values)
+
+@lru_cache(maxsize=2)
+def control_rows_json(text_mode=False):
+    """Serialized direction and end-game rows of a render mode, built once"""
+    # The third button switches to the other mode
+    switch = _button("🔢 دکمه‌ای", MODE + USER_MARK) if text_mode else _button("🔤 متنی", MODE + USER_MARK)
+    return (
+        json.dumps([_button("💡 راهنما", HINT + USER_MARK), _button("↑", UP + USER_MARK), switch]),
+        json.dumps([_button("←", LEFT + USER_MARK), _button("↓", DOWN + USER_MARK), _button("→", RIGHT + USER_MARK)]),
+        json.dumps([_button("دیگه نمیخوام بازی کنم ! ", END + USER_MARK)]),
+    )
+
+def build_game_keyboard(board, user_id, text_mode=False):
+    """Create inline keyboard for game board, only the controls in text mode"""
+    rows = [] if text_mode else [tile_row_json(tuple(row)) for row in board]
+    token = user_token(user_id)
+    rows.extend(row.replace(USER_MARK, token) for row in control_rows_json(text_mode))
+    return SerializedMarkup(rows)
+
+def game_message(board, user_id, status, text_mode=False):
+    """edit_message arguments showing a game: status text and tile buttons, or the board drawn in a <pre> block"""
+    markup = build_game_keyboard(board, user_id, text_mode)
+    if text_mode:
+        text = html.escape(status) + "\n<pre>" + "\n".join(text_row(tuple(row)) for row in board) + "</pre>"
+        message = {"text": text, "reply_markup": markup, "parse_mode": "HTML"}
+    else:
+        message = {"text": status, "reply_markup": markup}
+    metrics.EDIT_PAYLOAD_BYTES.observe(
+        len(message["text"].encode()) + len(markup.to_json().encode()), "text" if text_mode else "buttons"
+    )
+    return message
+
+
+# Callback answers of the hint button
+HINT_TEXTS = {UP: "⬆️ بالا", DOWN: "⬇️ پایین", LEFT: "⬅️ چپ", RIGHT: "➡️ راست"}
+HINT_BUSY_TEXT = "الان نمی‌تونم راهنمایی کنم، چند لحظه دیگه دوباره امتحان کن 🙏"
+
+def hint_text(direction):
+    """Callback answer for a suggested direction, or the busy text when there is none"""
+    if direction is None:
+        return HINT_BUSY_TEXT
+    return f"💡 پیشنهاد من: {HINT_TEXTS[direction]}"
+
+
+# Last (text, markup JSON) we put in each message, keyed by (chat_id, message_id)
+_last_sent = OrderedDict()
+_last_sent_lock = threading.Lock()
+
+def _markup_json(markup):
+    return markup.to_json() if markup is not None else None
+
+def _unchanged(key, content):
+    with _last_sent_lock:
+        if _last_sent.get(key) == content:
+            _last_sent.move_to_end(key)
+            logger.debug(f"Skipped unchanged edit of message {key[1]} in chat {key[0]}")
+            return True
+    return False
+
+def _remember(key, content):
+    with _last_sent_lock:
+        _last_sent[key] = content
+        _last_sent.move_to_end(key)
+        while len(_last_sent) > MAX_TRACKED_MESSAGES:
+            _last_sent.popitem(last=False)
+
+def edit_message(bot, chat_id, message_id, text, reply_markup=None, **kwargs):
+    """Edit a message unless it already shows this text and markup, return whether it was sent"""
+    key = (chat_id, message_id)
+    content = (text, _markup_json(reply_markup))
+    if _unchanged(key, content):
+        return False
+    bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup, **kwargs)
+    _remember(key, content)
+    return True
+
+async def edit_message_async(bot, chat_id, message_id, text, reply_markup=None, **kwargs):
+    """edit_message for AsyncTeleBot"""
+    key = (chat_id, message_id)
+    content = (text, _markup_json(reply_markup))
+    if _unchanged(key, content):
+        return False
+    await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup, **kwargs)
+    _remember(key, content)
+    return True
+
+
+# Board sizes with a leaderboard of their own, as the level menu names them
+LEVELS = {5: "آسون (۵×۵)", 7: "متوسط (۷×۷)", 9: "سخت (۹×۹)"}
+# The all-sizes board, scores saved before per-level boards existed are only there
+ALL_LEVELS = (None, "همه سطح‌ها")
+
+# Last rendered /leaderboard text and the leaderboard version it was built from
+leaderboard_message = {"version": None, "text": None}
+
+def render_leaderboard():
+    """Return the best players of every level and over all levels, rebuilt only after a top changed"""
+    version = get_leaderboard_version()
+    if leaderboard_message["version"] != version:
+        sections = []
+        for size, level in (*LEVELS.items(), ALL_LEVELS):
+            top = get_top_n(LEADERBOARD_SIZE, size)
+            if top:
+                lines = [f"{i}. {data['name']} - امتیاز: {data['score']} | زمان: {data['time']} ثانیه" for i, data in enumerate(top, 1)]
+                sections.append(f"**{level}**\n" + "\n".join(lines))
+        message_text = None
+        if sections:
+            message_text = "🏆 **لیدربورد بهترین بازیکنان (۵ نفر اول هر سطح)** 🏆\n\n" + "\n\n".join(sections)
+        leaderboard_message.update(version=version, text=message_text)
+    return leaderboard_message["text"]
+
+def render_rank(user_id):
+    """The /rank text: a player's position on each level and over all levels, None without any score"""
+    lines = []
+    for size, level in (*LEVELS.items(), ALL_LEVELS):
+        rank = rank_index.rank(user_id, size)
+        if rank is not None:
+            lines.append(f"{level}: نفر {rank[0]} از {rank[1]}")
+    if not lines:
+        return None
+    return "🥇 رتبه تو در لیدربورد:\n\n" + "\n".join(lines)
+
+
+def _latency_lines(histogram, limit):
+    """'name: count calls, p50/p95 ms' for the busiest labels of a histogram"""
+    busiest = sorted(histogram.series().items(), key=lambda item: -sum(item[1][:-1]))[:limit]
+    return [
+        f"{label}: {sum(series[:-1])} | {histogram.quantile(0.5, label) * 1000:.0f}/{histogram.quantile(0.95, label) * 1000:.0f} ms"
+        for label, series in busiest
+    ]
+
+def render_stats():
+    """Admin /stats text built from the in-process metrics"""
+    api_calls = sum(sum(series[:-1]) for series in metrics.API_SECONDS.series().values())
+    api_errors = metrics.API_ERRORS.values()
+    lines = [
+        "📊 آمار ربات",
+        f"زمان کارکرد: {int(time() - metrics.STARTED) // 60} دقیقه",
+        f"بازی‌های فعال: {metrics.ACTIVE_SESSIONS.value()} | کاربران مسدود: {metrics.BLOCKED_USERS.value()}",
+        f"درخواست‌های تلگرام: {api_calls} | خطا: {sum(api_errors.values())}",
+    ]
+    if api_errors:
+        lines += [f"  {error}: {count}" for error, count in sorted(api_errors.items(), key=lambda item: -item[1])[:5]]
+    lines += ["", "هندلرها (تعداد | p50/p95):"] + _latency_lines(metrics.HANDLER_SECONDS, 10)
+    lines += ["", "تلگرام (تعداد | p50/p95):"] + _latency_lines(metrics.API_SECONDS, 5)
+    lines += ["", "دیتابیس (تعداد | p50/p95):"] + _latency_lines(metrics.DB_SECONDS, 5)
+    payloads = metrics.EDIT_PAYLOAD_BYTES.series()
+    if payloads:
+        lines += ["", "حجم پیام بازی (تعداد | میانگین):"] + [
+            f"{mode}: {sum(series[:-1])} | {series[-1] / sum(series[:-1]):.0f} B" for mode, series in sorted(payloads.items())
+        ]
+    return "\n".join(lines)
@@ -0,0 +1,430 @@
+import random
+import secrets
+import sqlite3
+import sys
+import threading
+from collections import Counter, OrderedDict
+from time import time
+from config import (
+    logger, SESSION_BACKEND, SESSION_FLUSH_INTERVAL, SESSION_FLUSH_SIZE,
+    SESSION_IDLE_TTL, SESSION_MAX_ACTIVE, SESSION_REAP_INTERVAL,
+)
+from database import db as default_db
+from game import init_board, add_random_tile, MOVE_CODES
+from metrics import DB_SECONDS
+from verify import append_move, replay, score_verifier, InvalidMoveLog
+
+# Cost per active game (CPython 3.11, measured with sys.getsizeof):
+#   memory: ~160 B on 5x5, ~180 B on 7x7, ~210 B on 9x9 for the GameSession and its
+#           bytearray board (the old dict of lists took 0.8-1.5 KB), plus ~100 B for
+#           the cache entry and the user id key. GameSessionStore.stats() reports it live.
+#           The move log adds one byte per four moves.
+#   sqlite: one row of size*size bytes of tile exponents and the move log plus ~70 B of
+#           columns, written once per flush no matter how many moves happened in between.
+# Every flush is a single transaction (one fsync) covering all dirty games.
+
+
+def encode_board(board):
+    """Pack a board into one byte per cell holding the tile exponent"""
+    return bytes(value.bit_length() - 1 if value else 0 for row in board for value in row)
+
+def decode_board(data, size):
+    """Unpack one byte per cell back into a list of lists of tile values"""
+    return [[1 << e if e else 0 for e in data[i * size:(i + 1) * size]] for i in range(size)]
+
+
+class GameSession:
+    """One active game, the board is kept as one tile exponent byte per cell
+
+    Tiles come from a generator seeded per game and every move is logged in two bits,
+    so verify.py can replay the game and check its score. text_mode draws the board in the
+    message text instead of as tile buttons.
+    """
+    __slots__ = ("size", "cells", "start_time", "name", "last_active", "seed", "moves", "move_count", "text_mode", "_rng")
+
+    def __init__(
+        self, size, cells=None, start_time=None, name=None, last_active=None, seed=None, moves=None, move_count=None,
+        text_mode=False,
+    ):
+        self.size = size
+        self.cells = bytearray(size * size) if cells is None else bytearray(cells)
+        self.start_time = time() if start_time is None else start_time
+        self.name = name
+        self.last_active = self.start_time if last_active is None else last_active
+        self.seed = seed
+        self.moves = bytearray(moves or b"")
+        self.move_count = move_count or 0
+        self.text_mode = bool(text_mode)
+        self._rng = None
+
+    @classmethod
+    def start(cls, size, name, seed=None, text_mode=False):
+        """Start a game on a board drawn from a new seed"""
+        seed = secrets.randbits(63) if seed is None else seed
+        rng = random.Random(seed)
+        session = cls(size, encode_board(init_board(size, rng)), name=name, seed=seed, text_mode=text_mode)
+        session._rng = rng
+        return session
+
+    @property
+    def rng(self):
+        """The game's tile generator, rebuilt by replaying the log for games loaded from SQLite"""
+        if self._rng is None:
+            if self.seed is None:
+                # Started before games were seeded, it can't be replayed anyway
+                self._rng = random.Random()
+            else:
+                try:
+                    board, self._rng = replay(self.size, self.seed, self.moves, self.move_count)
+                except InvalidMoveLog as e:
+                    logger.warning(f"Move log doesn't replay ({e}), the game can't be verified")
+                    self.seed = None
+                    self._rng = random.Random()
+                else:
+                    if encode_board(board.to_lists()) != bytes(self.cells):
+                        logger.warning("Stored board differs from its replayed move log")
+        return self._rng
+
+    def play(self, move):
+        """Make a move, spawn a tile and log the move if it changed the board; return whether it did"""
+        board = self.board
+        if not move(board):
+            return False
+        add_random_tile(board, self.rng)
+        self.board = board
+        append_move(self.moves, self.move_count, MOVE_CODES[move])
+        self.move_count += 1
+        return True
+
+    @property
+    def board(self):
+        """The board as a list of lists, changes only stick once assigned back"""
+        return decode_board(self.cells, self.size)
+
+    @board.setter
+    def board(self, board):
+        self.cells[:] = encode_board(board)
+
+    @property
+    def score(self):
+        """Highest tile on the board"""
+        top = max(self.cells)
+        return 1 << top if top else 0
+
+    def elapsed(self, now=None):
+        """Whole seconds played so far"""
+        return int((time() if now is None else now) - self.start_time)
+
+    def memory_size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.cells) + sys.getsizeof(self.moves)
+
+
+def end_abandoned_game(user_id, session):
+    """Save the score of a game its player walked away from, once its log is verified"""
+    score_verifier.submit(
+        user_id, session.name or str(user_id), session, int(session.last_active - session.start_time)
+    )
+
+
+class GameSessionStore:
+    """LRU of active games, a background reaper ends the ones left idle for too long"""
+
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL, max_sessions=SESSION_MAX_ACTIVE, reap_interval=SESSION_REAP_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.reap_interval = reap_interval
+        self.evicted = Counter()
+        # Least recently used first, every lookup moves a game to the end
+        self._games = OrderedDict()
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        session = self.get(user_id)
+        if session is None:
+            raise KeyError(user_id)
+        return session
+
+    def __len__(self):
+        return len(self._games)
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            session = self._games.get(user_id)
+            if session is None:
+                session = self._load(user_id)
+            if session is None:
+                return default
+            session.last_active = time()
+            self._games.move_to_end(user_id)
+            return session
+
+    def holds(self, user_id, session):
+        """Whether session is still the user's active game, without reading SQLite"""
+        with self._lock:
+            return self._games.get(user_id) is session
+
+    def pop(self, user_id, default=None):
+        """Remove a user's game and return it, default if it already ended"""
+        with self._lock:
+            session = self.get(user_id)
+            if session is None:
+                return default
+            del self[user_id]
+            return session
+
+    def _load(self, user_id):
+        return None
+
+    def _add(self, user_id, session):
+        """Cache a game, return the games pushed out by the size limit"""
+        session.last_active = time()
+        self._games[user_id] = session
+        self._games.move_to_end(user_id)
+        overflow = []
+        while len(self._games) > self.max_sessions:
+            overflow.append(self._games.popitem(last=False))
+        return overflow
+
+    def _pop_idle(self, cutoff):
+        """Remove the cached games idle since before cutoff"""
+        idle = []
+        while self._games:
+            user_id, session = next(iter(self._games.items()))
+            if session.last_active >= cutoff:
+                break
+            idle.append(self._games.popitem(last=False))
+        return idle
+
+    def _end(self, games, reason):
+        # Runs outside the store lock, saving scores takes the leaderboard lock and a transaction
+        for user_id, session in games:
+            try:
+                end_abandoned_game(user_id, session)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to save the score of abandoned game of user {user_id}: {e}")
+        self.evicted[reason] += len(games)
+
+    def expire(self, now=None):
+        """End every game idle for longer than idle_ttl, return how many ended"""
+        cutoff = (time() if now is None else now) - self.idle_ttl
+        with self._lock:
+            idle = self._pop_idle(cutoff)
+        self._end(idle, "idle")
+        return len(idle)
+
+    def stats(self):
+        """Active game count, memory they take and how many were evicted"""
+        with self._lock:
+            sessions = list(self._games.values())
+            memory = sys.getsizeof(self._games) + sum(
+                session.memory_size() + sys.getsizeof(user_id) for user_id, session in self._games.items()
+            )
+        return {
+            "active": len(sessions),
+            "memory": memory,
+            "per_session": memory // len(sessions) if sessions else 0,
+            "evicted_idle": self.evicted["idle"],
+            "evicted_capacity": self.evicted["capacity"],
+        }
+
+    def _reap_loop(self):
+        while not self._closed.wait(self.reap_interval):
+            try:
+                expired = self.expire()
+            except Exception as e:
+                logger.error(f"Failed to expire idle game sessions: {e}")
+                continue
+            if expired:
+                stats = self.stats()
+                logger.info(
+                    f"Ended {expired} idle games, {stats['active']} active taking {stats['memory'] / 1024:.1f} KB "
+                    f"({stats['per_session']} B each)"
+                )
+
+    def save(self, user_id):
+        """Mark a game as changed after its board was modified"""
+
+    def set_shard(self, index, count):
+        """Only end stored games of users with user_id % count == index, for stores shared between shards"""
+
+    def flush(self):
+        """Write buffered changes, if the backend buffers any"""
+
+    def close(self):
+        """Stop the reaper"""
+        self._closed.set()
+        self._reaper.join()
+
+
+class MemorySessionStore(GameSessionStore):
+    """Keep active games in memory only, every restart wipes them"""
+
+    def __setitem__(self, user_id, session):
+        with self._lock:
+            overflow = self._add(user_id, session)
+        self._end(overflow, "capacity")
+
+    def __delitem__(self, user_id):
+        with self._lock:
+            del self._games[user_id]
+
+    def close(self):
+        super().close()
+        self._games.clear()
+
+
+class SQLiteSessionStore(GameSessionStore):
+    """Keep active games in SQLite behind a write-behind buffer, memory only caches them"""
+
+    def __init__(self, db=default_db, flush_interval=SESSION_FLUSH_INTERVAL, flush_size=SESSION_FLUSH_SIZE, **kwargs):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # (index, shard count) under supervisor.py, where every shard reads the same table
+        self.shard = None
+        self._dirty = {}
+        self._wake = threading.Event()
+        super().__init__(**kwargs)
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    def _load(self, user_id):
+        """Load one game from SQLite the first time its user shows up"""
+        if user_id in self._dirty:
+            session = self._dirty[user_id]
+        else:
+            row = self.db.connection().execute(
+                "SELECT size, board, start_time, name, updated_at, seed, moves, move_count, text_mode FROM game_sessions WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            session = GameSession(*row)
+            logger.info(f"Restored game of user {user_id} from database")
+        if session is not None:
+            # Games dropped from the cache are still in SQLite, so the overflow needs no saving
+            self._add(user_id, session)
+        return session
+
+    def __setitem__(self, user_id, session):
+        with self._lock:
+            self._add(user_id, session)
+            self._mark(user_id, session)
+
+    def __delitem__(self, user_id):
+        with self._lock:
+            if self.get(user_id) is None:
+                raise KeyError(user_id)
+            del self._games[user_id]
+            self._mark(user_id, None)
+
+    def save(self, user_id):
+        """Mark a game as changed after its board was modified"""
+        with self._lock:
+            session = self._games.get(user_id)
+            if session is not None:
+                self._mark(user_id, session)
+
+    def set_shard(self, index, count):
+        self.shard = (index, count)
+
+    def _mark(self, user_id, session):
+        self._dirty[user_id] = session
+        if len(self._dirty) >= self.flush_size:
+            self._wake.set()
+
+    def expire(self, now=None):
+        """End every game idle for longer than idle_ttl, cached or only in SQLite"""
+        cutoff = (time() if now is None else now) - self.idle_ttl
+        with self._lock:
+            idle = self._pop_idle(cutoff)
+            for user_id, _ in idle:
+                self._mark(user_id, None)
+            # The other shards end their own users' games, ending those here too would save them twice
+            where, params = "updated_at < ?", (cutoff,)
+            if self.shard is not None:
+                where += " AND CAST(user_id AS INTEGER) % ? = ?"
+                params += (self.shard[1], self.shard[0])
+            rows = self.db.connection().execute(
+                "SELECT user_id, size, board, start_time, name, updated_at, seed, moves, move_count, text_mode "
+                f"FROM game_sessions WHERE {where}",
+                params
+            ).fetchall()
+            stored = [
+                (user_id, GameSession(*row)) for user_id, *row in rows
+                if user_id not in self._games and user_id not in self._dirty
+            ]
+            for user_id, _ in stored:
+                self._mark(user_id, None)
+            idle += stored
+        self._end(idle, "idle")
+        return len(idle)
+
+    @DB_SECONDS.time("session_flush")
+    def flush(self):
+        """Write every buffered change in one transaction"""
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            upserts = [
+                (
+                    user_id, session.size, bytes(session.cells), session.start_time, session.name, session.last_active,
+                    session.seed, bytes(session.moves), session.move_count, session.text_mode,
+                )
+                for user_id, session in dirty.items() if session is not None
+            ]
+            deletes = [(user_id,) for user_id, session in dirty.items() if session is None]
+            try:
+                with self.db.transaction() as cursor:
+                    cursor.executemany("""
+                    INSERT INTO game_sessions (user_id, size, board, start_time, name, updated_at, seed, moves, move_count, text_mode)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        size = excluded.size,
+                        board = excluded.board,
+                        start_time = excluded.start_time,
+                        name = excluded.name,
+                        updated_at = excluded.updated_at,
+                        seed = excluded.seed,
+                        moves = excluded.moves,
+                        move_count = excluded.move_count,
+                        text_mode = excluded.text_mode
+                    """, upserts)
+                    cursor.executemany("DELETE FROM game_sessions WHERE user_id = ?", deletes)
+            except sqlite3.Error as e:
+                # Put the batch back so the next flush retries it, newer changes win
+                for user_id, session in dirty.items():
+                    self._dirty.setdefault(user_id, session)
+                logger.error(f"Failed to flush {len(dirty)} game sessions: {e}")
+                return
+        logger.debug(f"Flushed {len(upserts)} game sessions and removed {len(deletes)}")
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background threads and write whatever is still buffered"""
+        self._closed.set()
+        self._wake.set()
+        self._flusher.join()
+        super().close()
+        self.flush()
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Build the session store selected in the config"""
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown session backend: {backend}")
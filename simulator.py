@@ -0,0 +1,157 @@
+import argparse
+from time import time
+import numpy as np
+
+# Move codes used by the batch API, in the same order as the direction buttons
+UP, DOWN, LEFT, RIGHT = 0, 1, 2, 3
+MOVES = ("up", "down", "left", "right")
+LEVELS = {"easy": 5, "medium": 7, "hard": 9}
+WIN_TILE = 2048
+
+
+def init_boards(n, size, rng):
+    """Initialize n empty boards with two random tiles each"""
+    boards = np.zeros((n, size, size), dtype=np.int32)
+    everyone = np.ones(n, dtype=bool)
+    add_random_tiles(boards, everyone, rng)
+    add_random_tiles(boards, everyone, rng)
+    return boards
+
+def add_random_tiles(boards, mask, rng):
+    """Add a random tile (2 or 4) to every masked board that has an empty cell"""
+    n, size, _ = boards.shape
+    flat = boards.reshape(n, size * size)
+    empty = flat == 0
+    mask = mask & empty.any(axis=1)
+    if not mask.any():
+        return
+    # A uniform random key per empty cell, argmax picks one empty cell uniformly
+    keys = np.where(empty[mask], rng.random((int(mask.sum()), size * size)), -1.0)
+    cells = keys.argmax(axis=1)
+    values = rng.choice(np.array([2, 4], dtype=np.int32), size=cells.shape[0])
+    flat[np.flatnonzero(mask), cells] = values
+
+def _compact_left(rows):
+    """Push the non-zero tiles of every row to the left, keeping their order"""
+    order = np.argsort(rows == 0, axis=1, kind="stable")
+    return np.take_along_axis(rows, order, axis=1)
+
+def _slide_left(rows):
+    """Slide and merge a stack of rows left, same rules as game.move_left"""
+    rows = _compact_left(rows)
+    for j in range(rows.shape[1] - 1):
+        merge = (rows[:, j] != 0) & (rows[:, j] == rows[:, j + 1])
+        rows[merge, j] *= 2
+        rows[merge, j + 1] = 0
+    return _compact_left(rows)
+
+def _oriented(boards, move):
+    """View the boards so that the move becomes a left move"""
+    if move == RIGHT:
+        return boards[:, :, ::-1]
+    if move == UP:
+        return boards.transpose(0, 2, 1)
+    if move == DOWN:
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+    return boards
+
+def apply_moves(boards, moves):
+    """Apply one move per board in place and return the per-board moved mask"""
+    n, size, _ = boards.shape
+    moved = np.zeros(n, dtype=bool)
+    for move in range(len(MOVES)):
+        selected = np.flatnonzero(moves == move)
+        if selected.size == 0:
+            continue
+        before = boards[selected]
+        view = _oriented(before, move)
+        after = _slide_left(view.reshape(-1, size)).reshape(view.shape)
+        moved[selected] = (after != view).any(axis=(1, 2))
+        # Writing through the oriented view puts the result back in board order
+        _oriented(before, move)[...] = after
+        boards[selected] = before
+    return moved
+
+def is_game_over(boards):
+    """Check which boards have no moves left"""
+    has_empty = (boards == 0).any(axis=(1, 2))
+    horizontal = (boards[:, :, 1:] == boards[:, :, :-1]).any(axis=(1, 2))
+    vertical = (boards[:, 1:, :] == boards[:, :-1, :]).any(axis=(1, 2))
+    return ~(has_empty | horizontal | vertical)
+
+def get_scores(boards):
+    """Return the highest tile of every board"""
+    return boards.max(axis=(1, 2))
+
+def step(boards, moves, rng):
+    """Move every board, spawn tiles where something moved, return (moved, game_over)"""
+    moved = apply_moves(boards, moves)
+    add_random_tiles(boards, moved, rng)
+    return moved, is_game_over(boards)
+
+def preview_moves(boards):
+    """Return every board after each of the four moves, plus the moved masks"""
+    results = np.empty((len(MOVES),) + boards.shape, dtype=boards.dtype)
+    moved = np.empty((len(MOVES), boards.shape[0]), dtype=bool)
+    for move in range(len(MOVES)):
+        results[move] = boards
+        moved[move] = apply_moves(results[move], np.full(boards.shape[0], move))
+    return results, moved
+
+def choose_moves(boards, policy, rng):
+    """Pick one legal move per board, at random or greedily by empty cells"""
+    results, moved = preview_moves(boards)
+    if policy == "greedy":
+        score = (results == 0).sum(axis=(2, 3)).astype(np.float64)
+        score += rng.random(score.shape) * 0.5
+    else:
+        score = rng.random(moved.shape)
+    score[~moved] = -1.0
+    return score.argmax(axis=0)
+
+def simulate(games, size, policy="random", batch_size=100_000, seed=0):
+    """Play games to the end and return the final highest tile and move count of each"""
+    rng = np.random.default_rng(seed)
+    final_tiles = []
+    total_moves = 0
+    for start in range(0, games, batch_size):
+        n = min(batch_size, games - start)
+        boards = init_boards(n, size, rng)
+        tiles = get_scores(boards)
+        active = np.flatnonzero(~is_game_over(boards))
+        while active.size:
+            playing = boards[active]
+            moves = choose_moves(playing, policy, rng)
+            _, over = step(playing, moves, rng)
+            boards[active] = playing
+            total_moves += active.size
+            scores = get_scores(playing)
+            done = over | (scores >= WIN_TILE)
+            tiles[active[done]] = scores[done]
+            active = active[~done]
+        final_tiles.append(tiles)
+    return np.concatenate(final_tiles), total_moves
+
+def print_distribution(level, size, tiles, moves, elapsed):
+    """Print how often each highest tile was reached"""
+    values, counts = np.unique(tiles, return_counts=True)
+    print(f"{level} ({size}x{size}): {tiles.size} games, {moves} moves, {moves / max(elapsed, 1e-9):.0f} moves/s")
+    for value, count in zip(values[::-1], counts[::-1]):
+        print(f"  {int(value):>5}: {count:>10} ({count / tiles.size:.2%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate 2048 games in bulk and print tile distributions")
+    parser.add_argument("--games", type=int, default=100_000, help="games to play per level")
+    parser.add_argument("--levels", nargs="+", choices=list(LEVELS), default=list(LEVELS))
+    parser.add_argument("--policy", choices=["random", "greedy"], default="random")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="boards simulated at once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for level in args.levels:
+        size = LEVELS[level]
+        started = time()
+        tiles, moves = simulate(args.games, size, args.policy, args.batch_size, args.seed)
+        print_distribution(level, size, tiles, moves, time() - started)
+
+if __name__ == "__main__":
+    main()
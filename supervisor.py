@@ -0,0 +1,179 @@
+import multiprocessing
+import queue
+import signal
+import threading
+from time import sleep, monotonic
+from telebot import apihelper, types
+from config import (
+    logger, TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    SHARD_WORKERS, SHARD_QUEUE_SIZE, SHARD_REPORT_INTERVAL, METRICS_PORT,
+)
+from database import init_db
+from webhook import WebhookServer, update_user_id
+
+QUEUE_TIMEOUT = 1
+
+
+def worker_main(index, workers, updates, processed, api_url):
+    """Run the handlers of one shard until the supervisor sends None"""
+    # Spawned processes start from a fresh telebot, so carry over the parent's API server
+    apihelper.API_URL = api_url
+    # Imported here so every shard builds its own bot, game state and SQLite connections
+    from database import close_db
+    from handlers import bot, game_state
+    from broadcast import resume_broadcasts
+    from hints import close_hints
+    from verify import score_verifier
+    from writer import db_writer
+    from metrics import start_metrics_server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Every shard's reaper sees the whole game_sessions table, each only ends its own users' games
+    game_state.set_shard(index, workers)
+    bot.threaded = False
+    if METRICS_PORT:
+        # The supervisor has no handlers, each shard serves its own metrics on the next ports
+        start_metrics_server(port=METRICS_PORT + 1 + index)
+    if index == 0:
+        resume_broadcasts(bot)
+    logger.info(f"Shard {index} started")
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            try:
+                bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                logger.error(f"Shard {index} failed to process update {update.get('update_id')}: {e}")
+            with processed.get_lock():
+                processed.value += 1
+    finally:
+        close_hints()
+        game_state.close()
+        score_verifier.close()
+        db_writer.close()
+        close_db()
+        logger.info(f"Shard {index} stopped")
+
+
+class Supervisor:
+    """Own N shard processes, each handling the users with user_id % N == its index"""
+
+    def __init__(self, workers=SHARD_WORKERS, queue_size=SHARD_QUEUE_SIZE):
+        self.context = multiprocessing.get_context("spawn")
+        self.queue_size = queue_size
+        self.queues = [self.context.Queue(queue_size) for _ in range(workers)]
+        self.processed = [self.context.Value("q", 0) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.restarts = [0] * workers
+        self.api_url = apihelper.API_URL
+        self.stopping = False
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=worker_main, args=(index, len(self.processes), self.queues[index], self.processed[index], self.api_url),
+            name=f"shard-{index}", daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.processes)):
+            self.start_worker(index)
+
+    def route(self, update):
+        """Hand an update to its user's shard, return False if that shard's queue stays full"""
+        index = update_user_id(update) % len(self.queues)
+        try:
+            self.queues[index].put(update, timeout=QUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            logger.warning(f"Shard {index} queue is full, update {update.get('update_id')} has to wait")
+            return False
+
+    def check_workers(self):
+        """Restart every shard process that died"""
+        for index, process in enumerate(self.processes):
+            if not self.stopping and not process.is_alive():
+                self.restarts[index] += 1
+                # A killed process may still hold the queue's read lock, so the new one gets a fresh queue
+                lost = self.queues[index].qsize()
+                self.queues[index] = self.context.Queue(self.queue_size)
+                logger.error(
+                    f"Shard {index} exited with code {process.exitcode}, restarting (restart #{self.restarts[index]}), "
+                    f"{lost} queued updates dropped"
+                )
+                self.start_worker(index)
+
+    def report(self, previous, elapsed):
+        """Log updates per second of every shard since the last report, return the new totals"""
+        totals = [counter.value for counter in self.processed]
+        rates = ", ".join(
+            f"shard {index}: {(total - before) / elapsed:.1f}/s (queued {self.queues[index].qsize()})"
+            for index, (total, before) in enumerate(zip(totals, previous))
+        )
+        logger.info(f"Throughput {rates}")
+        return totals
+
+    def stop(self, timeout=30):
+        """Let every shard finish its queue, then stop it"""
+        self.stopping = True
+        for updates in self.queues:
+            updates.put(None)
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Shard {index} didn't stop in {timeout}s, terminating it")
+                process.terminate()
+
+
+def poll_updates(supervisor, stop):
+    """Long-poll Telegram in this process and route every update to its shard"""
+    apihelper.delete_webhook(TOKEN)
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = apihelper.get_updates(TOKEN, offset=offset, timeout=30, long_polling_timeout=20)
+        except Exception as e:
+            logger.error(f"Failed to get updates: {e}")
+            sleep(3)
+            continue
+        for update in updates:
+            while not supervisor.route(update):
+                if stop.is_set():
+                    return
+            offset = update["update_id"] + 1
+
+def run_supervisor():
+    """Start the shards and one intake (webhook or polling), restart shards that crash"""
+    init_db()
+    supervisor = Supervisor()
+    supervisor.start()
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    server = None
+    if BOT_MODE == "webhook":
+        server = WebhookServer(supervisor.route)
+        server.start()
+        apihelper.set_webhook(TOKEN, url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+    else:
+        threading.Thread(target=poll_updates, args=(supervisor, stop), name="intake", daemon=True).start()
+    logger.info(f"Supervisor running {len(supervisor.processes)} shards with {BOT_MODE} intake")
+
+    totals = [0] * len(supervisor.processes)
+    last_report = monotonic()
+    while not stop.wait(1):
+        supervisor.check_workers()
+        if monotonic() - last_report >= SHARD_REPORT_INTERVAL:
+            totals = supervisor.report(totals, monotonic() - last_report)
+            last_report = monotonic()
+
+    logger.info("Stopping supervisor...")
+    if server is not None:
+        server.stop()
+    supervisor.stop()
+
+if __name__ == "__main__":
+    run_supervisor()
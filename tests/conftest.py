@@ -0,0 +1,30 @@
+"""Shared fixtures: every test runs against its own SQLite file
+
+Modules read TOKEN and open bot.db relative to the working directory when they are first
+imported, so both are set up here before any test module imports them, like the tools do.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("TOKEN", "123456:fake-token")
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+import pytest
+import database
+import render
+from database import ConnectionManager
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database.db with every table created, its path in db.db_name"""
+    manager = ConnectionManager(str(tmp_path / "bot.db"))
+    monkeypatch.setattr(database, "db", manager)
+    monkeypatch.setattr(database, "_top_entries", {})
+    monkeypatch.setattr(render, "leaderboard_message", {"version": None, "text": None})
+    database.init_db()
+    yield manager
+    manager.close_all()
@@ -0,0 +1,19 @@
+"""Run a function in a separate spawned process, the way supervisor.py starts a shard"""
+import multiprocessing
+
+
+def _run(db_path, func, args):
+    import database
+    database.db = database.ConnectionManager(db_path)
+    try:
+        func(*args)
+    finally:
+        database.db.close_all()
+
+def run_in_shard(db_path, func, *args, timeout=60):
+    """Call func(*args) in a new process with its own module state, using the database at db_path"""
+    process = multiprocessing.get_context("spawn").Process(target=_run, args=(db_path, func, args))
+    process.start()
+    process.join(timeout)
+    if process.exitcode != 0:
+        raise AssertionError(f"Shard process exited with {process.exitcode}")
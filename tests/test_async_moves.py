@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import async_bot
+from game import move_left, move_right
+from sessions import GameSession, encode_board
+
+USER_ID = 42
+
+
+def press(query_id):
+    return SimpleNamespace(
+        id=str(query_id),
+        from_user=SimpleNamespace(id=USER_ID, first_name="player"),
+        message=SimpleNamespace(chat=SimpleNamespace(id=USER_ID), message_id=1),
+    )
+
+@pytest.fixture
+def bot_calls(monkeypatch):
+    """Fake Bot API methods of async_bot.bot, return the list of calls they record"""
+    calls = []
+
+    async def record(*args, **kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(async_bot.bot, "answer_callback_query", record)
+    monkeypatch.setattr(async_bot.bot, "edit_message_text", record)
+    return calls
+
+def test_two_fast_presses_end_a_won_game_once(bot_calls, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(async_bot.score_verifier, "submit", lambda user_id, *args: submitted.append(user_id))
+    board = [[0] * 5 for _ in range(5)]
+    board[0][:2] = [1024, 1024]
+    # Either press alone merges the two tiles into 2048 and wins
+    async_bot.game_state[str(USER_ID)] = GameSession(5, encode_board(board), name="player")
+
+    async def both():
+        return await asyncio.gather(
+            async_bot.handle_game_moves(press(1), move_left),
+            async_bot.handle_game_moves(press(2), move_right),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(both())
+
+    assert results == [None, None]
+    assert submitted == [str(USER_ID)]
+    assert str(USER_ID) not in async_bot.game_state
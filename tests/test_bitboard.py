@@ -0,0 +1,12 @@
+from bitboard import BitBoard, check_against_list_engine, move_left, move_up
+
+
+def test_bitboard_plays_like_the_list_engine():
+    assert check_against_list_engine(games=3) > 0
+
+def test_moves_merge_each_pair_once():
+    board = BitBoard.from_lists([[2, 2, 4, 4, 0], [0] * 5, [2, 0, 0, 0, 0], [2, 0, 0, 0, 0], [4, 0, 0, 0, 0]])
+    assert move_left(board)
+    assert board.to_lists()[0] == [4, 8, 0, 0, 0]
+    assert move_up(board)
+    assert [row[0] for row in board.to_lists()] == [4, 4, 4, 0, 0]
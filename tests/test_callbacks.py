@@ -0,0 +1,22 @@
+import pytest
+from callbacks import CONFIRM_END, DOWN, DUMMY, END, LEFT, RIGHT, SHOW_LEVELS, UP, decode, encode
+
+
+def test_encoded_actions_decode_to_their_owner():
+    assert decode(encode(LEFT, 123456789)) == (LEFT, 123456789)
+    assert decode(encode(SHOW_LEVELS)) == (SHOW_LEVELS, None)
+
+def test_legacy_callback_data_still_decodes():
+    assert decode("show_levels") == (SHOW_LEVELS, None)
+    assert decode("confirm_end_42") == (CONFIRM_END, 42)
+    assert decode("end_42") == (END, 42)
+    # Tiles of old keyboards carry their cell and the owner: tile_{i}_{j}_{user id}
+    assert decode("tile_3_4_123456789") == (DUMMY, 123456789)
+    for data, action in (("up_", UP), ("down_", DOWN), ("left_", LEFT), ("right_", RIGHT)):
+        assert decode(f"{data}123456789") == (action, 123456789)
+
+@pytest.mark.parametrize("data", ["", None, "u!!", "l-5", "left_abc", "up_²", "whatever_1"])
+def test_malformed_callback_data_is_unknown(data):
+    action, owner = decode(data)
+    assert owner is None
+    assert action is None or data.startswith(("left_", "up_"))
@@ -0,0 +1,20 @@
+from bitboard import pack_row
+from hints import Search, TranspositionTable, evaluate, successors
+
+
+def heavy_board(size, hole=None):
+    """A full board of big tiles that don't merge, with one empty cell at `hole` if given"""
+    cells = [[10 - (i + j) % 2 for j in range(size)] for i in range(size)]
+    if hole is not None:
+        cells[hole[0]][hole[1]] = 0
+    return tuple(pack_row(row) for row in cells)
+
+def test_a_lost_board_ranks_below_any_board_that_goes_on():
+    search = Search(9, float("inf"), table=TranspositionTable(1000))
+    alive = heavy_board(9, hole=(0, 0))
+    lost = heavy_board(9)
+    assert successors(alive, 9) and not successors(lost, 9)
+    # Heavy tiles push the heuristic below zero, it must not be clamped to a lost board's value
+    assert evaluate(alive, 9) < 0
+    assert search._max(alive, 1) < 0
+    assert search._max(lost, 1) < search._max(alive, 1)
@@ -0,0 +1,47 @@
+from database import get_leaderboard_version, import_leaderboard_entries, save_batch
+from render import render_leaderboard
+from shards import run_in_shard
+
+
+def save_score(user_id, name, score, time_value, size):
+    save_batch([(user_id, name)], [], [(user_id, name, score, time_value, size)], [(user_id, name, score, time_value)])
+
+
+def test_score_saved_in_another_shard_shows_on_leaderboard(db):
+    save_score(1, "first", 256, 100, 5)
+    assert "first" in render_leaderboard()
+
+    run_in_shard(db.db_name, save_score, 2, "other shard", 512, 50, 5)
+
+    assert "other shard" in render_leaderboard()
+
+def test_leaderboard_is_cached_until_a_score_is_saved(db, monkeypatch):
+    save_score(1, "first", 256, 100, 5)
+    text = render_leaderboard()
+    monkeypatch.setattr("render.get_top_n", lambda *args: [])
+    assert render_leaderboard() is text
+
+def test_only_scores_reaching_a_top_move_the_version(db):
+    for user_id in range(1, 7):
+        save_score(user_id, f"user{user_id}", 256 * user_id, 60, 5)
+    version = get_leaderboard_version()
+
+    save_score(50, "low", 8, 60, 5)
+    assert get_leaderboard_version() == version
+
+    save_score(51, "low elsewhere", 8, 60, 7)
+    assert get_leaderboard_version() == version + 1
+
+def test_import_into_level_boards_only_moves_the_version(db):
+    save_score(1, "player", 256, 60, 5)
+    version = get_leaderboard_version()
+    import_leaderboard_entries([(1, "player", 128, 60, 9)], "test", 1, 10)
+    assert get_leaderboard_version() == version + 1
+
+def test_scores_from_before_level_boards_stay_on_the_leaderboard(db):
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO leaderboard (user_id, name, score, time) VALUES (1, 'veteran', 2048, 300)")
+    save_score(2, "newcomer", 256, 60, 5)
+    text = render_leaderboard()
+    assert "veteran" in text
+    assert "newcomer" in text
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_load_test_plays_every_game_without_failures():
+    result = subprocess.run(
+        [sys.executable, "-m", "tools.loadtest", "--users", "20", "--moves", "5", "--think", "0", "--ramp", "0", "--latency", "0"],
+        cwd=ROOT, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith("20 players, 200 updates")
+    rows = [line.split() for line in result.stdout.splitlines() if line.split()[:1] in (["start"], ["move"], ["confirm"])]
+    assert [(row[0], row[1], row[2]) for row in rows] == [("start", "20", "0"), ("move", "100", "0"), ("confirm", "20", "0")]
@@ -0,0 +1,44 @@
+import json
+import pytest
+import migrate
+from database import count_users, get_top_n
+from migrate import import_file
+
+
+def test_leaderboard_import_fills_level_boards(db, tmp_path):
+    path = tmp_path / "leaderboard.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in [
+        {"user_id": 1, "name": "sized", "score": 512, "time": 30, "size": 7},
+        {"user_id": 2, "name": "legacy", "score": 256, "time": 20},
+    ]))
+
+    assert import_file("leaderboard", str(path), batch_size=1) == (2, 2, 0)
+
+    assert [entry["name"] for entry in get_top_n(5)] == ["sized", "legacy"]
+    assert [entry["name"] for entry in get_top_n(5, 7)] == ["sized"]
+    assert get_top_n(5, 5) == []
+
+def test_import_resumes_at_the_saved_byte_offset(db, tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    path.write_text("[" + ", ".join(json.dumps({"id": i, "username": f"user{i}"}) for i in range(1, 7)) + "]")
+    _, insert = migrate.IMPORTERS["users"]
+    calls = []
+
+    def failing_insert(rows, source, position, offset):
+        calls.append(position)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return insert(rows, source, position, offset)
+
+    monkeypatch.setitem(migrate.IMPORTERS, "users", (migrate.user_row, failing_insert))
+    with pytest.raises(KeyboardInterrupt):
+        import_file("users", str(path), batch_size=2)
+    monkeypatch.setitem(migrate.IMPORTERS, "users", (migrate.user_row, insert))
+
+    # The imported records are passed over by offset, so breaking them doesn't matter
+    text = path.read_text()
+    cut = text.index("}", text.index('"user2"')) + 1
+    path.write_text("[" + "x" * (cut - 1) + text[cut:])
+
+    assert import_file("users", str(path), batch_size=2) == (4, 4, 0)
+    assert count_users() == 6
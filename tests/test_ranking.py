@@ -0,0 +1,40 @@
+import random
+import database
+from ranking import RankIndex, RankTree
+
+
+def test_legacy_row_without_time_is_ranked(db):
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO leaderboard (user_id, name, score, time) VALUES (1, 'legacy', 300, NULL)")
+    database.save_leaderboard_entry(2, "new", 500, 40)
+
+    index = RankIndex()
+    assert index.rank(1) == (2, 2)
+    assert index.rank(2) == (1, 2)
+
+def test_rank_tree_counts_the_keys_below_any_key():
+    rng = random.Random(5)
+    keys = set(rng.sample(range(10_000), 500))
+    tree = RankTree(keys)
+    for _ in range(1000):
+        key = rng.randrange(10_000)
+        if key in keys and rng.random() < 0.5:
+            tree.remove(key)
+            keys.discard(key)
+        elif key not in keys:
+            tree.insert(key)
+            keys.add(key)
+        probe = rng.randrange(10_000)
+        assert tree.rank(probe) == sum(1 for other in keys if other < probe)
+    assert len(tree) == len(keys)
+
+def test_rank_follows_scores_saved_after_the_first_lookup(db):
+    for user_id, score in ((1, 256), (2, 512), (3, 1024)):
+        database.save_leaderboard_entry(user_id, f"user{user_id}", score, 60)
+    index = RankIndex()
+    assert index.rank(1) == (3, 3)
+
+    database.save_leaderboard_entry(1, "user1", 2048, 60)
+    database.save_leaderboard_entry(4, "user4", 8, 60)
+    assert index.rank(1) == (1, 4)
+    assert index.rank(2) == (3, 4)
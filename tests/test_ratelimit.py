@@ -0,0 +1,63 @@
+import random
+import pytest
+from ratelimit import MemoryRateLimitStore, RateLimiter, RateLimitPolicy, SQLiteRateLimitStore
+
+POLICY = RateLimitPolicy(window=1, burst=3, block=10)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, db):
+    def make(max_entries=1000):
+        if request.param == "memory":
+            store = MemoryRateLimitStore(max_entries=max_entries, ttl=5)
+        else:
+            store = SQLiteRateLimitStore(db=db, max_entries=max_entries, ttl=5, cleanup_interval=0)
+        return RateLimiter(POLICY, store)
+    return make
+
+def test_burst_is_blocked_until_the_block_ends(make_limiter):
+    limiter = make_limiter()
+    assert [limiter.hit(1, now=0)[:2] for _ in range(4)] == [(True, False)] * 3 + [(False, True)]
+    assert limiter.hit(1, now=9) == (False, False, 1)
+    assert limiter.hit(1, now=10.5)[0]
+
+def test_blocked_users_survive_the_entry_cap(make_limiter):
+    limiter = make_limiter(max_entries=2)
+    for _ in range(4):
+        limiter.hit(1, now=0)
+    for user_id in range(2, 50):
+        limiter.hit(user_id, now=1)
+    assert limiter.hit(1, now=2)[:2] == (False, False)
+    assert limiter.blocked_count(now=2) == 1
+
+def test_blocked_count_matches_the_blocks_handed_out():
+    store = MemoryRateLimitStore(max_entries=50, ttl=5)
+    limiter = RateLimiter(POLICY, store)
+    rng = random.Random(1)
+    ends = {}
+    now = 0.0
+    for _ in range(5000):
+        now += rng.random() * 0.05
+        user_id = rng.randrange(80)
+        allowed, just_blocked, left = limiter.hit(user_id, now=now)
+        if just_blocked:
+            ends[user_id] = now + left
+        assert limiter.blocked_count(now=now) == sum(1 for end in ends.values() if end > now)
+    assert len(ends) > 10
+
+def test_entries_stay_in_last_seen_order_around_blocks():
+    store = MemoryRateLimitStore(max_entries=3, ttl=5)
+    limiter = RateLimiter(POLICY, store)
+    for _ in range(4):
+        limiter.hit(1, now=0)
+    limiter.hit(2, now=1)
+    limiter.hit(3, now=2)
+    limiter.hit(4, now=3)
+    # 1 is blocked until 10, so only 2 made room for 4
+    assert list(store._entries) == [3, 4]
+    limiter.hit(5, now=11)
+    assert list(store._entries) == [1, 5]
+    # 1 counts as seen when its block ended and goes first once that is ttl ago
+    limiter.hit(6, now=15.5)
+    assert list(store._entries) == [5, 6]
+    assert store.blocked_count(now=15.5) == 0
@@ -0,0 +1,39 @@
+import sessions
+from sessions import GameSession, SQLiteSessionStore
+
+
+def make_store(db, **kwargs):
+    return SQLiteSessionStore(db=db, flush_interval=3600, reap_interval=3600, idle_ttl=60, **kwargs)
+
+def test_each_shard_only_ends_its_own_idle_games(db, monkeypatch):
+    ended = []
+    monkeypatch.setattr(sessions, "end_abandoned_game", lambda user_id, session: ended.append(user_id))
+    writer = make_store(db)
+    for user_id in range(1, 9):
+        writer[str(user_id)] = GameSession.start(5, f"user{user_id}")
+    writer.flush()
+    writer.close()
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE game_sessions SET updated_at = 0")
+
+    shards = [make_store(db) for _ in range(3)]
+    for index, store in enumerate(shards):
+        store.set_shard(index, len(shards))
+    for store in shards:
+        store.expire()
+        store.flush()
+    for store in shards:
+        store.close()
+
+    assert sorted(ended, key=int) == [str(user_id) for user_id in range(1, 9)]
+    assert db.connection().execute("SELECT COUNT(*) FROM game_sessions").fetchone()[0] == 0
+
+def test_text_mode_survives_a_restart(db):
+    store = make_store(db)
+    session = GameSession.start(7, "player", text_mode=True)
+    store["1"] = session
+    store.close()
+    restored = make_store(db)
+    assert restored.get("1").text_mode
+    assert bytes(restored.get("1").cells) == bytes(session.cells)
+    restored.close()
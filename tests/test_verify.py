@@ -0,0 +1,58 @@
+import random
+import pytest
+from game import MOVES
+from sessions import GameSession
+import verify
+from verify import FinishedGame, InvalidMoveLog, append_move, replay, verify_game
+
+
+def played_game(moves=200, seed=7):
+    session = GameSession.start(5, "player", seed=seed)
+    rng = random.Random(seed)
+    while session.move_count < moves and session.score < 2048:
+        session.play(rng.choice(MOVES))
+    return session
+
+def finished(session, score=None):
+    return FinishedGame(
+        1, "player", session.size, session.seed, bytes(session.moves), session.move_count,
+        session.score if score is None else score, 10, 0,
+    )
+
+def test_replay_reaches_the_played_board():
+    session = played_game()
+    board, _ = replay(session.size, session.seed, bytes(session.moves), session.move_count)
+    assert board.to_lists() == session.board
+
+def test_replay_rejects_a_move_that_changes_nothing():
+    session = GameSession.start(5, "player", seed=3)
+    # Moving left until the board stops changing, then logging one more left
+    while session.play(MOVES[2]):
+        pass
+    moves = bytearray(session.moves)
+    append_move(moves, session.move_count, 2)
+    with pytest.raises(InvalidMoveLog):
+        replay(session.size, session.seed, bytes(moves), session.move_count + 1)
+
+def test_verify_game_checks_the_claimed_score():
+    session = played_game()
+    assert verify_game(finished(session)) is True
+    assert verify_game(finished(session, session.score * 2)) is False
+    assert verify_game(finished(session)._replace(seed=None)) is None
+
+def test_a_game_that_breaks_replay_is_rejected_and_the_rest_saved(monkeypatch):
+    saved = []
+    monkeypatch.setattr(verify.db_writer, "save_game", lambda game, verified: saved.append((game.user_id, verified)))
+    check = verify.verify_game
+
+    def breaking(game):
+        if game.user_id == 1:
+            raise ValueError("unreadable log")
+        return check(game)
+
+    monkeypatch.setattr(verify, "verify_game", breaking)
+    verifier = verify.ScoreVerifier()
+    verifier.submit(1, "player", played_game(), 10)
+    verifier.submit(2, "player", played_game(), 10)
+    verifier.close()
+    assert saved == [(1, False), (2, True)]
@@ -0,0 +1,64 @@
+import sqlite3
+import pytest
+import writer
+from database import get_top_n
+from writer import WriteBehindWriter
+
+
+@pytest.fixture
+def make_writer(db):
+    writers = []
+
+    def make(**kwargs):
+        writers.append(WriteBehindWriter(flush_interval=3600, **kwargs))
+        return writers[-1]
+
+    yield make
+    for queued in writers:
+        queued.close()
+
+def scores(size=None):
+    return [(entry["user_id"], entry["score"]) for entry in get_top_n(5, size)]
+
+def test_level_boards_keep_the_best_queued_score(make_writer):
+    queue = make_writer()
+    queue.save_leaderboard_entry(1, "player", 512, 30, 5)
+    queue.save_leaderboard_entry(1, "player", 128, 20, 5)
+    queue.save_leaderboard_entry(1, "player", 256, 10, 7)
+    assert queue.flush() == 3
+    assert scores(5) == [(1, 512)]
+    assert scores(7) == [(1, 256)]
+
+@pytest.mark.parametrize("coalesce, expected", [("last", 256), ("max", 512)])
+def test_all_sizes_board_coalesces_by_policy(make_writer, coalesce, expected):
+    queue = make_writer(coalesce=coalesce)
+    queue.save_leaderboard_entry(1, "player", 512, 30, 5)
+    queue.save_leaderboard_entry(1, "player", 256, 10, 7)
+    queue.flush()
+    assert scores() == [(1, expected)]
+
+def test_unknown_policy_is_rejected(db):
+    with pytest.raises(ValueError):
+        WriteBehindWriter(coalesce="min")
+
+def test_known_users_are_queued_once(make_writer):
+    queue = make_writer()
+    assert queue.save_user(1, "player") is True
+    assert queue.save_user(1, "player") is False
+    assert len(queue) == 1
+
+def test_failed_flush_is_retried_and_newer_scores_win(make_writer, monkeypatch):
+    queue = make_writer()
+    save_batch = writer.save_batch
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    queue.save_leaderboard_entry(1, "player", 512, 30, 5)
+    monkeypatch.setattr(writer, "save_batch", locked)
+    assert queue.flush() == 0
+    queue.save_leaderboard_entry(1, "player", 128, 10, 5)
+    monkeypatch.setattr(writer, "save_batch", save_batch)
+    queue.flush()
+    assert scores(5) == [(1, 512)]
+    assert scores() == [(1, 128)]
@@ -0,0 +1,175 @@
+import json
+import random
+import threading
+from collections import Counter, defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import time, sleep
+from urllib.parse import urlsplit, parse_qs
+import telebot.apihelper
+
+FAKE_TOKEN = "123456:fake-token"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "2048Bot", "username": "fake_2048_bot"}
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts of updates open many connections at once, the default backlog of 5 resets them
+    request_queue_size = 128
+
+
+class FakeTelegram:
+    """Local stand-in for the Bot API that records every call it gets"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1, host="127.0.0.1", port=0, seed=2048):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = []
+        self.counts = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_ids = defaultdict(int)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Keep-alive responses go out in two writes, Nagle would hold the second one back
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length", 0))
+                if length:
+                    body = self.rfile.read(length)
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+                status, payload = fake.respond(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = FakeHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def point_bot_here(self):
+        """Send every telebot request (sync and async) to this server"""
+        telebot.apihelper.API_URL = self.api_url
+        try:
+            from telebot import asyncio_helper
+            asyncio_helper.API_URL = self.api_url
+        except ImportError:
+            pass
+
+    def respond(self, method, params):
+        """Return (HTTP status, JSON body) for one Bot API call"""
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            self.calls.append((time(), method, params))
+            self.counts[method] += 1
+            throttled = self.error_rate and self._rng.random() < self.error_rate
+            if throttled:
+                self.errors[method] += 1
+        if throttled:
+            return 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return []
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            if method == "sendMessage":
+                with self._lock:
+                    self._message_ids[chat_id] += 1
+                    message_id = self._message_ids[chat_id]
+            else:
+                message_id = int(params.get("message_id", 0))
+            return {
+                "message_id": message_id,
+                "date": int(time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    def calls_of(self, method):
+        with self._lock:
+            return [params for _, name, params in self.calls if name == method]
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.counts.clear()
+            self.errors.clear()
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Player{user_id}"}
+
+def message_update(update_id, user_id, text):
+    """Build a private-chat text message update, commands get their entity"""
+    message = {
+        "message_id": update_id,
+        "date": int(time()) + 1,
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def callback_update(update_id, user_id, data, message_id=1, query_id=None):
+    """Build a callback query update for a button under one of the bot's messages"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": query_id or str(update_id),
+            "chat_instance": str(user_id),
+            "from": _user(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "",
+            },
+        },
+    }
@@ -0,0 +1,185 @@
+"""Drive simulated players through the real handlers.py against a local fake Bot API
+
+Each player sends /start, opens the level menu, picks a level, makes random moves and ends the
+game, waiting --think seconds between presses. Updates go through the same per-user ordered
+worker pool as the webhook mode. The fake API shares this process, so its own CPU time counts too.
+
+Run with: python -m tools.loadtest --users 2000 --moves 30 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import heapq
+import os
+import random
+import resource
+import tempfile
+import threading
+from collections import defaultdict
+from time import monotonic, sleep
+from tools.fake_telegram import FakeTelegram, FAKE_TOKEN, message_update, callback_update
+
+
+def player_script(user_id, moves, rng):
+    """Updates one player sends, in order, as (kind, update) pairs"""
+    from callbacks import encode, SHOW_LEVELS, EASY, MEDIUM, HARD, UP, DOWN, LEFT, RIGHT, END, CONFIRM_END
+    base = user_id * 1000
+    yield "start", message_update(base, user_id, "/start")
+    yield "menu", callback_update(base + 1, user_id, encode(SHOW_LEVELS))
+    yield "level", callback_update(base + 2, user_id, encode(rng.choice((EASY, MEDIUM, HARD))))
+    for k in range(moves):
+        yield "move", callback_update(base + 3 + k, user_id, encode(rng.choice((UP, DOWN, LEFT, RIGHT)), user_id))
+    yield "end", callback_update(base + 3 + moves, user_id, encode(END, user_id))
+    yield "confirm", callback_update(base + 4 + moves, user_id, encode(CONFIRM_END, user_id))
+
+
+class LoadTest:
+    """Closed-loop players: the next press is scheduled when the previous one was handled"""
+
+    def __init__(self, bot, users, moves, think, ramp, workers, queue_size, seed):
+        from telebot import types
+        from webhook import OrderedWorkerPool
+        self.types = types
+        self.think = think
+        self.rng = random.Random(seed)
+        self.scripts = {
+            user_id: player_script(user_id, moves, random.Random(f"{seed}:{user_id}"))
+            for user_id in range(1, users + 1)
+        }
+        self.handler_latency = defaultdict(list)
+        self.total_latency = defaultdict(list)
+        self.failed = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self._current = threading.local()
+        self.bot = bot
+        self._due = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._finished = threading.Event()
+        self._active = users
+        self.pool = OrderedWorkerPool(self._handle, workers, queue_size)
+        self._count_api_calls()
+        for user_id in self.scripts:
+            self._schedule(user_id, monotonic() + self.rng.uniform(0, ramp))
+
+    def _count_api_calls(self):
+        """Attribute every Bot API request to the kind of update whose handler made it"""
+        from telebot import apihelper
+        make_request = apihelper._make_request
+        test = self
+
+        def counted(*args, **kwargs):
+            kind = getattr(test._current, "kind", None)
+            if kind is not None:
+                with test._lock:
+                    test.api_calls[kind] += 1
+            return make_request(*args, **kwargs)
+
+        apihelper._make_request = counted
+
+    def _schedule(self, user_id, due):
+        press = next(self.scripts[user_id], None)
+        with self._lock:
+            if press is None:
+                self._active -= 1
+                if not self._active:
+                    self._finished.set()
+                return
+            heapq.heappush(self._due, (due, user_id, press))
+        self._wake.set()
+
+    def _handle(self, item):
+        due, user_id, (kind, update) = item
+        self._current.kind = kind
+        started = monotonic()
+        failed = False
+        try:
+            self.bot.process_new_updates([self.types.Update.de_json(update)])
+        except Exception:
+            # 429s and other API errors surface here, the handlers don't retry them
+            failed = True
+        done = monotonic()
+        with self._lock:
+            self.failed[kind] += failed
+            self.handler_latency[kind].append(done - started)
+            self.total_latency[kind].append(done - due)
+            think = self.rng.expovariate(1 / self.think) if self.think else 0
+        self._schedule(user_id, done + think)
+
+    def run(self):
+        """Submit presses as they come due until every player finished"""
+        while not self._finished.is_set():
+            with self._lock:
+                ready = []
+                now = monotonic()
+                while self._due and self._due[0][0] <= now:
+                    ready.append(heapq.heappop(self._due))
+                wait = self._due[0][0] - now if self._due else 0.1
+            for item in ready:
+                while not self.pool.submit(item[1], item):
+                    sleep(0.01)
+            if not ready:
+                self._wake.wait(min(wait, 0.1))
+                self._wake.clear()
+        self.pool.drain()
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+    return pick(0.5), pick(0.95), pick(0.99)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test handlers.py against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--moves", type=int, default=30, help="moves per player before ending the game")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between a player's presses")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which players join")
+    parser.add_argument("--workers", type=int, default=16, help="handler threads")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake API takes per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=2048)
+    args = parser.parse_args()
+
+    os.environ["TOKEN"] = FAKE_TOKEN
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))
+    fake = FakeTelegram(latency=args.latency, error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed).start()
+    fake.point_bot_here()
+    from database import init_db
+    from handlers import bot, game_state
+    from verify import score_verifier
+    from writer import db_writer
+    init_db()
+    bot.threaded = False
+    rss_before = peak_rss_mb()
+
+    test = LoadTest(bot, args.users, args.moves, args.think, args.ramp, args.workers, args.queue_size, args.seed)
+    started = monotonic()
+    test.run()
+    elapsed = monotonic() - started
+    game_state.close()
+    score_verifier.close()
+    db_writer.close()
+    fake.stop()
+
+    handled = sum(len(values) for values in test.handler_latency.values())
+    print(f"{args.users} players, {handled} updates in {elapsed:.1f}s ({handled / elapsed:.0f} updates/s)")
+    print(f"{'update':<8} {'count':>7} {'failed':>7} {'handler p50/p95/p99 ms':>24} {'with queueing p50/p95/p99 ms':>30}")
+    for kind in ("start", "menu", "level", "move", "end", "confirm"):
+        handler = "/".join(f"{value:.0f}" for value in percentiles(test.handler_latency[kind]))
+        total = "/".join(f"{value:.0f}" for value in percentiles(test.total_latency[kind]))
+        print(f"{kind:<8} {len(test.handler_latency[kind]):>7} {test.failed[kind]:>7} {handler:>24} {total:>30}")
+    print(f"API calls: {dict(fake.counts)}, 429s: {sum(fake.errors.values())}")
+    calls = ", ".join(
+        f"{kind} {test.api_calls[kind] / len(test.handler_latency[kind]):.2f}"
+        for kind in ("start", "menu", "level", "move", "end", "confirm") if test.handler_latency[kind]
+    )
+    print(f"API calls per update: {calls}")
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB ({peak_rss_mb() - rss_before:+.0f} MB during the run)")
+
+if __name__ == "__main__":
+    main()
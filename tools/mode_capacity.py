@@ -0,0 +1,136 @@
+"""Compare how many players the threaded and the async mode serve against a slow fake Bot API
+
+Every player presses a button, waits for the bot to answer it and presses again. A level of
+concurrent players counts as sustained while the 95th percentile press takes at most --target seconds.
+
+Run with: python -m tools.mode_capacity --players 10,50,100,200 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+from time import monotonic
+from tools.fake_telegram import FakeTelegram, FAKE_TOKEN, callback_update
+
+
+class TrackingTelegram(FakeTelegram):
+    """Fake Bot API that wakes whoever waits for a callback query to be answered"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.answered = {}
+        self._answered_lock = threading.Lock()
+
+    def expect(self, query_id):
+        event = threading.Event()
+        with self._answered_lock:
+            self.answered[query_id] = event
+        return event
+
+    def respond(self, method, params):
+        result = super().respond(method, params)
+        if method == "answerCallbackQuery":
+            with self._answered_lock:
+                event = self.answered.pop(params.get("callback_query_id"), None)
+            if event is not None:
+                event.set()
+        return result
+
+
+def presses(user_id, moves, seed):
+    """Callback data a player sends: pick the easy level, then random directions"""
+    from callbacks import encode, EASY, UP, DOWN, LEFT, RIGHT
+    rng = random.Random(seed)
+    return [encode(EASY)] + [encode(rng.choice((UP, DOWN, LEFT, RIGHT)), user_id) for _ in range(moves)]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run_threaded(fake, players, moves, first_user):
+    """Feed presses to the TeleBot of handlers.py the way polling does and time each answer"""
+    from telebot import types
+    from handlers import bot
+    latencies = []
+    lock = threading.Lock()
+
+    def play(user_id):
+        for seq, data in enumerate(presses(user_id, moves, user_id)):
+            query_id = f"{user_id}:{seq}"
+            answered = fake.expect(query_id)
+            started = monotonic()
+            update = callback_update(user_id * 1000 + seq, user_id, data, query_id=query_id)
+            bot.process_new_updates([types.Update.de_json(update)])
+            answered.wait()
+            with lock:
+                latencies.append(monotonic() - started)
+
+    threads = [threading.Thread(target=play, args=(first_user + i,)) for i in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def run_async(players, moves, first_user):
+    """Feed presses to the AsyncTeleBot of async_bot.py and time each one"""
+    from telebot import types
+    from async_bot import bot
+
+    async def play(user_id, latencies):
+        for seq, data in enumerate(presses(user_id, moves, user_id)):
+            started = monotonic()
+            update = callback_update(user_id * 1000 + seq, user_id, data, query_id=f"{user_id}:{seq}")
+            await bot.process_new_updates([types.Update.de_json(update)])
+            latencies.append(monotonic() - started)
+
+    async def main():
+        latencies = []
+        await asyncio.gather(*(play(first_user + i, latencies) for i in range(players)))
+        await bot.close_session()
+        return latencies
+
+    return asyncio.run(main())
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent game sessions each serving mode sustains")
+    parser.add_argument("--players", default="10,50,100,200", help="comma separated concurrency levels")
+    parser.add_argument("--moves", type=int, default=20, help="moves per player")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake API takes per call")
+    parser.add_argument("--target", type=float, default=1.0, help="p95 seconds per press still counted as sustained")
+    args = parser.parse_args()
+
+    os.environ["TOKEN"] = FAKE_TOKEN
+    os.chdir(tempfile.mkdtemp(prefix="mode-capacity-"))
+    fake = TrackingTelegram(latency=args.latency).start()
+    fake.point_bot_here()
+    from database import init_db
+    init_db()
+
+    sustained = {"threaded": 0, "async": 0}
+    first_user = 1
+    print(f"{'mode':<9} {'players':>7} {'presses/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for players in map(int, args.players.split(",")):
+        for mode in ("threaded", "async"):
+            started = monotonic()
+            if mode == "threaded":
+                latencies = run_threaded(fake, players, args.moves, first_user)
+            else:
+                latencies = run_async(players, args.moves, first_user)
+            elapsed = monotonic() - started
+            first_user += players
+            p95 = percentile(latencies, 0.95)
+            if p95 <= args.target:
+                sustained[mode] = max(sustained[mode], players)
+            print(
+                f"{mode:<9} {players:>7} {len(latencies) / elapsed:>10.1f} "
+                f"{percentile(latencies, 0.5) * 1000:>8.0f} {p95 * 1000:>8.0f}"
+            )
+    fake.stop()
+    for mode, players in sustained.items():
+        print(f"{mode} mode sustained {players} concurrent players with p95 under {args.target}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Bytes a game message edit sends in the button and the text render mode
+
+Counts the message text and keyboard JSON, and the form-encoded body telebot posts to
+editMessageText, for each board size from an early game to a crowded board.
+
+Run with: python -m tools.payload_size
+"""
+import argparse
+import random
+from urllib.parse import urlencode
+from render import game_message
+
+SIZES = (5, 7, 9)
+FILLS = (0.25, 0.5, 0.9)
+# A typical Telegram user id, its base 36 token goes into every control button
+USER_ID = 123456789
+STATUS = "بازی ادامه داره!\nامتیاز: 1024 | زمان: 1234 ثانیه"
+
+
+def make_board(size, fill, seed=2048):
+    rng = random.Random(f"{seed}:{size}:{fill}")
+    board = [[0] * size for _ in range(size)]
+    for cell in rng.sample(range(size * size), round(size * size * fill)):
+        board[cell // size][cell % size] = 1 << rng.randint(1, 11)
+    return board
+
+def payload(board, text_mode):
+    """(text + keyboard bytes, form-encoded request body bytes) of one edit"""
+    message = game_message(board, USER_ID, STATUS, text_mode)
+    markup = message["reply_markup"].to_json()
+    params = {"chat_id": USER_ID, "message_id": 100, "text": message["text"], "reply_markup": markup}
+    if "parse_mode" in message:
+        params["parse_mode"] = message["parse_mode"]
+    return len(message["text"].encode()) + len(markup.encode()), len(urlencode(params))
+
+def main():
+    argparse.ArgumentParser(description="Compare game message sizes of the two render modes").parse_args()
+    print(f"{'board':<12} {'buttons':>16} {'text':>16} {'saved':>7}")
+    print(f"{'':<12} {'payload / body':>16} {'payload / body':>16}")
+    for size in SIZES:
+        for fill in FILLS:
+            board = make_board(size, fill)
+            buttons, text = payload(board, False), payload(board, True)
+            print(
+                f"{size}x{size}@{fill:<6} {buttons[0]:>7} / {buttons[1]:>6} {text[0]:>7} / {text[1]:>6} "
+                f"{1 - text[1] / buttons[1]:>7.0%}"
+            )
+
+if __name__ == "__main__":
+    main()
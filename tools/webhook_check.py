@@ -0,0 +1,102 @@
+"""Post updates to the webhook server with handlers.py behind it and a fake Bot API in front
+
+Run with: python -m tools.webhook_check --users 50 --moves 40
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import urllib.request
+from urllib.error import HTTPError
+from time import sleep, monotonic
+from tools.fake_telegram import FakeTelegram, FAKE_TOKEN, message_update, callback_update
+
+SECRET = "webhook-check"
+
+
+def post(url, update):
+    """POST one update like Telegram does, return the HTTP status"""
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode(), method="POST",
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+def play(url, user_id, moves, seed, stats):
+    """Send /start, pick a level and press random directions, retrying on 503 like Telegram"""
+    from callbacks import encode, SHOW_LEVELS, EASY, UP, DOWN, LEFT, RIGHT
+    rng = random.Random(seed)
+    updates = [message_update(user_id * 1000, user_id, "/start")]
+    presses = [encode(SHOW_LEVELS), encode(EASY)]
+    presses += [encode(rng.choice((UP, DOWN, LEFT, RIGHT)), user_id) for _ in range(moves)]
+    for seq, data in enumerate(presses):
+        updates.append(callback_update(user_id * 1000 + seq + 1, user_id, data, query_id=f"{user_id}:{seq}"))
+    for update in updates:
+        while True:
+            status = post(url, update)
+            if status == 200:
+                break
+            with stats["lock"]:
+                stats["rejected"] += 1
+            sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check per-user ordering and draining of the webhook mode")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--moves", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8, help="small on purpose, to exercise backpressure")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds the fake API takes per call")
+    args = parser.parse_args()
+
+    os.environ["TOKEN"] = FAKE_TOKEN
+    os.chdir(tempfile.mkdtemp(prefix="webhook-check-"))
+    fake = FakeTelegram(latency=args.latency).start()
+    fake.point_bot_here()
+
+    from database import init_db
+    from handlers import bot
+    from webhook import create_webhook
+    init_db()
+    server, pool = create_webhook(bot, "127.0.0.1", 0, "/webhook", SECRET, args.workers, args.queue_size)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}/webhook"
+
+    stats = {"lock": threading.Lock(), "rejected": 0}
+    started = monotonic()
+    players = [
+        threading.Thread(target=play, args=(url, user_id, args.moves, user_id, stats))
+        for user_id in range(1, args.users + 1)
+    ]
+    for player in players:
+        player.start()
+    for player in players:
+        player.join()
+    server.stop()
+    pool.drain()
+    elapsed = monotonic() - started
+
+    answered = {}
+    for params in fake.calls_of("answerCallbackQuery"):
+        user_id, seq = map(int, params["callback_query_id"].split(":"))
+        seen = answered.setdefault(user_id, [])
+        if not seen or seen[-1] != seq:
+            seen.append(seq)
+    expected = list(range(args.moves + 2))
+    broken = [user_id for user_id in range(1, args.users + 1) if answered.get(user_id) != expected]
+    total = args.users * (args.moves + 3)
+    print(f"{total} updates in {elapsed:.2f}s ({total / elapsed:.0f}/s), {stats['rejected']} rejected with 503 and retried")
+    print(f"API calls: {dict(fake.counts)}")
+    fake.stop()
+    if broken:
+        raise SystemExit(f"Updates of {len(broken)} users were lost or reordered, e.g. user {broken[0]}: {answered.get(broken[0])}")
+    print(f"All {args.users} users had every update processed in order")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
-from time import time
 from datetime import datetime
 from pytz import timezone
 from config import logger
+from ratelimit import create_rate_limiter
 
-message_tracker = {}
+rate_limiter = create_rate_limiter()
 bot_start_time = datetime.now(timezone('Asia/Tehran')).timestamp()
 
 def is_message_valid(message):
@@ -15,19 +15,16 @@ def is_message_valid(message):
         return False
     return True
 
+def to_persian_digits(value):
+    """Write a number with Persian digits"""
+    return str(value).translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹"))
+
 def check_rate_limit(user_id):
     """Limit message rate per user"""
-    current_time = time()
-    if user_id not in message_tracker:
-        message_tracker[user_id] = {'count': 0, 'last_time': current_time, 'temp_block_until': 0}
-    if current_time < message_tracker[user_id]['temp_block_until']:
-        remaining = int(message_tracker[user_id]['temp_block_until'] - current_time)
-        return False, f"شما به دلیل ارسال پیام زیاد تا {remaining} ثانیه نمی‌تونید پیام بفرستید 😕"
-    if current_time - message_tracker[user_id]['last_time'] > 1:
-        message_tracker[user_id]['count'] = 0
-        message_tracker[user_id]['last_time'] = current_time
-    message_tracker[user_id]['count'] += 1
-    if message_tracker[user_id]['count'] > 2:
-        message_tracker[user_id]['temp_block_until'] = current_time + 30
-        return False, "شما بیش از حد پیام فرستادید! تا ۳۰ ثانیه نمی‌تونید پیام بفرستید 😕"
-    return True, ""
+    allowed, just_blocked, remaining = rate_limiter.hit(user_id)
+    if allowed:
+        return True, ""
+    if just_blocked:
+        block = to_persian_digits(int(rate_limiter.policy.block))
+        return False, f"شما بیش از حد پیام فرستادید! تا {block} ثانیه نمی‌تونید پیام بفرستید 😕"
+    return False, f"شما به دلیل ارسال پیام زیاد تا {int(remaining)} ثانیه نمی‌تونید پیام بفرستید 😕"
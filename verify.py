@@ -0,0 +1,168 @@
+"""Replay seeded games from their 2-bit move logs to check scores before they reach the leaderboard
+
+Run with: python verify.py   (replays every stored game log and reports the ones that don't match)
+"""
+import argparse
+import random
+import threading
+from collections import namedtuple
+from time import time, perf_counter
+from bitboard import init_board, add_random_tile, get_score, move_up, move_down, move_left, move_right
+from config import logger
+from database import db, init_db
+from metrics import SCORES_REJECTED
+from writer import db_writer
+
+# Same order as game.MOVES, so a code means the same move on both engines
+BIT_MOVES = (move_up, move_down, move_left, move_right)
+WINNING_SCORE = 2048
+
+FinishedGame = namedtuple(
+    "FinishedGame", "user_id name size seed moves move_count score time finished_at"
+)
+
+
+class InvalidMoveLog(Exception):
+    """A move log that the bot could not have written"""
+
+
+def append_move(log, count, code):
+    """Append a 2-bit move code to a bytearray log holding `count` moves, four per byte"""
+    if count % 4 == 0:
+        log.append(code)
+    else:
+        log[-1] |= code << (2 * (count % 4))
+
+def iter_moves(log, count):
+    """Yield the first `count` move codes of a log"""
+    for k in range(count):
+        yield (log[k >> 2] >> (2 * (k & 3))) & 3
+
+def replay(size, seed, log, count):
+    """Play a logged game again from its seed, return the final BitBoard and the RNG in its state"""
+    if len(log) != (count + 3) // 4:
+        raise InvalidMoveLog(f"{len(log)} bytes can't hold {count} moves")
+    rng = random.Random(seed)
+    board = init_board(size, rng)
+    for k, code in enumerate(iter_moves(log, count)):
+        # Tiles only grow, so checking the board before the last move catches play after a win
+        if k == count - 1 and get_score(board) >= WINNING_SCORE:
+            raise InvalidMoveLog("Moves go on after the game was won")
+        if not BIT_MOVES[code](board):
+            raise InvalidMoveLog(f"Move {k} doesn't change the board")
+        add_random_tile(board, rng)
+    return board, rng
+
+def verify_game(game):
+    """True if the log replays to the claimed score, None for games started before logs existed"""
+    if game.seed is None:
+        return None
+    try:
+        board, _ = replay(game.size, game.seed, game.moves, game.move_count)
+    except (InvalidMoveLog, IndexError) as e:
+        logger.warning(f"Rejected game of user {game.user_id}: {e}")
+        return False
+    score = get_score(board)
+    if score != game.score:
+        logger.warning(f"Rejected game of user {game.user_id}: claims {game.score}, replays to {score}")
+        return False
+    return True
+
+
+class ScoreVerifier:
+    """Replay finished games on a background thread, then queue them on the database writer
+
+    Every game that finished while the previous batch was being verified goes into the next one.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="score-verifier", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, name, session, elapsed):
+        """Queue a finished game, its score is saved once its move log replays to it"""
+        game = FinishedGame(
+            int(user_id), name, session.size, session.seed, bytes(session.moves), session.move_count,
+            session.score, elapsed, time(),
+        )
+        with self._lock:
+            self._queue.append(game)
+        self._wake.set()
+
+    def flush(self):
+        """Verify every queued game and hand it to the database writer, return how many"""
+        with self._lock:
+            games, self._queue = self._queue, []
+        for game in games:
+            try:
+                verified = verify_game(game)
+            except Exception:
+                # A log this code can't read is rejected like a bad one, the rest of the batch goes on
+                logger.exception(f"Failed to verify game of user {game.user_id}, rejecting its score")
+                verified = False
+            if verified is False:
+                SCORES_REJECTED.inc()
+            db_writer.save_game(game, verified)
+        return len(games)
+
+    def _loop(self):
+        while not self._closed.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Dying here would leave every later game queued until shutdown
+                logger.exception("Score verifier flush failed")
+
+    def close(self):
+        """Stop the thread and verify whatever is still queued, before db_writer.close()"""
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+
+# Every process ending games sends them through this one
+score_verifier = ScoreVerifier()
+
+
+def audit(batch_size):
+    """Replay every stored game log in id order, yield (game id, verified) per game"""
+    last_id = 0
+    while True:
+        rows = db.connection().execute("""
+        SELECT id, user_id, name, size, seed, moves, move_count, score, time, finished_at
+        FROM game_logs WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        for game_id, *row in rows:
+            yield game_id, verify_game(FinishedGame(*row))
+        last_id = rows[-1][0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay every stored game log and check its score")
+    parser.add_argument("--batch-size", type=int, default=1000, help="logs read per query")
+    args = parser.parse_args()
+
+    init_db()
+    started = perf_counter()
+    counts = {True: 0, False: 0, None: 0}
+    for game_id, verified in audit(args.batch_size):
+        counts[verified] += 1
+        if verified is False:
+            print(f"Game {game_id} doesn't replay to its score")
+    elapsed = perf_counter() - started
+    total = sum(counts.values())
+    print(
+        f"Replayed {total} games in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} games/s): "
+        f"{counts[True]} verified, {counts[False]} rejected, {counts[None]} without a log"
+    )
+
+if __name__ == "__main__":
+    main()
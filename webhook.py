@@ -0,0 +1,146 @@
+import json
+import queue
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from telebot import types
+from config import (
+    logger, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_TIMEOUT,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_STOP = object()
+
+
+def update_user_id(update):
+    """Return the id of the user an update comes from, 0 when it has none"""
+    for key in ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result", "my_chat_member"):
+        sender = update.get(key, {}).get("from")
+        if sender:
+            return sender["id"]
+    return 0
+
+
+class OrderedWorkerPool:
+    """Run each user's updates in order on one worker, different users in parallel"""
+
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.handle = handle
+        self.queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"update-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, user_id, update, timeout=WEBHOOK_QUEUE_TIMEOUT):
+        """Queue an update on its user's worker, return False if that queue stays full"""
+        try:
+            self.queues[user_id % len(self.queues)].put(update, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self, updates):
+        while True:
+            update = updates.get()
+            if update is _STOP:
+                return
+            try:
+                self.handle(update)
+            except Exception as e:
+                logger.error(f"Failed to process update {update.get('update_id')}: {e}")
+
+    def drain(self):
+        """Finish every queued update, then stop the workers"""
+        for updates in self.queues:
+            updates.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def backlog(self):
+        return [updates.qsize() for updates in self.queues]
+
+
+class WebhookHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts of updates open many connections at once, the default backlog of 5 resets them
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """Minimal HTTP server that accepts Telegram webhook POSTs"""
+
+    def __init__(self, submit, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != path or (secret and self.headers.get(SECRET_HEADER) != secret):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                try:
+                    update = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                # A non-2xx answer makes Telegram deliver the update again later
+                self.send_response(200 if server.submit(update) else 503)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook {self.address_string()} {format % args}")
+
+        self.submit = submit
+        self.httpd = WebhookHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="webhook-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop accepting updates, requests already read are still answered"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def create_webhook(bot, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                   workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+    """Build the worker pool and HTTP server that feed updates to the bot's handlers"""
+    # Workers run the handlers themselves, telebot's own thread pool would break the ordering
+    bot.threaded = False
+    pool = OrderedWorkerPool(lambda update: bot.process_new_updates([types.Update.de_json(update)]), workers, queue_size)
+
+    def submit(update):
+        accepted = pool.submit(update_user_id(update), update)
+        if not accepted:
+            logger.warning(f"Update queues are full, asking Telegram to retry update {update.get('update_id')}")
+        return accepted
+
+    return WebhookServer(submit, host, port, path, secret), pool
+
+def run_webhook(bot):
+    """Serve updates over a webhook until SIGINT or SIGTERM, then drain the queues"""
+    server, pool = create_webhook(bot)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    server.start()
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None, max_connections=WEBHOOK_WORKERS * 5)
+    logger.info(f"Webhook listening on {WEBHOOK_LISTEN}:{server.port}{WEBHOOK_PATH} with {WEBHOOK_WORKERS} workers")
+    stop.wait()
+    logger.info("Stopping webhook, finishing queued updates...")
+    server.stop()
+    pool.drain()
@@ -0,0 +1,132 @@
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from config import logger, WRITE_FLUSH_INTERVAL, KNOWN_USERS_MAX, LEADERBOARD_COALESCE
+from database import save_batch
+from metrics import PENDING_WRITES
+
+COALESCE_POLICIES = ("last", "max")
+
+
+class WriteBehindWriter:
+    """Queue user, game and leaderboard writes in memory and save them in one transaction per interval
+
+    Users saved or queued before are remembered, so a repeated /start doesn't reach SQLite at all.
+    Leaderboard entries of one user coalesce until the next flush: on a level's board the best one
+    wins, on the all-sizes board the newest, or the best one with the "max" policy.
+    """
+
+    def __init__(self, flush_interval=WRITE_FLUSH_INTERVAL, coalesce=LEADERBOARD_COALESCE, known_users=KNOWN_USERS_MAX, manager=None):
+        if coalesce not in COALESCE_POLICIES:
+            raise ValueError(f"Unknown leaderboard coalesce policy: {coalesce}")
+        self.flush_interval = flush_interval
+        self.keep_best = coalesce == "max"
+        # ConnectionManager written to, the process-wide one when None
+        self.manager = manager
+        self.known_users = known_users
+        # Least recently seen first
+        self._known = OrderedDict()
+        self._users = {}
+        self._games = []
+        self._level_entries = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._users) + len(self._games) + len(self._level_entries) + len(self._entries)
+
+    def save_user(self, user_id, username):
+        """Queue a user unless it was saved before, return whether it was queued"""
+        with self._lock:
+            if user_id in self._known:
+                self._known.move_to_end(user_id)
+                return False
+            self._known[user_id] = None
+            if len(self._known) > self.known_users:
+                self._known.popitem(last=False)
+            self._users[user_id] = username if username else "ندارد"
+            return True
+
+    def save_leaderboard_entry(self, user_id, name, score, time_value, size):
+        """Queue a leaderboard entry, coalesced with the user's queued one of the same size"""
+        with self._lock:
+            self._add_entry((user_id, name, score, time_value, size))
+
+    def save_game(self, game, verified):
+        """Queue a finished game's log row, its score too unless verification rejected it"""
+        with self._lock:
+            self._games.append((*game, verified))
+            if verified is not False:
+                self._add_entry((game.user_id, game.name, game.score, game.time, game.size))
+
+    def _add_entry(self, entry):
+        self._add_level(entry)
+        self._add_overall(entry[0], entry[:4])
+
+    def _add_level(self, entry):
+        key = (entry[0], entry[4])
+        queued = self._level_entries.get(key)
+        if queued is None or (-entry[2], entry[3]) < (-queued[2], queued[3]):
+            self._level_entries[key] = entry
+
+    def _add_overall(self, user_id, entry):
+        queued = self._entries.get(user_id)
+        # An older entry survives only under "max" and only if it's better
+        if queued is not None and self.keep_best and (-queued[2], queued[3]) <= (-entry[2], entry[3]):
+            return
+        self._entries[user_id] = entry
+
+    def flush(self):
+        """Write everything queued in one transaction, return how many writes it held"""
+        with self._lock:
+            users, self._users = self._users, {}
+            games, self._games = self._games, []
+            level_entries, self._level_entries = self._level_entries, {}
+            entries, self._entries = self._entries, {}
+        if not (users or games or level_entries or entries):
+            return 0
+        scores = len(level_entries) + len(entries)
+        try:
+            save_batch(
+                list(users.items()), games, list(level_entries.values()), list(entries.values()), self.keep_best, self.manager
+            )
+        except sqlite3.Error as e:
+            # Put the batch back so the next flush retries it, newer writes win
+            with self._lock:
+                for user_id, username in users.items():
+                    self._users.setdefault(user_id, username)
+                self._games[:0] = games
+                for entry in level_entries.values():
+                    self._add_level(entry)
+                for user_id, entry in entries.items():
+                    newer = self._entries.pop(user_id, None)
+                    self._entries[user_id] = entry
+                    if newer is not None:
+                        self._add_overall(user_id, newer)
+            logger.error(f"Failed to write {len(users)} users, {len(games)} games and {scores} scores: {e}")
+            return 0
+        logger.debug(f"Wrote {len(users)} users, {len(games)} games and {scores} scores")
+        return len(users) + len(games) + scores
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the writer thread and write whatever is still queued, safe to call twice"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+
+# Every handler of this process writes through this one
+db_writer = WriteBehindWriter()
+PENDING_WRITES.set_function(lambda: len(db_writer))
+# Entry points close it before close_db(), this catches exits that skip their cleanup
+atexit.register(db_writer.close)